@@ -0,0 +1,400 @@
+import io
+import json
+import os, sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import redirect_stdout
+from typing import Iterator, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from urdf_to_xacro import convert, load_config, modify_keys
+import profiler
+import build_cache
+
+"""
+Convert many URDF files to xacro in parallel, one process per core.
+
+examples:
+python3 batch.py -root robots_dir -cfg urdf_config.py -ml all
+python3 batch.py -root robots_dir -cfgd configs_dir -ml all
+python3 batch.py -manifest batch.json -j 8
+
+batch.json (relative paths are relative to the manifest):
+[
+    {"input": "robot_a/urdf/robot_a.urdf", "config": "urdf_config_robot_a/urdf_config.py", "modify_list": ["all"]},
+    {"input": "robot_b/urdf/robot_b.urdf", "output": "out/robot_b.xacro", "prefix": "prefix"}
+]
+"""
+
+
+def make_job(
+    input_path: str,
+    config_path: Optional[str] = None,
+    output_path: Optional[str] = None,
+    modify_list: List[str] = (),
+    prefix: str = "prefix",
+) -> dict:
+    return {
+        "input": input_path,
+        "config": config_path,
+        "output": output_path,
+        "modify_list": list(modify_list),
+        "prefix": prefix,
+    }
+
+
+def find_config(urdf_path: str, configs_dir: str) -> Optional[str]:
+    """Find `<configs_dir>/urdf_config_<name>/urdf_config.{toml,json,py}` for
+    `<name>.urdf`, preferring the declarative configs."""
+    name = os.path.splitext(os.path.basename(urdf_path))[0]
+    for ext in (".toml", ".json", ".py"):
+        config_path = os.path.join(
+            configs_dir, f"urdf_config_{name}", f"urdf_config{ext}"
+        )
+        if os.path.exists(config_path):
+            return config_path
+    return None
+
+
+def jobs_from_directory(
+    root_dir: str,
+    config_path: Optional[str] = None,
+    configs_dir: Optional[str] = None,
+    modify_list: List[str] = (),
+    prefix: str = "prefix",
+) -> List[dict]:
+    jobs = []
+    for root, dirs, files in os.walk(root_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if not name.endswith(".urdf"):
+                continue
+            urdf_path = os.path.join(root, name)
+            job_config = None
+            if configs_dir is not None:
+                job_config = find_config(urdf_path, configs_dir)
+            if job_config is None:
+                job_config = config_path
+            jobs.append(make_job(urdf_path, job_config, None, modify_list, prefix))
+    return jobs
+
+
+def jobs_from_manifest(manifest_path: str) -> List[dict]:
+    with open(manifest_path, "r", encoding="utf-8") as file:
+        entries: List[dict] = json.load(file)
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+
+    def resolve(path):
+        if path is None or os.path.isabs(path):
+            return path
+        return os.path.join(base_dir, path)
+
+    jobs = []
+    for entry in entries:
+        jobs.append(
+            make_job(
+                resolve(entry["input"]),
+                resolve(entry.get("config")),
+                resolve(entry.get("output")),
+                entry.get("modify_list", []),
+                entry.get("prefix", "prefix"),
+            )
+        )
+    return jobs
+
+
+@profiler.profiled("build_cache_check")
+def check_jobs(
+    jobs: List[dict], cache: "build_cache.BuildCache", force=False
+) -> List[dict]:
+    """Return the jobs whose output is missing or stale, with the reasons in
+    job["reasons"] and what they are built from in job["entry"]. A config is
+    loaded once for all its jobs."""
+    configs = {}
+    stale = []
+    for job in jobs:
+        if job["output"] is None:
+            job["output"] = job["input"].replace(".urdf", ".xacro")
+        try:
+            path = job["config"]
+            if path is not None and path not in configs:
+                with redirect_stdout(io.StringIO()):
+                    configs[path] = load_config(path)
+            keys = modify_keys(job["modify_list"])
+            entry = build_cache.build_entry(
+                job["input"],
+                configs.get(path),
+                keys,
+                job["prefix"],
+                cache.get(job["output"]),
+            )
+        except Exception as e:
+            # converting it reports the error
+            job["reasons"] = [f"check failed: {type(e).__name__}"]
+            stale.append(job)
+            continue
+        reasons = ["forced"] if force else cache.stale_reasons(job["output"], entry)
+        if reasons:
+            job["reasons"] = reasons
+            job["entry"] = entry
+            stale.append(job)
+    return stale
+
+
+def new_result(job: dict) -> dict:
+    result = {"input": job["input"], "output": None, "ok": False, "error": None}
+    if "reasons" in job:
+        result["reasons"] = job["reasons"]
+    return result
+
+
+def run_job(job: dict) -> dict:
+    """Convert one URDF file and never raise, so that a bad robot can not
+    abort the others. The printed log is captured in the result."""
+    result = new_result(job)
+    log = io.StringIO()
+    start = time.perf_counter()
+    try:
+        with redirect_stdout(log):
+            config = load_config(job["config"]) if job["config"] else None
+            result["output"] = convert(
+                job["input"],
+                job["output"],
+                config,
+                job["modify_list"],
+                job["prefix"],
+            )
+        result["ok"] = True
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+        log.write(traceback.format_exc())
+    result["seconds"] = time.perf_counter() - start
+    result["log"] = log.getvalue()
+    return result
+
+
+def failed_result(job: dict, error: Exception) -> dict:
+    result = new_result(job)
+    result["error"] = f"{type(error).__name__}: {error}"
+    result["seconds"] = 0.0
+    result["log"] = ""
+    return result
+
+
+# in a worker process, the queue of the indexes of the jobs it starts
+_started = None
+
+
+def _init_worker(started):
+    global _started
+    _started = started
+
+
+def _run_worker_job(index: int, job: dict) -> dict:
+    _started.put(index)
+    return run_job(job)
+
+
+def run_in_workers(jobs: List[dict], workers: int) -> Iterator[dict]:
+    """Run the jobs in `workers` processes and yield their results as they
+    complete. When a worker dies, e.g. killed when out of memory, the pool
+    is broken: the jobs that had started fail and the others are submitted
+    again to a new pool."""
+    import multiprocessing
+
+    pending = dict(enumerate(jobs))
+    while pending:
+        started = multiprocessing.SimpleQueue()
+        executor = ProcessPoolExecutor(
+            max_workers=min(workers, len(pending)),
+            initializer=_init_worker,
+            initargs=(started,),
+        )
+        broken = {}
+        try:
+            futures = {
+                executor.submit(_run_worker_job, index, job): index
+                for index, job in pending.items()
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    result = future.result()
+                except BrokenProcessPool as e:
+                    broken[index] = e
+                    continue
+                except Exception as e:
+                    result = failed_result(pending[index], e)
+                del pending[index]
+                yield result
+        finally:
+            executor.shutdown(cancel_futures=True)
+        indexes = set()
+        while not started.empty():
+            indexes.add(started.get())
+        # nothing started, e.g. the workers could not start: do not retry
+        failed = indexes & broken.keys() or broken.keys()
+        for index in sorted(failed):
+            yield failed_result(pending.pop(index), broken[index])
+        if pending:
+            print(f"A worker died, running the {len(pending)} jobs not started again")
+
+
+@profiler.profiled("batch")
+def run_batch(jobs: List[dict], workers: Optional[int] = None) -> List[dict]:
+    workers = os.cpu_count() if workers is None else workers
+    workers = max(1, min(workers, len(jobs)))
+    results = []
+    if workers == 1:
+        completed = map(run_job, jobs)
+    else:
+        completed = run_in_workers(jobs, workers)
+    try:
+        for index, result in enumerate(completed, 1):
+            status = "OK" if result["ok"] else "FAILED"
+            reasons = ""
+            if "reasons" in result:
+                reasons = f": {', '.join(result['reasons'])}"
+            print(
+                f"[{index}/{len(jobs)}] {status} {result['input']} "
+                f"({result['seconds']:.2f}s){reasons}"
+            )
+            if not result["ok"]:
+                print(f"    {result['error']}")
+                profiler.count("jobs_failed")
+            profiler.count("jobs")
+            results.append(result)
+    finally:
+        if workers > 1:
+            completed.close()
+    return results
+
+
+def summarize(results: List[dict], elapsed: float, skipped=0) -> dict:
+    failed = [result for result in results if not result["ok"]]
+    return {
+        "total": len(results) + skipped,
+        "up_to_date": skipped,
+        "succeeded": len(results) - len(failed),
+        "failed": len(failed),
+        "failed_inputs": [result["input"] for result in failed],
+        "seconds": elapsed,
+    }
+
+
+def main(argv=None):
+    import argparse
+    from urdf_to_xacro import MODIFY_CHOICES
+
+    parser = argparse.ArgumentParser(
+        description="Convert many URDF files to xacro in parallel"
+    )
+    parser.add_argument(
+        "-root",
+        "--root_dir",
+        type=str,
+        help="Directory searched recursively for .urdf files",
+        default=None,
+    )
+    parser.add_argument(
+        "-manifest",
+        "--manifest_path",
+        type=str,
+        help="Path to a .json file listing the conversions",
+        default=None,
+    )
+    parser.add_argument(
+        "-cfg",
+        "--config_file_path",
+        type=str,
+        help="Configuration .py file used for all the URDF files in --root_dir",
+        default=None,
+    )
+    parser.add_argument(
+        "-cfgd",
+        "--configs_dir",
+        type=str,
+        help="Directory containing urdf_config_<name>/urdf_config.{toml,json,py} for each <name>.urdf",
+        default=None,
+    )
+    parser.add_argument(
+        "-p",
+        "--prefix",
+        type=str,
+        help="The prefix to add to the joint and link names",
+        default="prefix",
+    )
+    parser.add_argument(
+        "-ml",
+        "--modify_list",
+        type=str,
+        nargs="*",
+        help="List of components to modify",
+        default=[],
+        choices=MODIFY_CHOICES,
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        help="Number of worker processes, defaults to the number of cores",
+        default=None,
+    )
+    parser.add_argument(
+        "-r",
+        "--report_path",
+        type=str,
+        help="Path to save the per-file results and the summary as .json",
+        default=None,
+    )
+    build_cache.add_arguments(parser)
+    profiler.add_arguments(parser)
+    args = parser.parse_args(argv)
+    profiler.enable_from_args(args)
+
+    assert (
+        args.root_dir is not None or args.manifest_path is not None
+    ), "Either --root_dir or --manifest_path is required"
+    if args.manifest_path is not None:
+        jobs = jobs_from_manifest(args.manifest_path)
+    else:
+        jobs = jobs_from_directory(
+            args.root_dir,
+            args.config_file_path,
+            args.configs_dir,
+            args.modify_list,
+            args.prefix,
+        )
+    print(f"Found {len(jobs)} URDF files")
+
+    start = time.perf_counter()
+    cache = build_cache.from_args(args)
+    stale = jobs if cache is None else check_jobs(jobs, cache, args.force)
+    if cache is not None:
+        print(f"{len(jobs) - len(stale)} up to date, {len(stale)} to convert")
+    results = run_batch(stale, args.workers) if stale else []
+    if cache is not None:
+        entries = {job["output"]: job.get("entry") for job in stale}
+        for result in results:
+            if result["ok"] and entries.get(result["output"]) is not None:
+                cache.record(result["output"], entries[result["output"]])
+        cache.save()
+    summary = summarize(
+        results, time.perf_counter() - start, len(jobs) - len(stale)
+    )
+    print(
+        f"Converted {summary['succeeded']}/{summary['total']} files "
+        f"({summary['up_to_date']} up to date), "
+        f"{summary['failed']} failed in {summary['seconds']:.2f}s"
+    )
+    if args.report_path is not None:
+        with open(args.report_path, "w", encoding="utf-8") as file:
+            json.dump({"summary": summary, "results": results}, file, indent=4)
+        print(f"Saved report to {args.report_path}")
+    sys.exit(1 if summary["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
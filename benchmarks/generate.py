@@ -0,0 +1,244 @@
+import json
+import os, sys
+import random
+from typing import Optional, Tuple
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+"""
+Generate synthetic robots to benchmark the tools: a URDF chain of N links
+and joints (plain or already wrapped in a xacro macro), the config matching
+it, binary STL meshes of a configurable size and a deep package tree to
+rename.
+
+examples:
+python3 benchmarks/generate.py -out /tmp/bench -n 1000 -m 20 -tri 50000
+python3 benchmarks/generate.py -out /tmp/bench -n 1000 --macro
+"""
+
+XACRO_NS = "http://wiki.ros.org/xacro"
+
+
+def link_xml(name, mesh_path, indent):
+    return (
+        f'{indent}<link name="{name}">\n'
+        f"{indent}  <inertial>\n"
+        f'{indent}    <origin xyz="0 0 0.05" rpy="0 0 0"/>\n'
+        f'{indent}    <mass value="1.0"/>\n'
+        f'{indent}    <inertia ixx="0.01" ixy="0" ixz="0" iyy="0.01" iyz="0" izz="0.01"/>\n'
+        f"{indent}  </inertial>\n"
+        f"{indent}  <visual>\n"
+        f'{indent}    <origin xyz="0 0 0" rpy="0 0 0"/>\n'
+        f"{indent}    <geometry>\n"
+        f'{indent}      <mesh filename="{mesh_path}"/>\n'
+        f"{indent}    </geometry>\n"
+        f"{indent}  </visual>\n"
+        f"{indent}  <collision>\n"
+        f'{indent}    <origin xyz="0 0 0" rpy="0 0 0"/>\n'
+        f"{indent}    <geometry>\n"
+        f'{indent}      <mesh filename="{mesh_path}"/>\n'
+        f"{indent}    </geometry>\n"
+        f"{indent}  </collision>\n"
+        f"{indent}</link>\n"
+    )
+
+
+def joint_xml(name, parent, child, indent):
+    return (
+        f'{indent}<joint name="{name}" type="revolute">\n'
+        f'{indent}  <origin xyz="0 0 0.1" rpy="0 0 0"/>\n'
+        f'{indent}  <parent link="{parent}"/>\n'
+        f'{indent}  <child link="{child}"/>\n'
+        f'{indent}  <axis xyz="0 0 1"/>\n'
+        f'{indent}  <limit lower="-1" upper="1" effort="1" velocity="1"/>\n'
+        f"{indent}</joint>\n"
+    )
+
+
+def generate_urdf(
+    path, links=100, macro=False, robot_name="bench", mesh_count=1, branching=1
+) -> dict:
+    """Write a robot of `links` links, each child of link (i - 1) // branching,
+    and return the config dict matching it."""
+    prefix = "${prefix}" if macro else ""
+    indent = "    " if macro else "  "
+    with open(path, "w", encoding="utf-8") as file:
+        file.write('<?xml version="1.0" encoding="utf-8"?>\n')
+        if macro:
+            file.write(f'<robot xmlns:xacro="{XACRO_NS}" name="{robot_name}">\n')
+            file.write(f'  <xacro:macro name="{robot_name}" params="prefix">\n')
+        else:
+            file.write(f'<robot name="{robot_name}">\n')
+        for i in range(links):
+            mesh = f"mesh_{i % max(mesh_count, 1)}.STL"
+            mesh_path = f"package://{robot_name}/meshes/{mesh}"
+            file.write(link_xml(f"{prefix}link{i}", mesh_path, indent))
+            if i > 0:
+                parent = f"{prefix}link{(i - 1) // branching}"
+                child = f"{prefix}link{i}"
+                file.write(joint_xml(f"{prefix}joint{i}", parent, child, indent))
+        if macro:
+            file.write("  </xacro:macro>\n")
+        file.write("</robot>\n")
+    rng = random.Random(links)
+    return {
+        "joints_limit": {
+            f"joint{i}": {
+                "lower": -rng.uniform(1, 3),
+                "upper": rng.uniform(1, 3),
+                "effort": rng.uniform(1, 20),
+                "velocity": rng.uniform(0.5, 2),
+            }
+            for i in range(1, links)
+        },
+        "links_inertial": {
+            f"link{i}": {
+                "mass": rng.uniform(0.1, 5),
+                "origin": {"xyz": "0 0 0.05"},
+                "inertia": {
+                    "ixx": 0.02,
+                    "ixy": 0,
+                    "ixz": 0,
+                    "iyy": 0.02,
+                    "iyz": 0,
+                    "izz": 0.02,
+                },
+            }
+            for i in range(links)
+        },
+    }
+
+
+def generate_mesh(path, triangles=10_000, seed=0):
+    """Write a binary STL of a noisy sphere with about `triangles` triangles."""
+    import numpy as np
+    from scipy.spatial import ConvexHull
+    from mesh_tools.mesh_io import write_binary_stl
+
+    rng = np.random.default_rng(seed)
+    points = rng.normal(size=(max(triangles // 2 + 2, 4), 3))
+    points /= np.linalg.norm(points, axis=1, keepdims=True)
+    hull = ConvexHull(points)
+    # push the vertices in and out once the faces are known, so that the hull
+    # simplification has something to drop
+    points *= rng.uniform(0.9, 1.0, size=(len(points), 1))
+    write_binary_stl(path, points * 0.05, hull.simplices)
+
+
+def generate_meshes(mesh_dir, count=10, triangles=10_000):
+    os.makedirs(mesh_dir, exist_ok=True)
+    for i in range(count):
+        generate_mesh(os.path.join(mesh_dir, f"mesh_{i}.STL"), triangles, seed=i)
+
+
+def generate_package(root_dir, name="bench", depth=4, width=3, files=5) -> int:
+    """Create a package tree with `name` in the directory names, file names
+    and contents, `width` sub directories per level down to `depth` levels.
+    Return the number of files written."""
+    count = 0
+
+    def fill(directory, level):
+        nonlocal count
+        os.makedirs(directory, exist_ok=True)
+        for i in range(files):
+            path = os.path.join(directory, f"{name}_file_{i}.txt")
+            with open(path, "w", encoding="utf-8") as file:
+                file.write(f"package {name} level {level}\n" * 20)
+            count += 1
+        if level < depth:
+            for i in range(width):
+                fill(os.path.join(directory, f"{name}_dir_{i}"), level + 1)
+
+    fill(os.path.join(root_dir, name), 0)
+    return count
+
+
+def generate_case(
+    output_dir,
+    links=100,
+    macro=False,
+    mesh_count=0,
+    triangles=10_000,
+    depth=0,
+    width=3,
+    files=5,
+    branching=1,
+) -> Tuple[str, str, Optional[str], Optional[str]]:
+    """Generate a whole case into `output_dir` and return the paths of the
+    URDF, of its config .json, of the meshes and of the package tree (None if
+    not generated)."""
+    os.makedirs(output_dir, exist_ok=True)
+    suffix = ".xacro" if macro else ".urdf"
+    urdf_path = os.path.join(output_dir, f"bench{suffix}")
+    config = generate_urdf(
+        urdf_path, links, macro, mesh_count=max(mesh_count, 1), branching=branching
+    )
+    config_path = os.path.join(output_dir, "bench_config.json")
+    with open(config_path, "w", encoding="utf-8") as file:
+        json.dump(config, file)
+    mesh_dir = None
+    if mesh_count > 0:
+        mesh_dir = os.path.join(output_dir, "meshes")
+        generate_meshes(mesh_dir, mesh_count, triangles)
+    package_dir = None
+    if depth > 0:
+        package_dir = os.path.join(output_dir, "package")
+        generate_package(package_dir, depth=depth, width=width, files=files)
+    return urdf_path, config_path, mesh_dir, package_dir
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate a synthetic robot")
+    parser.add_argument(
+        "-out", "--output_dir", type=str, help="Directory to generate into"
+    )
+    parser.add_argument(
+        "-n", "--links", type=int, help="Number of links", default=100
+    )
+    parser.add_argument(
+        "-b",
+        "--branching",
+        type=int,
+        help="Number of children per link, 1 for a serial chain",
+        default=1,
+    )
+    parser.add_argument(
+        "--macro", action="store_true", help="Wrap the robot in a xacro macro"
+    )
+    parser.add_argument(
+        "-m", "--meshes", type=int, help="Number of STL meshes", default=0
+    )
+    parser.add_argument(
+        "-tri",
+        "--triangles",
+        type=int,
+        help="Approximate number of triangles per mesh",
+        default=10_000,
+    )
+    parser.add_argument(
+        "-d", "--depth", type=int, help="Depth of the package tree", default=0
+    )
+    parser.add_argument(
+        "-w", "--width", type=int, help="Sub directories per level", default=3
+    )
+    parser.add_argument(
+        "-f", "--files", type=int, help="Files per directory", default=5
+    )
+    args = parser.parse_args()
+    paths = generate_case(
+        args.output_dir,
+        args.links,
+        args.macro,
+        args.meshes,
+        args.triangles,
+        args.depth,
+        args.width,
+        args.files,
+        args.branching,
+    )
+    for path in paths:
+        if path is not None:
+            print(f"Generated {path}")
@@ -0,0 +1,304 @@
+import contextlib
+import io
+import json
+import os, sys
+import platform
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from generate import ROOT_DIR, generate_case
+
+sys.path.insert(0, ROOT_DIR)
+import profiler
+import xml_format
+from rename import rename_all_items
+from urdf_to_xacro import URDFer
+
+"""
+Time each stage of the conversion on a synthetic robot and compare the
+results with a stored baseline.
+
+Every stage is timed `repeat` times on fresh copies of the inputs, then run
+once more under tracemalloc to record the peak memory it allocates. The
+results are written as JSON; with a baseline, the stages slower than the
+threshold are reported and the exit code is 1.
+
+examples:
+python3 benchmarks/run_benchmarks.py -n 2000 -m 10 -d 4 -out baseline.json
+python3 benchmarks/run_benchmarks.py -n 2000 -m 10 -d 4 -out new.json -base baseline.json
+"""
+
+STAGES = [
+    "parse",
+    "replace_joint_limits",
+    "replace_link_inertial",
+    "split_mesh_paths",
+    "to_xacro_style",
+    "save",
+    "format",
+    "rename",
+    "hull_simplification",
+]
+
+
+class Recorder(object):
+    """Record the duration, or the traced peak memory, of each stage."""
+
+    def __init__(self, trace=False) -> None:
+        self.trace = trace
+        self.seconds: Dict[str, float] = {}
+        self.peak: Dict[str, int] = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if self.trace:
+            tracemalloc.start()
+            try:
+                yield
+            finally:
+                current, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                self.peak[name] = peak
+            return
+        start = time.perf_counter()
+        yield
+        self.seconds[name] = time.perf_counter() - start
+
+
+def run_stages(
+    recorder: Recorder,
+    urdf_path,
+    config: dict,
+    work_dir,
+    mesh_dir: Optional[str] = None,
+    package_dir: Optional[str] = None,
+):
+    """Run all the stages once; the inputs that are modified in place are
+    copied into `work_dir` first, outside of the timings."""
+    output_path = os.path.join(work_dir, "bench_out.xacro")
+    with recorder.stage("parse"):
+        urdfer = URDFer(urdf_path)
+    with recorder.stage("replace_joint_limits"):
+        urdfer.replace_joint_limits(config["joints_limit"])
+    with recorder.stage("replace_link_inertial"):
+        urdfer.replace_link_inertial(config["links_inertial"])
+    with recorder.stage("split_mesh_paths"):
+        urdfer.split_mesh_paths(
+            "package://bench/meshes",
+            "package://bench/meshes/visual",
+            "package://bench/meshes",
+            "package://bench/meshes/collision",
+            False,
+        )
+    with recorder.stage("to_xacro_style"):
+        urdfer.to_xacro_style("prefix")
+    with recorder.stage("save"):
+        urdfer.save(output_path, pretty=False)
+    with recorder.stage("format"):
+        xml_format.format_file(output_path)
+
+    if package_dir is not None:
+        package_copy = os.path.join(work_dir, "package")
+        shutil.copytree(package_dir, package_copy)
+        with recorder.stage("rename"):
+            rename_all_items(package_copy, [("bench", "renamed")])
+        shutil.rmtree(package_copy)
+
+    if mesh_dir is not None:
+        # numpy, scipy and trimesh are only needed for this stage
+        from mesh_tools.simplify_meshes_scipy import process_stl_files
+
+        mesh_copy = os.path.join(work_dir, "meshes")
+        shutil.copytree(mesh_dir, mesh_copy)
+        with recorder.stage("hull_simplification"):
+            process_stl_files(mesh_copy)
+        shutil.rmtree(mesh_copy)
+    os.remove(output_path)
+
+
+def run_benchmarks(
+    case: dict, repeat=3, trace=True, verbose=False, work_dir=None
+) -> dict:
+    """Generate the case described by the keyword arguments of
+    `generate_case`, run the stages and return the results."""
+    base_dir = tempfile.mkdtemp(prefix="urdf2xacro_bench_", dir=work_dir)
+    try:
+        case_dir = os.path.join(base_dir, "case")
+        urdf_path, config_path, mesh_dir, package_dir = generate_case(case_dir, **case)
+        with open(config_path, "r", encoding="utf-8") as file:
+            config = json.load(file)
+        runs: List[Recorder] = [Recorder() for _ in range(repeat)]
+        if trace:
+            runs.append(Recorder(trace=True))
+        for recorder in runs:
+            run_dir = tempfile.mkdtemp(dir=base_dir)
+            # the tools print their progress, keep the report readable
+            output = sys.stdout if verbose else io.StringIO()
+            with contextlib.redirect_stdout(output):
+                run_stages(recorder, urdf_path, config, run_dir, mesh_dir, package_dir)
+            shutil.rmtree(run_dir)
+    finally:
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+    stages = {}
+    for name in STAGES:
+        seconds = [run.seconds[name] for run in runs if name in run.seconds]
+        if not seconds:
+            continue
+        stages[name] = {
+            "seconds": min(seconds),
+            "median": statistics.median(seconds),
+            "runs": seconds,
+        }
+        if trace:
+            stages[name]["peak_bytes"] = runs[-1].peak.get(name)
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "case": case,
+        "repeat": repeat,
+        "stages": stages,
+        "max_rss_bytes": profiler.max_rss_bytes(),
+    }
+
+
+def compare(results: dict, baseline: dict, threshold=0.1) -> List[str]:
+    """Print the stage timings next to the baseline ones and return the
+    names of the stages slower than the baseline by more than `threshold`."""
+    if results["case"] != baseline.get("case"):
+        print("Warning: the baseline was recorded with another case")
+    regressions = []
+    print(f"{'stage':<24}{'baseline (s)':>14}{'current (s)':>14}{'change':>10}")
+    for name, current in results["stages"].items():
+        old = baseline["stages"].get(name)
+        if old is None:
+            print(f"{name:<24}{'-':>14}{current['seconds']:>14.4f}{'new':>10}")
+            continue
+        change = current["seconds"] / old["seconds"] - 1 if old["seconds"] else 0.0
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = " <- slower"
+        print(
+            f"{name:<24}{old['seconds']:>14.4f}{current['seconds']:>14.4f}"
+            f"{change:>+10.1%}{flag}"
+        )
+    return regressions
+
+
+def print_results(results: dict):
+    print(f"{'stage':<24}{'best (s)':>12}{'median (s)':>12}{'peak (MB)':>12}")
+    for name, stage in results["stages"].items():
+        peak = stage.get("peak_bytes")
+        peak = "-" if peak is None else f"{peak / 1e6:.1f}"
+        print(
+            f"{name:<24}{stage['seconds']:>12.4f}{stage['median']:>12.4f}{peak:>12}"
+        )
+    print(f"Max RSS: {results['max_rss_bytes'] / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark the conversion stages on a synthetic robot"
+    )
+    parser.add_argument(
+        "-n", "--links", type=int, help="Number of links", default=1000
+    )
+    parser.add_argument(
+        "-b",
+        "--branching",
+        type=int,
+        help="Number of children per link, 1 for a serial chain",
+        default=1,
+    )
+    parser.add_argument(
+        "--macro",
+        action="store_true",
+        help="Start from a robot already wrapped in a xacro macro",
+    )
+    parser.add_argument(
+        "-m",
+        "--meshes",
+        type=int,
+        help="Number of STL meshes, 0 to skip the hull simplification",
+        default=0,
+    )
+    parser.add_argument(
+        "-tri",
+        "--triangles",
+        type=int,
+        help="Approximate number of triangles per mesh",
+        default=10_000,
+    )
+    parser.add_argument(
+        "-d",
+        "--depth",
+        type=int,
+        help="Depth of the package tree, 0 to skip the rename",
+        default=0,
+    )
+    parser.add_argument(
+        "-w", "--width", type=int, help="Sub directories per level", default=3
+    )
+    parser.add_argument(
+        "-f", "--files", type=int, help="Files per directory", default=5
+    )
+    parser.add_argument(
+        "-r", "--repeat", type=int, help="Timed runs per stage", default=3
+    )
+    parser.add_argument(
+        "--no_trace",
+        action="store_true",
+        help="Skip the tracemalloc run measuring the peak memory",
+    )
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="Show the output of the tools"
+    )
+    parser.add_argument(
+        "-out", "--output_path", type=str, help="Path to the results .json", default=None
+    )
+    parser.add_argument(
+        "-base",
+        "--baseline_path",
+        type=str,
+        help="Path to the results .json of a previous run to compare with",
+        default=None,
+    )
+    parser.add_argument(
+        "-th",
+        "--threshold",
+        type=float,
+        help="Relative slowdown reported as a regression",
+        default=0.1,
+    )
+    args = parser.parse_args()
+    case = {
+        "links": args.links,
+        "macro": args.macro,
+        "mesh_count": args.meshes,
+        "triangles": args.triangles,
+        "depth": args.depth,
+        "width": args.width,
+        "files": args.files,
+        "branching": args.branching,
+    }
+    results = run_benchmarks(case, args.repeat, not args.no_trace, args.verbose)
+    print_results(results)
+    if args.output_path is not None:
+        with open(args.output_path, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+        print(f"Results saved to {args.output_path}")
+    if args.baseline_path is not None:
+        with open(args.baseline_path, "r", encoding="utf-8") as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"Slower than the baseline: {', '.join(regressions)}")
+            sys.exit(1)
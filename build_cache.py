@@ -0,0 +1,254 @@
+import functools
+import hashlib
+import json
+import os, sys
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import profiler
+
+"""
+Manifest of the xacro files built by urdf_to_xacro.py and batch.py, so that
+an output whose inputs did not change is not converted again.
+
+Each output is recorded with the hashes of what it was built from: the input
+URDF file, the resolved CONFIG sections applied by the modify list (not the
+config file, so reformatting a config or editing a section that is not used
+rebuilds nothing), the prefix and modify list, and the tool version, which
+includes a hash of the converting modules. The output itself is hashed too,
+so an output edited or deleted by hand is rebuilt. The files are only read
+again when their size or modification time changed.
+
+The manifest is a .json file shared by all the outputs, in the user cache
+directory by default. It is written atomically; two processes updating it
+at the same time may lose the entries of one of them, which only causes
+these outputs to be rebuilt on the next run.
+
+examples:
+python3 build_cache.py -show
+python3 build_cache.py -manifest builds.json -show
+"""
+
+DEFAULT_MANIFEST_PATH = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "urdf2xacro",
+    "builds.json",
+)
+MANIFEST_VERSION = 1
+# the modules whose code changes the outputs
+TOOL_MODULES = ("urdf_to_xacro.py", "urdf_stream.py", "xml_format.py")
+
+
+@functools.lru_cache(maxsize=None)
+def tool_version() -> str:
+    from urdf2xacro import __version__
+
+    hasher = hashlib.sha256()
+    tool_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in TOOL_MODULES:
+        with open(os.path.join(tool_dir, name), "rb") as file:
+            hasher.update(file.read())
+    return f"{__version__}+{hasher.hexdigest()[:12]}"
+
+
+def file_hash(path) -> Optional[str]:
+    try:
+        with open(path, "rb") as file:
+            return hashlib.sha256(file.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def file_stat(path) -> Optional[list]:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def data_hash(data) -> str:
+    text = json.dumps(data, sort_keys=True, default=repr)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def config_hash(config: Optional[dict], keys: List[str]) -> str:
+    """Hash of the config sections applied."""
+    if config is None:
+        return data_hash(None)
+    return data_hash({key: config.get(key) for key in sorted(set(keys))})
+
+
+def build_entry(
+    input_path,
+    config: Optional[dict],
+    keys: List[str] = (),
+    prefix: str = "prefix",
+    previous: Optional[dict] = None,
+    stream=False,
+) -> dict:
+    """What an output is built from with the config sections `keys` (the
+    modify list with "all" expanded), reusing the input hash of the
+    `previous` entry when the input file looks unchanged. `stream` is part
+    of the options, the streamed output differs from the tree one."""
+    input_path = os.path.abspath(input_path)
+    stat = file_stat(input_path)
+    if previous is not None and stat is not None and previous.get("input_stat") == stat:
+        digest = previous["input_hash"]
+    else:
+        digest = file_hash(input_path)
+        profiler.count("build_cache_hashed_files")
+    return {
+        "input": input_path,
+        "input_stat": stat,
+        "input_hash": digest,
+        "config_hash": config_hash(config, keys),
+        "options_hash": data_hash(
+            {"modify_list": sorted(set(keys)), "prefix": prefix, "stream": stream}
+        ),
+        "tool_version": tool_version(),
+    }
+
+
+# entry key: reason to rebuild when it differs
+REASONS = {
+    "input": "input path changed",
+    "input_hash": "input changed",
+    "config_hash": "config changed",
+    "options_hash": "options changed",
+    "tool_version": "tool version changed",
+}
+
+
+class BuildCache(object):
+    def __init__(self, manifest_path=DEFAULT_MANIFEST_PATH) -> None:
+        self.manifest_path = manifest_path
+        self.entries: Dict[str, dict] = {}
+        self.changed = False
+        if os.path.exists(manifest_path):
+            try:
+                with open(manifest_path, "r", encoding="utf-8") as file:
+                    data = json.load(file)
+                if data.get("version") == MANIFEST_VERSION:
+                    self.entries = data["outputs"]
+            except (ValueError, KeyError, AttributeError):
+                print(f"Ignoring the invalid build manifest {manifest_path}")
+
+    def get(self, output_path) -> Optional[dict]:
+        return self.entries.get(os.path.abspath(output_path))
+
+    def stale_reasons(self, output_path, entry: dict) -> List[str]:
+        """Why the output must be built from `entry`, nothing if it is up to
+        date."""
+        previous = self.get(output_path)
+        if previous is None:
+            return ["not built yet"]
+        reasons = [
+            reason
+            for key, reason in REASONS.items()
+            if previous.get(key) != entry.get(key)
+        ]
+        if entry["input_hash"] is None:
+            reasons.append("input missing")
+        stat = file_stat(output_path)
+        if stat is None:
+            reasons.append("output missing")
+        elif stat != previous.get("output_stat"):
+            profiler.count("build_cache_hashed_files")
+            if file_hash(output_path) != previous.get("output_hash"):
+                reasons.append("output modified")
+            else:
+                # touched or copied, remember it to not hash it again
+                previous["output_stat"] = stat
+                self.changed = True
+        return reasons
+
+    def record(self, output_path, entry: dict):
+        """Remember that the output was just built from `entry`."""
+        output_path = os.path.abspath(output_path)
+        self.entries[output_path] = {
+            **entry,
+            "output_stat": file_stat(output_path),
+            "output_hash": file_hash(output_path),
+        }
+        self.changed = True
+
+    def save(self):
+        if not self.changed:
+            return
+        directory = os.path.dirname(os.path.abspath(self.manifest_path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(
+                {"version": MANIFEST_VERSION, "outputs": self.entries}, file, indent=1
+            )
+        os.replace(tmp_path, self.manifest_path)
+        self.changed = False
+
+
+def add_arguments(parser):
+    """Add the build cache options to an argparse parser."""
+    parser.add_argument(
+        "-bc",
+        "--build_cache",
+        type=str,
+        help=f"Path to the build manifest ({DEFAULT_MANIFEST_PATH} by default)",
+        default=DEFAULT_MANIFEST_PATH,
+    )
+    parser.add_argument(
+        "-nbc",
+        "--no_build_cache",
+        action="store_true",
+        help="Always convert, without reading or updating the build manifest",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Convert even the up-to-date outputs, and record them",
+    )
+
+
+def from_args(args) -> Optional[BuildCache]:
+    return None if args.no_build_cache else BuildCache(args.build_cache)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Show or clear the build manifest")
+    parser.add_argument(
+        "-manifest",
+        "--manifest_path",
+        type=str,
+        help=f"Path to the build manifest ({DEFAULT_MANIFEST_PATH} by default)",
+        default=DEFAULT_MANIFEST_PATH,
+    )
+    parser.add_argument(
+        "-show", "--show", action="store_true", help="List the recorded outputs"
+    )
+    parser.add_argument(
+        "-clear", "--clear", action="store_true", help="Forget all the outputs"
+    )
+    args = parser.parse_args(argv)
+
+    cache = BuildCache(args.manifest_path)
+    if args.show:
+        for output, entry in sorted(cache.entries.items()):
+            # the configs and options are only known when converting
+            current = {**entry, "tool_version": tool_version()}
+            if file_stat(entry["input"]) != entry["input_stat"]:
+                current["input_hash"] = file_hash(entry["input"])
+            reasons = cache.stale_reasons(output, current)
+            state = "up to date" if not reasons else ", ".join(reasons)
+            print(f"{output} <- {entry['input']} ({state})")
+    print(f"{len(cache.entries)} outputs recorded in {args.manifest_path}")
+    if args.clear:
+        cache.entries = {}
+        cache.changed = True
+        cache.save()
+        print("Cleared")
+
+
+if __name__ == "__main__":
+    main()
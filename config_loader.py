@@ -0,0 +1,385 @@
+import ast
+import hashlib
+import json
+import math
+import os, sys
+import pickle
+from typing import Dict, List, Optional, Tuple, Union
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import profiler
+
+"""
+Load declarative .json or .toml configs into the CONFIG dict used by
+urdf_to_xacro.py, without running any Python.
+
+Numbers can be written as expressions of constants (pi, e, tau, inf), of the
+[variables] of the file and of a few math functions, e.g. "pi / 2" or
+"max_effort * 0.5". The effort and velocity of a joint limit are optional,
+those of the URDF being kept. links_inertial is either a table or the path of
+a links_inertial.json file, relative to the config.
+
+The validated configs are pickled in a cache keyed by the path and hash of
+the config file, and reused as long as the files they depend on have the same hash, so
+loading one in a batch job costs a file hash and an unpickle.
+
+urdf_config.toml:
+[variables]
+max_effort = 12
+max_velocity = 0.5
+
+[joints_limit.joint1]
+lower = -2.7475
+upper = "pi"
+effort = "max_effort"
+velocity = "max_velocity"
+
+[joints_limit.joint2]  # continuous
+lower = "None"
+upper = "None"
+effort = "max_effort / 4"
+velocity = 1.0
+
+[config]
+links_inertial = "links_inertial.json"
+
+examples:
+python3 config_loader.py urdf_config_example/urdf_config.toml
+python3 config_loader.py urdf_config_example/urdf_config.toml -dump
+"""
+
+# change this when the parsed form of the configs changes
+CONFIG_CACHE_VERSION = b"config:2"
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "urdf2xacro",
+    "configs",
+)
+CONSTANTS = {
+    "pi": math.pi,
+    "e": math.e,
+    "tau": math.tau,
+    "inf": math.inf,
+    "None": None,
+}
+FUNCTIONS = {
+    "radians": math.radians,
+    "degrees": math.degrees,
+    "sqrt": math.sqrt,
+    "abs": abs,
+    "min": min,
+    "max": max,
+}
+JOINT_LIMIT_KEYS = ("lower", "upper", "effort", "velocity")
+# effort and velocity are left unchanged when not given
+REQUIRED_JOINT_LIMIT_KEYS = ("lower", "upper")
+INERTIA_KEYS = ("ixx", "ixy", "ixz", "iyy", "iyz", "izz")
+_BINARY_OPERATORS = {
+    ast.Add: lambda a, b: a + b,
+    ast.Sub: lambda a, b: a - b,
+    ast.Mult: lambda a, b: a * b,
+    ast.Div: lambda a, b: a / b,
+    ast.FloorDiv: lambda a, b: a // b,
+    ast.Mod: lambda a, b: a % b,
+    ast.Pow: lambda a, b: a**b,
+}
+_UNARY_OPERATORS = {ast.USub: lambda a: -a, ast.UAdd: lambda a: a}
+
+
+class ConfigError(ValueError):
+    pass
+
+
+def evaluate(
+    expression: str, variables: Dict[str, float], where=""
+) -> Optional[float]:
+    """Evaluate an arithmetic expression of numbers, constants, `variables`
+    and FUNCTIONS, nothing else."""
+
+    def visit(node):
+        if isinstance(node, ast.Expression):
+            return visit(node.body)
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            return node.value
+        if isinstance(node, ast.Name):
+            if node.id in variables:
+                return variables[node.id]
+            if node.id in CONSTANTS:
+                return CONSTANTS[node.id]
+            raise ConfigError(f"{where}: unknown name {node.id!r}")
+        if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPERATORS:
+            operator = _BINARY_OPERATORS[type(node.op)]
+            return operator(visit(node.left), visit(node.right))
+        if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPERATORS:
+            return _UNARY_OPERATORS[type(node.op)](visit(node.operand))
+        if (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Name)
+            and node.func.id in FUNCTIONS
+            and not node.keywords
+        ):
+            return FUNCTIONS[node.func.id](*(visit(arg) for arg in node.args))
+        raise ConfigError(f"{where}: unsupported expression {expression!r}")
+
+    try:
+        tree = ast.parse(expression.strip(), mode="eval")
+    except SyntaxError:
+        raise ConfigError(f"{where}: invalid expression {expression!r}") from None
+    try:
+        return visit(tree)
+    except (ArithmeticError, TypeError) as e:
+        raise ConfigError(f"{where}: {e} in {expression!r}") from None
+
+
+def number(
+    value, variables: Dict[str, float], where, optional=False
+) -> Optional[Union[int, float]]:
+    """The value of a number or an expression, the ints being kept as ints
+    so that they are written as in a .py config, e.g. "12" not "12.0"."""
+    if isinstance(value, str):
+        value = evaluate(value, variables, where)
+    if value is None and optional:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ConfigError(f"{where}: expected a number, got {value!r}")
+    return value
+
+
+def _table(value, where) -> dict:
+    if not isinstance(value, dict):
+        raise ConfigError(f"{where}: expected a table, got {value!r}")
+    return value
+
+
+def parse_joints_limit(joints_limit, variables) -> Dict[str, dict]:
+    parsed = {}
+    for joint, limits in _table(joints_limit, "joints_limit").items():
+        where = f"joints_limit.{joint}"
+        limits = _table(limits, where)
+        unknown = set(limits) - set(JOINT_LIMIT_KEYS)
+        if unknown:
+            raise ConfigError(f"{where}: unknown keys {sorted(unknown)}")
+        missing = set(REQUIRED_JOINT_LIMIT_KEYS) - set(limits)
+        if missing:
+            raise ConfigError(f"{where}: missing keys {sorted(missing)}")
+        parsed[joint] = {
+            key: number(
+                limits[key], variables, f"{where}.{key}", key in ("lower", "upper")
+            )
+            for key in JOINT_LIMIT_KEYS
+            if key in limits
+        }
+    return parsed
+
+
+def _xyz(value, where) -> str:
+    if isinstance(value, list):
+        value = " ".join(str(v) for v in value)
+    if not isinstance(value, str) or len(value.split()) != 3:
+        raise ConfigError(f"{where}: expected 3 numbers, got {value!r}")
+    try:
+        [float(v) for v in value.split()]
+    except ValueError:
+        raise ConfigError(f"{where}: expected 3 numbers, got {value!r}") from None
+    return value
+
+
+def parse_links_inertial(links_inertial, variables) -> Dict[str, Optional[dict]]:
+    parsed = {}
+    for link, inertial in _table(links_inertial, "links_inertial").items():
+        where = f"links_inertial.{link}"
+        if inertial is None:
+            parsed[link] = None  # a virtual link
+            continue
+        inertial = _table(inertial, where)
+        unknown = set(inertial) - {"mass", "origin", "inertia"}
+        if unknown:
+            raise ConfigError(f"{where}: unknown keys {sorted(unknown)}")
+        result = {}
+        if "mass" in inertial:
+            result["mass"] = number(inertial["mass"], variables, f"{where}.mass")
+        if "origin" in inertial:
+            origin = _table(inertial["origin"], f"{where}.origin")
+            unknown = set(origin) - {"xyz", "rpy"}
+            if unknown:
+                raise ConfigError(f"{where}.origin: unknown keys {sorted(unknown)}")
+            result["origin"] = {
+                key: _xyz(value, f"{where}.origin.{key}")
+                for key, value in origin.items()
+            }
+        if "inertia" in inertial:
+            inertia = _table(inertial["inertia"], f"{where}.inertia")
+            unknown = set(inertia) - set(INERTIA_KEYS)
+            if unknown:
+                raise ConfigError(f"{where}.inertia: unknown keys {sorted(unknown)}")
+            result["inertia"] = {
+                key: number(value, variables, f"{where}.inertia.{key}")
+                for key, value in inertia.items()
+            }
+        parsed[link] = result
+    return parsed
+
+
+def read_document(path) -> dict:
+    if path.endswith(".toml"):
+        try:
+            import tomllib
+        except ImportError:  # python < 3.11
+            import tomli as tomllib
+        with open(path, "rb") as file:
+            return tomllib.load(file)
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def parse_config(path) -> Tuple[dict, List[str]]:
+    """Parse and validate a .json or .toml config, returning the CONFIG dict
+    and the paths of the other files it was built from."""
+    document = _table(read_document(path), path)
+    unknown = set(document) - {"variables", "joints_limit", "links_inertial", "config"}
+    if unknown:
+        raise ConfigError(f"{path}: unknown sections {sorted(unknown)}")
+    # [config] holds the plain keys, which TOML can not write after tables
+    plain = _table(document.pop("config", {}), "config")
+    unknown = set(plain) - {"joints_limit", "links_inertial"}
+    if unknown:
+        raise ConfigError(f"config: unknown keys {sorted(unknown)}")
+    document = {**plain, **document}
+    variables: Dict[str, float] = {}
+    for name, value in _table(document.get("variables", {}), "variables").items():
+        # variables can use the ones defined before them
+        variables[name] = number(value, variables, f"variables.{name}")
+
+    dependencies = []
+    config = {"joints_limit": None, "links_inertial": None}
+    if document.get("joints_limit") is not None:
+        config["joints_limit"] = parse_joints_limit(document["joints_limit"], variables)
+    links_inertial = document.get("links_inertial")
+    if isinstance(links_inertial, str):
+        config_dir = os.path.dirname(os.path.abspath(path))
+        inertial_path = os.path.join(config_dir, links_inertial)
+        dependencies.append(inertial_path)
+        if os.path.exists(inertial_path):
+            with open(inertial_path, "r", encoding="utf-8") as file:
+                links_inertial = json.load(file)
+        else:
+            print(f"No {links_inertial} file found")
+            links_inertial = None
+    if links_inertial is not None:
+        config["links_inertial"] = parse_links_inertial(links_inertial, variables)
+    return config, dependencies
+
+
+def file_hash(path) -> str:
+    try:
+        with open(path, "rb") as file:
+            return hashlib.sha256(file.read()).hexdigest()
+    except FileNotFoundError:
+        return ""
+
+
+# path: (stats of the config and its dependencies, dependencies, pickled
+# entry), so that a batch job loading the same config thousands of times does
+# not read and hash it again
+_MEMORY_CACHE: Dict[str, Tuple[tuple, List[str], bytes]] = {}
+
+
+def _stat_key(paths: List[str]) -> tuple:
+    key = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            key.append((path, stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            key.append((path, None, None))
+    return tuple(key)
+
+
+@profiler.profiled()
+def load_config(config_path, cache_dir: Optional[str] = DEFAULT_CACHE_DIR) -> dict:
+    """Load a .json or .toml config, from the cache when neither the config
+    nor its dependencies changed. A fresh dict is returned on every call.
+    `cache_dir` None disables the on-disk cache."""
+    config_path = os.path.abspath(config_path)
+    memory = _MEMORY_CACHE.get(config_path)
+    if memory is not None:
+        stats, dependencies, entry = memory
+        if stats == _stat_key([config_path] + dependencies):
+            profiler.count("config_cache_hits")
+            return pickle.loads(entry)[2]
+
+    with open(config_path, "rb") as file:
+        content = file.read()
+    # the path is part of the key, the dependencies are relative to it
+    hasher = hashlib.sha256(CONFIG_CACHE_VERSION + b"\0")
+    hasher.update(config_path.encode() + b"\0")
+    hasher.update(content)
+    key = hasher.hexdigest()
+    entry_path = None
+    if cache_dir is not None:
+        entry_path = os.path.join(cache_dir, f"{key}.pickle")
+    entry = None
+    if entry_path is not None and os.path.exists(entry_path):
+        with open(entry_path, "rb") as file:
+            data = file.read()
+        dependencies, hashes, config = pickle.loads(data)
+        if [file_hash(path) for path in dependencies] == hashes:
+            entry = data
+            profiler.count("config_cache_hits")
+    if entry is None:
+        profiler.count("config_cache_misses")
+        config, dependencies = parse_config(config_path)
+        hashes = [file_hash(path) for path in dependencies]
+        entry = pickle.dumps((dependencies, hashes, config), pickle.HIGHEST_PROTOCOL)
+        if entry_path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = f"{entry_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as file:
+                file.write(entry)
+            os.replace(tmp_path, entry_path)
+    stats = _stat_key([config_path] + dependencies)
+    _MEMORY_CACHE[config_path] = (stats, dependencies, entry)
+    return config
+
+
+def config_dependencies(config_path) -> List[str]:
+    """The files a config was built from, itself included."""
+    config_path = os.path.abspath(config_path)
+    if config_path.endswith(".py"):
+        return [config_path]
+    load_config(config_path)
+    return [config_path] + _MEMORY_CACHE[config_path][1]
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Validate a .json or .toml config and cache its parsed form"
+    )
+    parser.add_argument("config_path", type=str, help="Path to the config file")
+    parser.add_argument(
+        "-dump", "--dump", action="store_true", help="Print the parsed CONFIG as JSON"
+    )
+    parser.add_argument(
+        "-ncache", "--no_cache", action="store_true", help="Disable the cache"
+    )
+    profiler.add_arguments(parser)
+    args = parser.parse_args(argv)
+    profiler.enable_from_args(args)
+    try:
+        config = load_config(
+            args.config_path, None if args.no_cache else DEFAULT_CACHE_DIR
+        )
+    except ConfigError as e:
+        print(f"Invalid config: {e}")
+        sys.exit(1)
+    if args.dump:
+        print(json.dumps(config, indent=4))
+    for key, value in config.items():
+        print(f"{key}: {'not set' if value is None else f'{len(value)} entries'}")
+    print(f"Depends on: {', '.join(config_dependencies(args.config_path))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,100 +1,246 @@
 import re
-import argparse
-from typing import List, Optional, Dict
 import json
-import os
+import os, sys
+from typing import Dict, Iterable, Iterator, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import profiler
+
+"""
+Extract the mass, center of mass and inertia tensor of links from mass
+properties exported by SolidWorks (.txt) and merge them into a
+links_inertial.json file.
+
+Any number of exports (or directories of exports) are read line by line in
+one process, each file holding one or several links, and the output file is
+read and written only once.
+
+examples:
+python3 extract_intertial.py -in example_config/links_inertial.txt -t 1e-5 -ln base_link link1
+python3 extract_intertial.py -in exports/ -out urdf_config_robot/links_inertial.json
+python3 extract_intertial.py -in base_link.txt link1.txt link2.txt
+"""
 
 default_thresh = 1e-5
-parser = argparse.ArgumentParser(description="Extract inertial data from a .txt file")
-parser.add_argument("-in", "--input_text_path", type=str, help="Path to the .txt file")
-parser.add_argument(
-    "-out", "--output_json_path", type=str, help="Path to the .json file"
-)
-parser.add_argument(
-    "-t",
-    "--threshold",
-    type=float,
-    help="Threshold for filtering out small inertial values",
-    default=default_thresh,
-)
-parser.add_argument(
-    "-ln",
-    "--links_name",
-    type=str,
-    nargs="*",
-    help="Name of the links in the URDF file",
-)
-args = parser.parse_args()
-input_path: str = args.input_text_path
-output_path: str = args.output_json_path
-threshold: float = args.threshold
-links_name: Optional[List[str]] = args.links_name
-assert input_path.endswith(".txt"), "Input file must be a .txt file"
-output_path = (
-    input_path.replace(".txt", ".json") if output_path is None else output_path
-)
-# 读取.txt文件
-with open(input_path, "r", encoding="utf-8") as file:
-    document = file.read()
-
-# 正则表达式匹配惯量数据
-tensor_pattern = re.compile(
-    r"Lxx = ([\d\.-]+)\s+Lxy = ([\d\.-]+)\s+Lxz = ([\d\.-]+)\s+L(?:yx = |x = )([\d\.-]+)\s+Lyy = ([\d\.-]+)\s+Lyz = ([\d\.-]+)\s+L(?:zx = |z = )([\d\.-]+)\s+L(?:zy = |zz = )([\d\.-]+)\s+Lzz = ([\d\.-]+)"
-)
-
-# 解析文件
-if links_name is None:
-    link_pattern = re.compile(r"(link\d*|\w+_link\d*)")
-    links_name = link_pattern.findall(document)
-    assert (
-        len(links_name) > 0
-    ), "No supported link names found in the document, please modify or provide them through the command line"
-    print(f"Found links: {links_name}")
-tensors = tensor_pattern.findall(document)
-assert len(tensors) == len(links_name), "Number of link names and tensors do not match"
-
-# 生成惯量数据字典
-link_inertial = {}
-intertia_keys = ["ixx", "ixy", "ixz", "iyy", "iyz", "izz"]
-for link, tensor in zip(links_name, tensors):
-    link = link.lower()
-    link_inertial[link] = {"inertia": {}}
-    for key, value in zip(intertia_keys, tensor):
-        # print(f"{link} {key} = {value}")
-        value = float(value)
-        if abs(value) < threshold:
-            # print(f"Filtering out small value: {value}")
-            value = default_thresh
-        link_inertial[link]["inertia"][key] = value
-
-# 如果目标路径存在，则在已有的数据里更新
-if os.path.exists(output_path):
-    print("Updating existing data")
-    with open(output_path, "r", encoding="utf-8") as file:
-        old_data: Dict[str, dict] = json.load(file)
-    for link in links_name:
-        old_data[link]["inertia"].update(link_inertial[link]["inertia"])
-        # old_data[link]["mass"] = link_inertial[link]["mass"]
-    link_inertial = old_data
-else:
-    print("No links_inertial.json file found")
-
-# 保存惯量数据
-with open(output_path, "w", encoding="utf-8") as file:
-    json.dump(link_inertial, file, indent=4)
-
-print(f"Saved inertial data to {output_path}")
-print("Done!")
-
-# 代码中的正则表达式用于匹配具有以下格式的文本行：
+# the tensor taken at the center of mass, Lxx Lxy Lxz / Lyx Lyy Lyz / Lzx Lzy Lzz
+TENSOR_VALUE = re.compile(r"\bL[xyz]{1,2}\s*=\s*([-+]?[\d.]+(?:[eE][-+]?\d+)?)")
+# the symmetric tensor is written row by row, keep the upper triangle
+INERTIA_INDICES = {"ixx": 0, "ixy": 1, "ixz": 2, "iyy": 4, "iyz": 5, "izz": 8}
+MASS = re.compile(r"^\s*(?:mass|质量)\s*=\s*([-+]?[\d.]+(?:[eE][-+]?\d+)?)", re.I)
+CENTER_OF_MASS = re.compile(r"^\s*(?:center of mass|重心)\s*[:：]", re.I)
+COORDINATE = re.compile(r"^\s*([XYZ])\s*=\s*([-+]?[\d.]+(?:[eE][-+]?\d+)?)\s*$")
+LINK_NAME = re.compile(r"(link\d*|\w+_link\d*)")
+
+
+def parse_mass_properties(lines: Iterable[str], default_name=None) -> Iterator[dict]:
+    """Yield a {"name", "mass", "com", "tensor"} record for each link of the
+    export, a new record starting at each line naming a link. The records
+    without a link name are named `default_name`."""
+    record: dict = {"name": None}
+    com_axes: Optional[dict] = None
+
+    def finished(record):
+        return len(record.get("tensor", ())) == 9
+
+    for line in lines:
+        match = TENSOR_VALUE.findall(line)
+        if match:
+            record.setdefault("tensor", []).extend(float(value) for value in match)
+            continue
+        match = MASS.match(line)
+        if match:
+            record["mass"] = float(match.group(1))
+            continue
+        if CENTER_OF_MASS.match(line):
+            com_axes = {}
+            continue
+        if com_axes is not None:
+            match = COORDINATE.match(line)
+            if match:
+                com_axes[match.group(1)] = float(match.group(2))
+                if len(com_axes) == 3:
+                    record["com"] = [com_axes[axis] for axis in "XYZ"]
+                    com_axes = None
+                continue
+            if line.strip():
+                com_axes = None
+        match = LINK_NAME.search(line)
+        if match:
+            if "tensor" in record or "mass" in record:
+                if record["name"] is None:
+                    record["name"] = default_name
+                yield record
+                record = {"name": None}
+            if record["name"] is None:
+                record["name"] = match.group(1)
+    if finished(record) or "mass" in record:
+        if record["name"] is None:
+            record["name"] = default_name
+        yield record
+
+
+def extract_file(path, encoding="utf-8") -> List[dict]:
+    """Records of one export, named after the file when it names no link."""
+    default_name = os.path.splitext(os.path.basename(path))[0]
+    with open(path, "r", encoding=encoding, errors="replace") as file:
+        records = list(parse_mass_properties(file, default_name))
+    profiler.count("files_read")
+    for record in records:
+        tensor = record.get("tensor")
+        assert tensor is None or len(tensor) == 9, (
+            f"Incomplete inertia tensor for {record['name']} in {path}"
+        )
+    return records
+
+
+def find_exports(paths: Iterable[str]) -> List[str]:
+    """Expand the directories to the .txt files they contain."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(
+                os.path.join(path, name)
+                for name in sorted(os.listdir(path))
+                if name.endswith(".txt") and not name.startswith(".")
+            )
+        else:
+            assert path.endswith(".txt"), f"Input file must be a .txt file: {path}"
+            files.append(path)
+    return files
+
+
+def to_inertial(record: dict, threshold=default_thresh) -> dict:
+    """Convert a record to the links_inertial.json format of a link."""
+    inertial = {}
+    if "mass" in record:
+        inertial["mass"] = record["mass"]
+    if "com" in record:
+        inertial["origin"] = {"xyz": " ".join(str(v) for v in record["com"])}
+    if "tensor" in record:
+        inertia = {}
+        for key, index in INERTIA_INDICES.items():
+            value = record["tensor"][index]
+            if abs(value) < threshold:
+                value = default_thresh
+            inertia[key] = value
+        inertial["inertia"] = inertia
+    return inertial
+
+
+def extract_inertials(
+    paths: Iterable[str],
+    threshold=default_thresh,
+    links_name: Optional[List[str]] = None,
+) -> Dict[str, dict]:
+    """Extract the links of all the exports, named in order by `links_name`
+    if given."""
+    records = []
+    with profiler.stage("extract"):
+        for path in find_exports(paths):
+            records.extend(extract_file(path))
+    if links_name is not None:
+        assert len(records) == len(
+            links_name
+        ), "Number of link names and tensors do not match"
+        for record, name in zip(records, links_name):
+            record["name"] = name
+    else:
+        print(f"Found links: {[record['name'] for record in records]}")
+    return {record["name"].lower(): to_inertial(record, threshold) for record in records}
+
+
+def merge_inertials(output_path, link_inertial: Dict[str, dict]) -> Dict[str, dict]:
+    """Update the links of the existing output file, if any, with the new
+    values and write it once."""
+    with profiler.stage("merge"):
+        if os.path.exists(output_path):
+            print("Updating existing data")
+            with open(output_path, "r", encoding="utf-8") as file:
+                data: Dict[str, dict] = json.load(file)
+        else:
+            print("No links_inertial.json file found")
+            data = {}
+        for link, inertial in link_inertial.items():
+            old = data.setdefault(link, {})
+            for key, value in inertial.items():
+                if isinstance(value, dict) and isinstance(old.get(key), dict):
+                    old[key].update(value)
+                else:
+                    old[key] = value
+        with open(output_path, "w", encoding="utf-8") as file:
+            json.dump(data, file, indent=4)
+    profiler.count("files_written")
+    return data
+
+
+def default_output_path(paths: List[str]) -> str:
+    first = paths[0]
+    if os.path.isdir(first):
+        return os.path.join(first, "links_inertial.json")
+    if len(paths) == 1:
+        return first.replace(".txt", ".json")
+    return os.path.join(os.path.dirname(first), "links_inertial.json")
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Extract inertial data from .txt files"
+    )
+    parser.add_argument(
+        "-in",
+        "--input_text_path",
+        type=str,
+        nargs="+",
+        help="Paths to the .txt files or to directories of .txt files",
+    )
+    parser.add_argument(
+        "-out", "--output_json_path", type=str, help="Path to the .json file"
+    )
+    parser.add_argument(
+        "-t",
+        "--threshold",
+        type=float,
+        help="Threshold for filtering out small inertial values",
+        default=default_thresh,
+    )
+    parser.add_argument(
+        "-ln",
+        "--links_name",
+        type=str,
+        nargs="*",
+        help="Name of the links in the URDF file, in the order of the exports",
+    )
+    profiler.add_arguments(parser)
+    args = parser.parse_args(argv)
+    profiler.enable_from_args(args)
+    input_paths: List[str] = args.input_text_path
+    output_path: str = args.output_json_path
+    output_path = (
+        default_output_path(input_paths) if output_path is None else output_path
+    )
+
+    link_inertial = extract_inertials(input_paths, args.threshold, args.links_name)
+    merge_inertials(output_path, link_inertial)
+    print(f"Saved inertial data of {len(link_inertial)} links to {output_path}")
+    print("Done!")
+
+
+if __name__ == "__main__":
+    main()
+
+# 惯性张量按行输出，匹配以下格式的文本行：
 #
 # Lxx = 0.000000 Lxy = 0.000000 Lxz = 0.000000
 # Lyx = 0.000000 Lyy = 0.000000 Lyz = 0.000000
 # Lzx = 0.000000 Lzy = 0.000000 Lzz = 0.000000
 #
-# 该正则表达式将匹配这样的行，并将每个值提取为一个组。这些组将在后续代码中用于提取数据。
+# 取第 0, 1, 2, 4, 5, 8 个值作为 ixx, ixy, ixz, iyy, iyz, izz。
+# 质量来自 "质量 = 0.78 千克" (或 "Mass = ...") 行，重心来自 "重心: ( 米 )" (或
+# "Center of mass: ...") 之后的 X, Y, Z 行。
 #
-# 代码中的链接名称是通过正则表达式匹配的。如果未提供链接名称，则使用以下正则表达式：
+# 如果未提供链接名称，则从匹配以下正则表达式的行开始一个新的链接，
+# 没有名称的文件使用文件名：
 #
-# link_pattern = re.compile(r"(link\d*|\w+_link\d*)")
-# links_name = link_pattern.findall(document)
+# LINK_NAME = re.compile(r"(link\d*|\w+_link\d*)")
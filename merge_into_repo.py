@@ -0,0 +1,99 @@
+import glob
+import os, sys
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from mesh_tools.dedup import LINK_MODES, DedupStore
+import profiler
+
+"""
+Merge a converted URDF package into a description repository: the meshes go
+to <out_path>/meshes/<package name>/{visual,collision} and the .xacro files
+to <out_path>/urdf/<type>s/.
+
+The package meshes are taken from meshes/visual and meshes/collision when it
+has them, otherwise all of meshes/ is used for both. Each distinct mesh is
+stored once: the copies of a mesh already in the repository, e.g. a part
+shared with another robot, or used as visual and collision mesh, are
+reflinks or hardlinks of it (see mesh_tools/dedup.py).
+
+examples:
+python3 merge_into_repo.py ~/temp_urdf/my_gripper ~/ws/src/arm-models gripper
+python3 merge_into_repo.py ~/temp_urdf/my_gripper ~/ws/src/arm-models gripper -mode copy
+"""
+
+
+def copy_files(paths: List[str], target_dir, store: DedupStore) -> int:
+    os.makedirs(target_dir, exist_ok=True)
+    copied = 0
+    for path in paths:
+        if os.path.isfile(path):
+            store.copy_file(path, os.path.join(target_dir, os.path.basename(path)))
+            copied += 1
+    profiler.count("files_copied", copied)
+    return copied
+
+
+def package_meshes(raw_path, kind) -> List[str]:
+    kind_dir = os.path.join(raw_path, "meshes", kind)
+    if os.path.isdir(kind_dir):
+        return sorted(glob.glob(os.path.join(kind_dir, "*")))
+    return sorted(glob.glob(os.path.join(raw_path, "meshes", "*")))
+
+
+@profiler.profiled("merge")
+def merge_into_repo(raw_path, out_path, type, mode="auto") -> str:
+    """Merge the package at `raw_path` into the repository at `out_path`,
+    return the package name."""
+    raw_path = os.path.abspath(raw_path)
+    package_name = os.path.basename(raw_path.rstrip(os.sep))
+    store = DedupStore(mode)
+    repo_meshes_dir = os.path.join(out_path, "meshes")
+    if os.path.isdir(repo_meshes_dir):
+        store.index(repo_meshes_dir)
+    target_meshes_dir = os.path.join(repo_meshes_dir, package_name)
+    for kind in ("collision", "visual"):
+        copy_files(
+            package_meshes(raw_path, kind),
+            os.path.join(target_meshes_dir, kind),
+            store,
+        )
+    # all the xacro files go into the target urdf directory
+    xacros = sorted(glob.glob(os.path.join(raw_path, "urdf", "*.xacro")))
+    copy_files(xacros, os.path.join(out_path, "urdf", f"{type}s"), store)
+    store.print_stats()
+    return package_name
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Merge a converted URDF package into a description repository"
+    )
+    parser.add_argument("raw_path", type=str, help="Path to the converted package")
+    parser.add_argument("out_path", type=str, help="Path to the repository")
+    parser.add_argument(
+        "type", type=str, help="Type of the robot part, e.g. arm or gripper"
+    )
+    parser.add_argument(
+        "-mode",
+        "--link_mode",
+        type=str,
+        help="How the identical meshes share their content, auto tries reflink, "
+        "then hardlink, then copy",
+        default="auto",
+        choices=LINK_MODES,
+    )
+    profiler.add_arguments(parser)
+    args = parser.parse_args(argv)
+    profiler.enable_from_args(args)
+
+    package_name = merge_into_repo(
+        args.raw_path, args.out_path, args.type, args.link_mode
+    )
+    print(f"Merged {package_name} into {args.out_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+"""Mesh processing tools of urdf2xacro."""
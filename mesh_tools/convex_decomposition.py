@@ -0,0 +1,509 @@
+import json
+import os, sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from scipy.optimize import linprog
+from scipy.spatial import ConvexHull, HalfspaceIntersection, QhullError
+
+if not __package__:
+    # run as a script rather than imported from the mesh_tools package
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    __package__ = "mesh_tools"
+from .decimate import MESH_FORMATS, read_mesh, write_mesh
+from .mesh_cache import MeshCache, replace_file
+from .mesh_io import mesh_volume
+from .simplify_meshes_scipy import convex_hull_arrays
+import profiler
+
+"""
+Approximate convex decomposition of meshes: a concave part such as a gripper
+is replaced by a bounded number of convex hulls instead of a single one, so
+that the collision checks stay convex while being accurate.
+
+The faces of a mesh are split recursively by a plane across one of their
+principal axes, the piece split next being the most concave one, until all
+the pieces are convex enough or there are --max_pieces of them. The
+concavity of a piece is the largest distance from its surface to its convex
+hull; the plane of each split is the one, among a few positions along the
+three axes, minimizing the volume of the two hulls.
+
+Each mesh <name>.<ext> gives the hulls <name>_piece<i>.<ext>, listed in the
+pieces.json manifest of the output directory, {"<name>.<ext>": [pieces]}.
+split_mesh_paths.py -pieces (or the convex_decomposition stage of
+pipeline.py) replaces each <collision> of a mesh by one per piece.
+
+examples:
+python3 mesh_tools/convex_decomposition.py -in meshes/collision -n 8
+python3 mesh_tools/convex_decomposition.py -in meshes/visual -out meshes/collision -c 0.02 -j 8
+"""
+
+# change this when the output of convex_decomposition changes
+DECOMPOSITION_CACHE_VERSION = "convex_decomposition:1"
+PIECES_MANIFEST = "pieces.json"
+# positions of the splitting planes tried along each axis, as quantiles
+SPLIT_QUANTILES = (0.25, 0.5, 0.75)
+# the concavity is measured on at most this many points of a piece
+MAX_SAMPLES = 1024
+# the faces are subdivided to edges shorter than this fraction of the mesh
+# size, so that a cut never misses the surface between their corners
+MAX_EDGE = 1 / 16
+
+
+def hull_depth(hull: ConvexHull, points: np.ndarray) -> float:
+    """Largest distance from the points to the surface of the hull
+    containing them."""
+    if len(points) > MAX_SAMPLES:
+        points = points[np.linspace(0, len(points) - 1, MAX_SAMPLES).astype(np.int64)]
+    # the equations are outward unit normals and offsets, negative inside
+    if len(points) == 0:
+        return 0.0
+    distances = -(points @ hull.equations[:, :3].T + hull.equations[:, 3])
+    return float(max(distances.min(axis=1).max(), 0.0))
+
+
+def cell_points(
+    vertices: np.ndarray, faces: np.ndarray, planes: List[Tuple[np.ndarray, float]]
+) -> np.ndarray:
+    """The surface of the faces clipped to the cell x.normal >= offset of all
+    the `planes`: the corners inside the cell and the points where the edges
+    cross its planes, so that the hull of the pieces covers the cut."""
+    triangles = vertices[faces]
+    start = triangles.reshape(-1, 3)
+    end = np.roll(triangles, -1, axis=1).reshape(-1, 3)
+    points = [vertices[np.unique(faces)]]
+    for normal, offset in planes:
+        d_start, d_end = start @ normal - offset, end @ normal - offset
+        crossing = d_start * d_end < 0
+        t = d_start[crossing] / (d_start[crossing] - d_end[crossing])
+        points.append(start[crossing] + t[:, None] * (end[crossing] - start[crossing]))
+    points = np.concatenate(points)
+    inside = np.ones(len(points), dtype=bool)
+    scale = np.abs(points).max()
+    for normal, offset in planes:
+        inside &= points @ normal - offset >= -1e-9 * scale
+    return points[inside]
+
+
+def subdivide_long_faces(
+    vertices: np.ndarray, faces: np.ndarray, max_edge: float, max_faces=200_000
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Split the faces in two across their longest edge until no edge is
+    longer than `max_edge` or there would be more than `max_faces`. The new
+    vertices are not shared by the neighbor faces: only the surface matters
+    here."""
+    while len(faces) < max_faces:
+        triangles = vertices[faces]
+        edges = np.roll(triangles, -1, axis=1) - triangles
+        lengths = np.einsum("fij,fij->fi", edges, edges)
+        long = lengths.max(axis=1) > max_edge**2
+        if not long.any() or len(faces) + long.sum() > max_faces:
+            break
+        # rotate the faces to have the longest edge first, from a to b
+        split = faces[long]
+        first = lengths[long].argmax(axis=1)
+        a, b, c = (split[np.arange(len(split)), (first + i) % 3] for i in range(3))
+        middles = len(vertices) + np.arange(len(split))
+        vertices = np.concatenate([vertices, (vertices[a] + vertices[b]) / 2])
+        faces = np.concatenate(
+            [
+                faces[~long],
+                np.column_stack([a, middles, c]),
+                np.column_stack([middles, b, c]),
+            ]
+        )
+    return vertices, faces
+
+
+def winding_numbers(
+    vertices: np.ndarray, faces: np.ndarray, points: np.ndarray, chunk_size=1 << 22
+) -> np.ndarray:
+    """Generalized winding numbers of the points, about 1 inside the mesh and
+    0 outside, from the solid angles of its faces (Van Oosterom and
+    Strackee)."""
+    triangles = vertices[faces]
+    winding = np.zeros(len(points))
+    step = max(1, chunk_size // max(len(faces), 1))
+    for start in range(0, len(points), step):
+        a, b, c = (
+            triangles[None, :, i] - points[start : start + step, None] for i in range(3)
+        )
+        la, lb, lc = (np.linalg.norm(x, axis=2) for x in (a, b, c))
+        det = np.einsum("pfi,pfi->pf", a, np.cross(b, c))
+        denominator = (
+            la * lb * lc
+            + np.einsum("pfi,pfi->pf", a, b) * lc
+            + np.einsum("pfi,pfi->pf", a, c) * lb
+            + np.einsum("pfi,pfi->pf", b, c) * la
+        )
+        winding[start : start + step] = np.arctan2(det, denominator).sum(axis=1)
+    return winding / (2 * np.pi)
+
+
+def cell_corners(planes: List[Tuple[np.ndarray, float]], bounds: np.ndarray) -> np.ndarray:
+    """Vertices of the cell of the `planes` within the box `bounds`."""
+    normals = np.array([normal for normal, _ in planes] + list(np.eye(3)) + list(-np.eye(3)))
+    offsets = np.array([offset for _, offset in planes] + list(bounds[0]) + list(-bounds[1]))
+    # normal.x >= offset as A.x + b <= 0
+    halfspaces = np.column_stack([-normals, offsets])
+    # the center of the largest ball in the cell, an interior point
+    norms = np.linalg.norm(normals, axis=1)
+    solution = linprog(
+        [0, 0, 0, -1],
+        A_ub=np.column_stack([-normals, norms]),
+        b_ub=-offsets,
+        bounds=[(None, None)] * 3 + [(0, None)],
+    )
+    if not solution.success or solution.x[3] <= 1e-12:
+        return np.empty((0, 3))
+    try:
+        return HalfspaceIntersection(halfspaces, solution.x[:3]).intersections
+    except QhullError:
+        return np.empty((0, 3))
+
+
+class Piece(object):
+    """The part of the mesh in a convex cell, the intersection of the half
+    spaces of the previous cuts, and its convex hull."""
+
+    def __init__(self, vertices, faces, index: np.ndarray, planes) -> None:
+        # the faces crossing a cut belong to both sides
+        self.index = index
+        self.planes = planes
+        self.points = cell_points(vertices, faces[index], planes)
+        self.hull = ConvexHull(self.points)
+        centroids = vertices[faces[index]].mean(axis=1)
+        for normal, offset in planes:
+            centroids = centroids[centroids @ normal >= offset]
+        # the hull vertices are at a depth of 0
+        inner = np.ones(len(self.points), dtype=bool)
+        inner[self.hull.vertices] = False
+        self.concavity = hull_depth(
+            self.hull, np.concatenate([self.points[inner], centroids])
+        )
+
+    def solid_points(self, vertices, faces) -> np.ndarray:
+        """The points of the piece and the corners of its cell inside the
+        mesh, where three cuts meet away from the surface."""
+        bounds = np.array([vertices.min(axis=0), vertices.max(axis=0)])
+        corners = cell_corners(self.planes, bounds)
+        if len(corners) > 0:
+            corners = corners[winding_numbers(vertices, faces, corners) > 0.5]
+        return np.concatenate([self.points, corners])
+
+
+def split_piece(vertices, faces, piece: Piece) -> Optional[List[Piece]]:
+    """The two pieces of the best splitting plane, None if no plane gives two
+    pieces with a volume."""
+    center = piece.points.mean(axis=0)
+    centered = piece.points - center
+    _, axes = np.linalg.eigh(centered.T @ centered)
+    corners = vertices[faces[piece.index]]
+    best, best_volume = None, np.inf
+    for axis in axes.T[::-1]:
+        projection = centered @ axis
+        distances = (corners - center) @ axis
+        for cut in np.quantile(projection, SPLIT_QUANTILES):
+            offset = center @ axis + cut
+            above = (distances > cut).any(axis=1)
+            below = (distances < cut).any(axis=1)
+            if not above.any() or not below.any():
+                continue
+            try:
+                halves = [
+                    Piece(vertices, faces, piece.index[side], piece.planes + [plane])
+                    for side, plane in ((above, (axis, offset)), (below, (-axis, -offset)))
+                ]
+            except QhullError:
+                # a flat side
+                continue
+            volume = halves[0].hull.volume + halves[1].hull.volume
+            if volume < best_volume:
+                best, best_volume = halves, volume
+    return best
+
+
+def convex_decomposition(
+    vertices: np.ndarray, faces: np.ndarray, max_pieces=8, max_concavity=0.01
+) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """Convex hulls (vertices, outward faces) of at most `max_pieces` pieces
+    of the mesh, each one within `max_concavity` times the diagonal of the
+    mesh bounding box from its hull when possible."""
+    vertices = np.asarray(vertices, dtype=np.float64)
+    faces = np.asarray(faces, dtype=np.int64)
+    size = np.linalg.norm(np.ptp(vertices, axis=0))
+    tolerance = max_concavity * size
+    pieces = [Piece(vertices, faces, np.arange(len(faces)), [])]
+    if pieces[0].concavity > tolerance and max_pieces > 1:
+        vertices, faces = subdivide_long_faces(vertices, faces, MAX_EDGE * size)
+        pieces = [Piece(vertices, faces, np.arange(len(faces)), [])]
+    # the pieces that can not be split any further
+    final: List[Piece] = []
+    while len(pieces) + len(final) < max_pieces:
+        worst = max(range(len(pieces)), key=lambda i: pieces[i].concavity, default=None)
+        if worst is None or pieces[worst].concavity <= tolerance:
+            break
+        halves = split_piece(vertices, faces, pieces[worst])
+        piece = pieces.pop(worst)
+        if halves is None:
+            final.append(piece)
+        else:
+            pieces.extend(halves)
+            profiler.count("pieces_split")
+    return [
+        convex_hull_arrays(piece.solid_points(vertices, faces))
+        for piece in pieces + final
+    ]
+
+
+def piece_names(input_path, count: int) -> List[str]:
+    stem, ext = os.path.splitext(os.path.basename(input_path))
+    return [f"{stem}_piece{i}{ext}" for i in range(count)]
+
+
+def decompose_file(
+    input_path, produced_dir, max_pieces=8, max_concavity=0.01
+) -> dict:
+    """Write the hulls of the pieces of `input_path` to `produced_dir`, named
+    as `piece_names`. Never raises: the error is returned in the result."""
+    result = {"input": input_path, "error": None, "cached": False, "pieces": []}
+    start = time.perf_counter()
+    try:
+        vertices, faces = read_mesh(input_path)
+        hulls = convex_decomposition(vertices, faces, max_pieces, max_concavity)
+        result["pieces"] = piece_names(input_path, len(hulls))
+        for name, (hull_vertices, hull_faces) in zip(result["pieces"], hulls):
+            write_mesh(os.path.join(produced_dir, name), hull_vertices, hull_faces)
+        result["volumes"] = [
+            abs(mesh_volume(vertices, faces)),
+            sum(mesh_volume(*hull) for hull in hulls),
+        ]
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+        for name in result["pieces"]:
+            if os.path.exists(os.path.join(produced_dir, name)):
+                os.remove(os.path.join(produced_dir, name))
+        result["pieces"] = []
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def _decompose_job(args) -> dict:
+    return decompose_file(*args)
+
+
+def fetch_pieces(cache: MeshCache, key, input_path, out_dir) -> Optional[List[str]]:
+    """Materialize the cached pieces of a mesh in `out_dir`, None if they
+    are not all in the cache."""
+    count_path = os.path.join(out_dir, f".tmp_pieces_{os.getpid()}.json")
+    if not cache.fetch(key, count_path):
+        return None
+    with open(count_path, "r", encoding="utf-8") as file:
+        count = json.load(file)["pieces"]
+    os.remove(count_path)
+    names = piece_names(input_path, count)
+    for i, name in enumerate(names):
+        if not cache.fetch(f"{key}{i}", os.path.join(out_dir, name)):
+            return None
+    return names
+
+
+def store_pieces(cache: MeshCache, key, names: List[str], produced_dir, out_dir):
+    for i, name in enumerate(names):
+        cache.store(f"{key}{i}", os.path.join(produced_dir, name), os.path.join(out_dir, name))
+    # the number of pieces is the entry of the key itself
+    count_path = os.path.join(produced_dir, "count.json")
+    with open(count_path, "w", encoding="utf-8") as file:
+        json.dump({"pieces": len(names)}, file)
+    cache.store(key, count_path, count_path)
+    os.remove(count_path)
+
+
+def read_pieces_manifest(out_dir) -> Dict[str, List[str]]:
+    path = os.path.join(out_dir, PIECES_MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def write_pieces_manifest(out_dir, manifest: Dict[str, List[str]]):
+    path = os.path.join(out_dir, PIECES_MANIFEST)
+    tmp_path = os.path.join(out_dir, f".tmp_{os.getpid()}_{PIECES_MANIFEST}")
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=4, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+@profiler.profiled("convex_decomposition")
+def decompose_files(
+    paths: List[str],
+    out_dir,
+    max_pieces=8,
+    max_concavity=0.01,
+    workers: Optional[int] = None,
+    cache: Optional[MeshCache] = None,
+) -> Dict[str, List[str]]:
+    """Decompose the meshes into `out_dir` with `workers` processes, a failed
+    mesh being reported and left out, update the pieces manifest of
+    `out_dir` and return it."""
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = read_pieces_manifest(out_dir)
+    params = f"{DECOMPOSITION_CACHE_VERSION}:{max_pieces}:{max_concavity}"
+    results = [None] * len(paths)
+    jobs, pending = [], []
+    for index, input_path in enumerate(paths):
+        key = None
+        if cache is not None:
+            key = cache.key(input_path, params, os.path.splitext(input_path)[1].lower())
+            names = fetch_pieces(cache, key, input_path, out_dir)
+            if names is not None:
+                results[index] = {
+                    "input": input_path,
+                    "error": None,
+                    "cached": True,
+                    "pieces": names,
+                    "seconds": 0.0,
+                }
+                continue
+        # a directory per mesh, the pieces are only moved once all written
+        produced_dir = os.path.join(out_dir, f".tmp_decompose_{os.getpid()}_{index}")
+        os.makedirs(produced_dir, exist_ok=True)
+        jobs.append((input_path, produced_dir, max_pieces, max_concavity))
+        pending.append((index, produced_dir, key))
+
+    workers = os.cpu_count() if workers is None else workers
+    workers = max(1, min(workers, len(jobs)))
+    if workers == 1:
+        produced = list(map(_decompose_job, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            produced = list(executor.map(_decompose_job, jobs))
+    for (index, produced_dir, key), result in zip(pending, produced):
+        if result["error"] is None:
+            if cache is not None:
+                store_pieces(cache, key, result["pieces"], produced_dir, out_dir)
+            else:
+                for name in result["pieces"]:
+                    replace_file(
+                        os.path.join(produced_dir, name), os.path.join(out_dir, name)
+                    )
+        os.rmdir(produced_dir)
+        results[index] = result
+
+    for index, result in enumerate(results, 1):
+        name = os.path.basename(result["input"])
+        if result["error"] is not None:
+            print(f"[{index}/{len(results)}] FAILED {name} ({result['seconds']:.2f}s)")
+            print(f"    {result['error']}")
+            continue
+        # the pieces of a previous run that are not produced anymore
+        for stale in set(manifest.get(name, [])) - set(result["pieces"]):
+            if os.path.exists(os.path.join(out_dir, stale)):
+                os.remove(os.path.join(out_dir, stale))
+        manifest[name] = result["pieces"]
+        status = "CACHED" if result["cached"] else "OK"
+        volumes = ""
+        if "volumes" in result and result["volumes"][0] > 0:
+            volumes = result["volumes"][1] / result["volumes"][0]
+            volumes = f", {volumes:.2f}x the mesh volume"
+        print(
+            f"[{index}/{len(results)}] {status} {name} -> {len(result['pieces'])} pieces"
+            f"{volumes} ({result['seconds']:.2f}s)"
+        )
+    write_pieces_manifest(out_dir, manifest)
+    failed = sum(result["error"] is not None for result in results)
+    profiler.count("files_read", len(results))
+    profiler.count("files_cached", sum(result["cached"] for result in results))
+    profiler.count("files_failed", failed)
+    print(f"Decomposed {len(results) - failed}/{len(results)} meshes")
+    if cache is not None:
+        cache.print_stats()
+    return manifest
+
+
+def main(argv=None):
+    import argparse
+    from .mesh_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_SIZE
+
+    parser = argparse.ArgumentParser(
+        description="Split meshes into convex pieces for the collisions"
+    )
+    parser.add_argument(
+        "-in", "--input_dir", type=str, help="Directory containing the meshes"
+    )
+    parser.add_argument(
+        "-out",
+        "--output_dir",
+        type=str,
+        help="Directory of the pieces and their manifest, the input one by default",
+        default=None,
+    )
+    parser.add_argument(
+        "-n",
+        "--max_pieces",
+        type=int,
+        help="Maximum number of convex pieces of a mesh",
+        default=8,
+    )
+    parser.add_argument(
+        "-c",
+        "--max_concavity",
+        type=float,
+        help="Stop splitting a piece within this fraction of the mesh size "
+        "from its hull",
+        default=0.01,
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        help="Number of worker processes, defaults to the number of cores",
+        default=None,
+    )
+    parser.add_argument(
+        "-cache",
+        "--cache_dir",
+        type=str,
+        help="Directory of the pieces cache",
+        default=DEFAULT_CACHE_DIR,
+    )
+    parser.add_argument(
+        "-cs",
+        "--cache_size",
+        type=float,
+        help="Maximum size of the cache in MB",
+        default=DEFAULT_MAX_SIZE / 1024**2,
+    )
+    parser.add_argument(
+        "-ncache", "--no_cache", action="store_true", help="Disable the cache"
+    )
+    profiler.add_arguments(parser)
+    args = parser.parse_args(argv)
+    profiler.enable_from_args(args)
+
+    out_dir = args.input_dir if args.output_dir is None else args.output_dir
+    pieces = {
+        piece for names in read_pieces_manifest(out_dir).values() for piece in names
+    }
+    paths = [
+        os.path.join(args.input_dir, name)
+        for name in sorted(os.listdir(args.input_dir))
+        if name.lower().endswith(MESH_FORMATS)
+        and not name.startswith(".")
+        and name not in pieces
+    ]
+    if len(paths) == 0:
+        print(f"No meshes found in {args.input_dir}")
+        return
+    cache = None
+    if not args.no_cache:
+        cache = MeshCache(args.cache_dir, int(args.cache_size * 1024**2))
+    decompose_files(
+        paths, out_dir, args.max_pieces, args.max_concavity, args.workers, cache
+    )
+
+
+if __name__ == "__main__":
+    main()
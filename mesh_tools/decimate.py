@@ -0,0 +1,559 @@
+import os, sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+import numpy as np
+
+if not __package__:
+    # run as a script rather than imported from the mesh_tools package
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    __package__ = "mesh_tools"
+from .mesh_cache import MeshCache, replace_file
+from .mesh_io import compact_mesh, read_stl_triangles, write_binary_stl
+import profiler
+
+"""
+Simplify meshes to a target number of faces or an error bound by quadric
+error edge collapses (Garland and Heckbert), in-process and with NumPy only,
+as an alternative to meshlabserver.
+
+Each vertex accumulates the quadric of the planes of its faces, the cost of
+collapsing an edge being the squared distance of the optimal merged vertex
+to these planes. Instead of collapsing one edge at a time from a priority
+queue, every pass collapses at once the edges that are the cheapest of their
+neighborhood: no face is touched by two collapses of a pass, so they are
+independent and checked together. A collapse is rejected if it would make
+the mesh non-manifold or flip a face, and the boundary edges are kept in
+place by planes perpendicular to their face.
+
+examples:
+python3 mesh_tools/decimate.py -in meshes/collision -t 2000
+python3 mesh_tools/decimate.py -in meshes/visual -out meshes/collision -r 0.1 -e 0.0005 -j 8
+python3 mesh_tools/decimate.py -in meshes/collision -e 0.001 -pre simplified_
+"""
+
+# change this when the output of quadric_decimate changes
+DECIMATE_CACHE_VERSION = "decimate:1"
+MESH_FORMATS = (".stl", ".obj", ".ply", ".off", ".dae")
+# weight of the planes holding the boundary edges in place
+BOUNDARY_WEIGHT = 1e3
+# minimum cosine between the normals of a face before and after a collapse
+FLIP_COSINE = 0.2
+# a closed mesh can not have fewer faces than a tetrahedron
+MIN_FACES = 4
+
+
+def weld_vertices(triangles: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Indexed mesh of (n, 3, 3) triangles, e.g. read from an STL file, the
+    vertices with the same coordinates being merged."""
+    points = np.asarray(triangles, dtype=np.float64).reshape(-1, 3)
+    vertices, inverse = np.unique(points, axis=0, return_inverse=True)
+    faces = inverse.reshape(-1, 3)
+    return vertices, remove_degenerate_faces(faces)
+
+
+def remove_degenerate_faces(faces: np.ndarray, repeated=True) -> np.ndarray:
+    """Drop the faces using a vertex twice and, if `repeated`, the faces
+    using the same vertices as a previous one."""
+    keep = (
+        (faces[:, 0] != faces[:, 1])
+        & (faces[:, 1] != faces[:, 2])
+        & (faces[:, 2] != faces[:, 0])
+    )
+    faces = faces[keep]
+    if repeated:
+        _, first = np.unique(np.sort(faces, axis=1), axis=0, return_index=True)
+        faces = faces[np.sort(first)]
+    return faces
+
+
+def scatter_sum(index: np.ndarray, values: np.ndarray, size: int) -> np.ndarray:
+    """Sum the rows of `values` into `size` rows by `index`."""
+    flat = values.reshape(len(values), -1)
+    columns = [
+        np.bincount(index, weights=flat[:, j], minlength=size)
+        for j in range(flat.shape[1])
+    ]
+    return np.stack(columns, axis=1).reshape((size,) + values.shape[1:])
+
+
+def plane_quadrics(normals: np.ndarray, points: np.ndarray, weights=1.0) -> np.ndarray:
+    """(k, 4, 4) quadrics of the planes through `points` with unit `normals`."""
+    planes = np.concatenate(
+        [normals, -np.einsum("ij,ij->i", normals, points)[:, None]], axis=1
+    )
+    return np.asarray(weights)[..., None, None] * planes[:, :, None] * planes[:, None, :]
+
+
+def face_normals(vertices: np.ndarray, faces: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Unit normals and doubled areas of the faces."""
+    triangles = vertices[faces]
+    normals = np.cross(
+        triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0]
+    )
+    areas = np.linalg.norm(normals, axis=1)
+    normals = np.divide(
+        normals, areas[:, None], out=np.zeros_like(normals), where=areas[:, None] > 0
+    )
+    return normals, areas
+
+
+def mesh_edges(faces: np.ndarray, n_vertices: int):
+    """Unique edges (a < b), the number of faces of each and for each face
+    edge (3 per face) the index of its unique edge."""
+    pairs = faces[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2)
+    pairs = np.sort(pairs, axis=1)
+    keys = pairs[:, 0] * n_vertices + pairs[:, 1]
+    unique, index, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    edges = np.stack([unique // n_vertices, unique % n_vertices], axis=1)
+    return edges, counts, index.reshape(-1, 3)
+
+
+def vertex_quadrics(vertices: np.ndarray, faces: np.ndarray) -> np.ndarray:
+    """Quadrics of the face planes around each vertex, plus the planes
+    holding the boundary edges."""
+    n = len(vertices)
+    normals, _ = face_normals(vertices, faces)
+    triangles = vertices[faces]
+    face_quadrics = plane_quadrics(normals, triangles[:, 0])
+    quadrics = scatter_sum(faces.ravel(), np.repeat(face_quadrics, 3, axis=0), n)
+    edges, counts, face_edges = mesh_edges(faces, n)
+    boundary = counts[face_edges] == 1
+    if boundary.any():
+        face_index, corner = np.nonzero(boundary)
+        a = faces[face_index, corner]
+        b = faces[face_index, (corner + 1) % 3]
+        direction = vertices[b] - vertices[a]
+        side = np.cross(direction, normals[face_index])
+        lengths = np.linalg.norm(side, axis=1)
+        side = np.divide(
+            side, lengths[:, None], out=np.zeros_like(side), where=lengths[:, None] > 0
+        )
+        boundary_quadrics = plane_quadrics(side, vertices[a], BOUNDARY_WEIGHT)
+        index = np.concatenate([a, b])
+        quadrics += scatter_sum(index, np.concatenate([boundary_quadrics] * 2), n)
+    return quadrics
+
+
+def quadric_cost(quadrics: np.ndarray, points: np.ndarray) -> np.ndarray:
+    homogeneous = np.concatenate([points, np.ones((len(points), 1))], axis=1)
+    return np.einsum("ij,ijk,ik->i", homogeneous, quadrics, homogeneous)
+
+
+def collapse_targets(
+    vertices: np.ndarray, quadrics: np.ndarray, edges: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Optimal position and cost of collapsing each edge. Where the quadric
+    is singular, or its optimum far from the edge, the best of the two
+    vertices and the midpoint is used."""
+    a, b = edges[:, 0], edges[:, 1]
+    q = quadrics[a] + quadrics[b]
+    p, r = vertices[a], vertices[b]
+    candidates = np.stack([p, r, (p + r) / 2])
+    costs = np.stack([quadric_cost(q, c) for c in candidates])
+    best = np.argmin(costs, axis=0)
+    positions = candidates[best, np.arange(len(edges))]
+    cost = costs[best, np.arange(len(edges))]
+
+    matrix = q[:, :3, :3]
+    scale = np.einsum("ijj->i", matrix) ** 3
+    solvable = np.abs(np.linalg.det(matrix)) > 1e-10 * np.maximum(scale, 1e-300)
+    if solvable.any():
+        optimum = np.linalg.solve(matrix[solvable], -q[solvable, :3, 3:])[..., 0]
+        length = np.linalg.norm(r[solvable] - p[solvable], axis=1)
+        near = np.linalg.norm(optimum - candidates[2][solvable], axis=1) <= length
+        index = np.nonzero(solvable)[0][near]
+        optimum_cost = quadric_cost(q[index], optimum[near])
+        better = optimum_cost < cost[index]
+        positions[index[better]] = optimum[near][better]
+        cost[index[better]] = optimum_cost[better]
+    return positions, np.maximum(cost, 0.0)
+
+
+def independent_edges(
+    edges: np.ndarray, rank: np.ndarray, faces: np.ndarray, n_vertices: int
+) -> np.ndarray:
+    """The edges ranked first among all the edges touching the faces around
+    them, so that no face is touched by two of them. `rank` is a unique
+    rank per edge, len(edges) for the edges not allowed."""
+    sentinel = len(edges)
+    vertex_rank = np.full(n_vertices, sentinel)
+    np.minimum.at(vertex_rank, edges[:, 0], rank)
+    np.minimum.at(vertex_rank, edges[:, 1], rank)
+    face_rank = vertex_rank[faces].min(axis=1)
+    around_rank = np.full(n_vertices, sentinel)
+    for corner in range(3):
+        np.minimum.at(around_rank, faces[:, corner], face_rank)
+    return (
+        (rank < sentinel)
+        & (around_rank[edges[:, 0]] == rank)
+        & (around_rank[edges[:, 1]] == rank)
+    )
+
+
+def link_condition(
+    edges: np.ndarray, counts: np.ndarray, selected: np.ndarray, n_vertices: int
+) -> np.ndarray:
+    """For the selected edges, whether the endpoints only share the
+    neighbors opposite to the edge, otherwise the collapse would glue two
+    sheets of the surface together."""
+    sources = np.concatenate([edges[:, 0], edges[:, 1]])
+    targets = np.concatenate([edges[:, 1], edges[:, 0]])
+    order = np.argsort(sources, kind="stable")
+    targets = targets[order]
+    starts = np.searchsorted(sources[order], np.arange(n_vertices + 1))
+
+    chosen = np.nonzero(selected)[0]
+    endpoints = np.concatenate([edges[chosen, 0], edges[chosen, 1]])
+    owners = np.concatenate([chosen, chosen])
+    lengths = starts[endpoints + 1] - starts[endpoints]
+    offsets = np.repeat(starts[endpoints] - np.cumsum(lengths) + lengths, lengths)
+    neighbors = targets[np.arange(lengths.sum()) + offsets]
+    owners = np.repeat(owners, lengths)
+    keys, key_counts = np.unique(
+        owners.astype(np.int64) * n_vertices + neighbors, return_counts=True
+    )
+    common = np.bincount(
+        keys[key_counts > 1] // n_vertices, minlength=len(edges)
+    )
+    return common[chosen] <= counts[chosen]
+
+
+def quadric_decimate(
+    vertices: np.ndarray,
+    faces: np.ndarray,
+    target_faces: Optional[int] = None,
+    max_error: Optional[float] = None,
+    max_passes=1000,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Collapse edges until the mesh has at most `target_faces` faces or no
+    collapse moves the surface by less than `max_error` (in the units of the
+    vertices), whichever comes first."""
+    assert (
+        target_faces is not None or max_error is not None
+    ), "Either target_faces or max_error is required"
+    vertices = np.array(vertices, dtype=np.float64)
+    faces = remove_degenerate_faces(np.asarray(faces, dtype=np.int64))
+    target_faces = MIN_FACES if target_faces is None else max(target_faces, MIN_FACES)
+    max_cost = np.inf if max_error is None else max_error**2
+    quadrics = vertex_quadrics(vertices, faces)
+    n = len(vertices)
+    # the collapse of the edges is only computed again around the vertices
+    # moved by the previous pass
+    keys = np.empty(0, dtype=np.int64)
+    positions = np.empty((0, 3))
+    cost = np.empty(0)
+    moved_vertex = np.zeros(n, dtype=bool)
+    rng = np.random.default_rng(0)
+
+    for _ in range(max_passes):
+        if len(faces) <= target_faces:
+            break
+        edges, counts, _ = mesh_edges(faces, n)
+        new_keys = edges[:, 0] * n + edges[:, 1]
+        index = np.minimum(np.searchsorted(keys, new_keys), max(len(keys) - 1, 0))
+        known = (keys[index] == new_keys) if len(keys) else np.zeros(len(edges), bool)
+        stale = ~known | moved_vertex[edges[:, 0]] | moved_vertex[edges[:, 1]]
+        new_positions = np.empty((len(edges), 3))
+        new_cost = np.empty(len(edges))
+        new_positions[~stale] = positions[index[~stale]]
+        new_cost[~stale] = cost[index[~stale]]
+        new_positions[stale], new_cost[stale] = collapse_targets(
+            vertices, quadrics, edges[stale]
+        )
+        keys, positions, cost = new_keys, new_positions, new_cost
+        moved_vertex[:] = False
+        # an interior edge between two boundary vertices would pinch the surface
+        boundary_vertex = np.zeros(n, dtype=bool)
+        boundary_vertex[edges[counts == 1].ravel()] = True
+        allowed = (cost <= max_cost) & ~(
+            (counts > 1) & boundary_vertex[edges[:, 0]] & boundary_vertex[edges[:, 1]]
+        )
+        if not allowed.any():
+            break
+        # the ties, e.g. on flat areas, are broken randomly: ordered by index
+        # the edges would form chains with few local minima
+        rank = np.full(len(edges), len(edges))
+        allowed_index = np.nonzero(allowed)[0]
+        order = np.lexsort((rng.random(len(allowed_index)), cost[allowed_index]))
+        rank[allowed_index[order]] = np.arange(len(allowed_index))
+        selected = independent_edges(edges, rank, faces, n)
+        selected[selected] = link_condition(edges, counts, selected, n)
+
+        # reject the collapses flipping or flattening a face around them
+        chosen = np.nonzero(selected)[0]
+        owner = np.full(n, -1)
+        owner[edges[chosen, 0]] = chosen
+        owner[edges[chosen, 1]] = chosen
+        face_owner = owner[faces].max(axis=1)
+        touched = np.nonzero(face_owner >= 0)[0]
+        touched_edges = face_owner[touched]
+        moved = (faces[touched] == edges[touched_edges, 0][:, None]) | (
+            faces[touched] == edges[touched_edges, 1][:, None]
+        )
+        kept = moved.sum(axis=1) == 1  # the faces of the edge itself disappear
+        old_normals, old_areas = face_normals(vertices, faces[touched])
+        new_triangles = vertices[faces[touched]]
+        new_triangles[moved] = np.repeat(
+            positions[touched_edges][:, None], 3, axis=1
+        )[moved]
+        new_normals = np.cross(
+            new_triangles[:, 1] - new_triangles[:, 0],
+            new_triangles[:, 2] - new_triangles[:, 0],
+        )
+        new_areas = np.linalg.norm(new_normals, axis=1)
+        flipped = kept & (
+            np.einsum("ij,ij->i", old_normals, new_normals)
+            < FLIP_COSINE * new_areas
+        )
+        flipped |= kept & (new_areas <= 1e-12 * np.maximum(old_areas, 1e-300))
+        selected[touched_edges[flipped]] = False
+
+        # keep the cheapest collapses, not going below the target
+        chosen = np.nonzero(selected)[0]
+        chosen = chosen[np.argsort(rank[chosen], kind="stable")]
+        removed = np.cumsum(counts[chosen])
+        chosen = chosen[removed - counts[chosen] < len(faces) - target_faces]
+        if len(chosen) == 0:
+            break
+        a, b = edges[chosen, 0], edges[chosen, 1]
+        vertices[a] = positions[chosen]
+        quadrics[a] += quadrics[b]
+        moved_vertex[a] = True
+        remap = np.arange(n)
+        remap[b] = a
+        faces = remove_degenerate_faces(remap[faces], repeated=False)
+        profiler.count("edge_collapses", len(chosen))
+    return compact_mesh(vertices, remove_degenerate_faces(faces))
+
+
+def read_mesh(path) -> Tuple[np.ndarray, np.ndarray]:
+    if path.lower().endswith(".stl"):
+        return weld_vertices(read_stl_triangles(path))
+    import trimesh
+
+    mesh = trimesh.load(path, force="mesh", process=False)
+    vertices, faces = np.asarray(mesh.vertices), np.asarray(mesh.faces)
+    vertices, inverse = np.unique(vertices, axis=0, return_inverse=True)
+    return vertices, remove_degenerate_faces(inverse.reshape(-1)[faces])
+
+
+def write_mesh(path, vertices: np.ndarray, faces: np.ndarray, file_type=None):
+    """Write a binary STL, or any format trimesh can export, by extension
+    unless `file_type` is given."""
+    file_type = os.path.splitext(path)[1][1:].lower() if file_type is None else file_type
+    if file_type == "stl":
+        write_binary_stl(path, vertices, faces)
+        return
+    import trimesh
+
+    trimesh.Trimesh(vertices=vertices, faces=faces, process=False).export(
+        path, file_type=file_type
+    )
+
+
+def target_face_count(
+    faces: int, target_faces: Optional[int] = None, ratio: Optional[float] = None
+) -> Optional[int]:
+    """The larger of `target_faces` and `ratio` times the faces."""
+    if ratio is None:
+        return target_faces
+    ratio_target = int(np.ceil(faces * ratio))
+    return ratio_target if target_faces is None else max(target_faces, ratio_target)
+
+
+def decimate_file(
+    input_path,
+    produced_path,
+    target_faces: Optional[int] = None,
+    ratio: Optional[float] = None,
+    max_error: Optional[float] = None,
+) -> dict:
+    """Write the decimated mesh of `input_path` to `produced_path`, in the
+    format of its extension. Never raises: the error is returned in the
+    result."""
+    result = {"input": input_path, "error": None, "cached": False}
+    start = time.perf_counter()
+    try:
+        vertices, faces = read_mesh(input_path)
+        target = target_face_count(len(faces), target_faces, ratio)
+        new_vertices, new_faces = quadric_decimate(vertices, faces, target, max_error)
+        result["faces"] = [len(faces), len(new_faces)]
+        write_mesh(produced_path, new_vertices, new_faces)
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+        if os.path.exists(produced_path):
+            os.remove(produced_path)
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def _decimate_job(args) -> dict:
+    return decimate_file(*args)
+
+
+@profiler.profiled("decimate")
+def decimate_files(
+    paths: List[Tuple[str, str]],
+    target_faces: Optional[int] = None,
+    ratio: Optional[float] = None,
+    max_error: Optional[float] = None,
+    workers: Optional[int] = None,
+    cache: Optional[MeshCache] = None,
+) -> List[dict]:
+    """Decimate the (input, output) meshes with `workers` processes, a
+    failed mesh being reported in its result. Each output is replaced, not
+    written into, so the files hardlinked to it are left unchanged."""
+    results = [None] * len(paths)
+    jobs, pending = [], []
+    params = f"{DECIMATE_CACHE_VERSION}:{target_faces}:{ratio}:{max_error}"
+    for index, (input_path, output_path) in enumerate(paths):
+        key = None
+        if cache is not None:
+            key = cache.key(input_path, params, os.path.splitext(output_path)[1].lower())
+            if cache.fetch(key, output_path):
+                results[index] = {
+                    "input": input_path, "error": None, "cached": True, "seconds": 0.0
+                }
+                continue
+        out_dir, out_name = os.path.split(os.path.abspath(output_path))
+        # keep the extension, it gives the format
+        produced_path = os.path.join(out_dir, f".tmp_decimate_{os.getpid()}_{out_name}")
+        jobs.append((input_path, produced_path, target_faces, ratio, max_error))
+        pending.append((index, output_path, produced_path, key))
+
+    workers = os.cpu_count() if workers is None else workers
+    workers = max(1, min(workers, len(jobs)))
+    if workers == 1:
+        produced = list(map(_decimate_job, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            produced = list(executor.map(_decimate_job, jobs))
+    for (index, output_path, produced_path, key), result in zip(pending, produced):
+        if result["error"] is None:
+            if cache is not None:
+                cache.store(key, produced_path, output_path)
+            else:
+                replace_file(produced_path, output_path)
+        results[index] = result
+
+    for index, result in enumerate(results, 1):
+        status = "CACHED" if result["cached"] else "OK"
+        status = status if result["error"] is None else "FAILED"
+        faces = ""
+        if "faces" in result:
+            faces = f" {result['faces'][0]} -> {result['faces'][1]} faces"
+        print(
+            f"[{index}/{len(results)}] {status} {os.path.basename(result['input'])}"
+            f"{faces} ({result['seconds']:.2f}s)"
+        )
+        if result["error"] is not None:
+            print(f"    {result['error']}")
+    failed = sum(result["error"] is not None for result in results)
+    profiler.count("files_read", len(results))
+    profiler.count("files_cached", sum(result["cached"] for result in results))
+    profiler.count("files_failed", failed)
+    print(f"Decimated {len(results) - failed}/{len(results)} meshes")
+    if cache is not None:
+        cache.print_stats()
+    return results
+
+
+def directory_jobs(in_dir, out_dir=None, prefix="") -> List[Tuple[str, str]]:
+    out_dir = in_dir if out_dir is None else out_dir
+    os.makedirs(out_dir, exist_ok=True)
+    return [
+        (os.path.join(in_dir, name), os.path.join(out_dir, prefix + name))
+        for name in sorted(os.listdir(in_dir))
+        if name.lower().endswith(MESH_FORMATS)
+        and not name.startswith(".")
+        and not (prefix and name.startswith(prefix))
+    ]
+
+
+def main(argv=None):
+    import argparse
+    from .mesh_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_SIZE
+
+    parser = argparse.ArgumentParser(
+        description="Simplify meshes by quadric error edge collapses"
+    )
+    parser.add_argument(
+        "-in", "--input_dir", type=str, help="Directory containing the meshes"
+    )
+    parser.add_argument(
+        "-out",
+        "--output_dir",
+        type=str,
+        help="Directory of the simplified meshes, the input one by default",
+        default=None,
+    )
+    parser.add_argument(
+        "-pre",
+        "--prefix",
+        type=str,
+        help="Prefix of the simplified mesh files, empty to replace the meshes",
+        default="",
+    )
+    parser.add_argument(
+        "-t", "--target_faces", type=int, help="Target number of faces", default=None
+    )
+    parser.add_argument(
+        "-r",
+        "--ratio",
+        type=float,
+        help="Target number of faces as a fraction of the faces of each mesh",
+        default=None,
+    )
+    parser.add_argument(
+        "-e",
+        "--max_error",
+        type=float,
+        help="Stop before moving the surface by more than this distance",
+        default=None,
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        help="Number of worker processes, defaults to the number of cores",
+        default=None,
+    )
+    parser.add_argument(
+        "-cache",
+        "--cache_dir",
+        type=str,
+        help="Directory of the simplified meshes cache",
+        default=DEFAULT_CACHE_DIR,
+    )
+    parser.add_argument(
+        "-cs",
+        "--cache_size",
+        type=float,
+        help="Maximum size of the cache in MB",
+        default=DEFAULT_MAX_SIZE / 1024**2,
+    )
+    parser.add_argument(
+        "-ncache", "--no_cache", action="store_true", help="Disable the cache"
+    )
+    profiler.add_arguments(parser)
+    args = parser.parse_args(argv)
+    profiler.enable_from_args(args)
+    assert not (
+        args.target_faces is None and args.ratio is None and args.max_error is None
+    ), "One of --target_faces, --ratio or --max_error is required"
+
+    cache = None
+    if not args.no_cache:
+        cache = MeshCache(args.cache_dir, int(args.cache_size * 1024**2))
+    jobs = directory_jobs(args.input_dir, args.output_dir, args.prefix)
+    if len(jobs) == 0:
+        print(f"No meshes found in {args.input_dir}")
+        return
+    decimate_files(
+        jobs, args.target_faces, args.ratio, args.max_error, args.workers, cache
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+import fcntl
+import os, sys
+import shutil
+import threading
+from typing import Dict, List, Optional
+
+if not __package__:
+    # run as a script rather than imported from the mesh_tools package
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    __package__ = "mesh_tools"
+from .mesh_cache import file_digest
+import profiler
+
+"""
+Store each distinct mesh once: the meshes with the same content are reflinks
+(copy-on-write clones) or hardlinks of one file instead of copies, falling
+back to copying where the filesystem supports neither.
+
+Only the mesh files are deduplicated, the other files (URDF, xacro...) are
+reflinked or copied, since some tools rewrite them in place. The mesh tools
+always replace their outputs instead of writing into them, so a hardlinked
+mesh is never modified through another path.
+
+A tree can be materialized at a destination, e.g. the visual meshes as the
+collision meshes, linking the meshes to the identical ones already there, or
+an existing tree can be deduplicated in place.
+
+examples:
+python3 mesh_tools/dedup.py -src pkg/meshes/visual -dst pkg/meshes/collision
+python3 mesh_tools/dedup.py -root ~/ws/src/arm-models/meshes
+python3 mesh_tools/dedup.py -root ~/ws/src/arm-models/meshes -mode reflink -n
+"""
+
+MESH_EXTENSIONS = (".stl", ".dae", ".obj", ".ply", ".off", ".glb", ".gltf")
+# auto: reflink, else hardlink, else copy
+LINK_MODES = ("auto", "reflink", "hardlink", "copy")
+# _IOW(0x94, 9, int), see <linux/fs.h>
+FICLONE = 0x40049409
+
+
+def is_mesh(path) -> bool:
+    return path.lower().endswith(MESH_EXTENSIONS)
+
+
+def reflink(src_path, dst_path):
+    """Clone the content of `src_path` into a new `dst_path` sharing its
+    blocks, raising OSError where the filesystem can not."""
+    with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.remove(dst_path)
+            raise
+
+
+def link_file(src_path, dst_path, mode="auto") -> str:
+    """Atomically put the content of `src_path` at `dst_path`, sharing its
+    storage as `mode` allows, and return how: "reflink", "hardlink" or
+    "copy". The old `dst_path` is replaced, not written into."""
+    assert mode in LINK_MODES, f"Unknown link mode: {mode}"
+    tmp_path = os.path.join(
+        os.path.dirname(os.path.abspath(dst_path)),
+        f".tmp_{os.getpid()}_{threading.get_ident()}_{os.path.basename(dst_path)}",
+    )
+    method = "copy"
+    if mode in ("auto", "reflink"):
+        try:
+            reflink(src_path, tmp_path)
+            shutil.copystat(src_path, tmp_path)
+            method = "reflink"
+        except OSError:
+            pass
+    if method == "copy" and mode in ("auto", "hardlink"):
+        try:
+            os.link(src_path, tmp_path)
+            method = "hardlink"
+        except OSError:
+            pass
+    if method == "copy":
+        shutil.copy2(src_path, tmp_path)
+    os.replace(tmp_path, dst_path)
+    return method
+
+
+class DedupStore(object):
+    """The distinct meshes of a destination, by content hash.
+
+    The known files are only hashed when a file of the same size is placed,
+    so indexing a large repository is a walk of its directories.
+    """
+
+    def __init__(self, mode="auto") -> None:
+        assert mode in LINK_MODES, f"Unknown link mode: {mode}"
+        self.mode = mode
+        self.by_digest: Dict[str, str] = {}
+        self.digests: Dict[str, str] = {}
+        # size: known files not hashed yet
+        self.unhashed: Dict[int, List[str]] = {}
+        self.lock = threading.Lock()
+        self.stats = {
+            "unique": 0,
+            "reflink": 0,
+            "hardlink": 0,
+            "copy": 0,
+            "kept": 0,
+            "bytes_saved": 0,
+        }
+
+    def index(self, root):
+        """Make the meshes under `root` available to link to."""
+        for dirpath, dirs, files in os.walk(root):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.abspath(os.path.join(dirpath, name))
+                if is_mesh(name) and not name.startswith(".") and os.path.isfile(path):
+                    self.unhashed.setdefault(os.path.getsize(path), []).append(path)
+
+    def _digest(self, path) -> str:
+        profiler.count("files_hashed")
+        return file_digest(path).hexdigest()
+
+    def _add(self, path, digest):
+        self.digests[path] = digest
+        self.by_digest.setdefault(digest, path)
+
+    def _forget(self, path):
+        """Forget the content of a file about to be replaced."""
+        digest = self.digests.pop(path, None)
+        if digest is not None and self.by_digest.get(digest) == path:
+            del self.by_digest[digest]
+
+    def find(self, size: int, digest: str) -> Optional[str]:
+        """A known file with this content, hashing the known ones of the same
+        size first."""
+        for path in self.unhashed.pop(size, []):
+            if os.path.exists(path):
+                self._add(path, self._digest(path))
+        return self.by_digest.get(digest)
+
+    def place(self, src_path, dst_path) -> str:
+        """Put the content of `src_path` at `dst_path`, linked to an identical
+        mesh when there is one, and return how."""
+        dst_path = os.path.abspath(dst_path)
+        size = os.path.getsize(src_path)
+        digest = self._digest(src_path)
+        with self.lock:
+            existing = self.find(size, digest)
+            if existing is not None and os.path.exists(dst_path):
+                if os.path.samefile(existing, dst_path):
+                    self.stats["kept"] += 1
+                    return "kept"
+            if existing is None and os.path.exists(dst_path):
+                if os.path.getsize(dst_path) == size and self._digest(dst_path) == digest:
+                    # already there, e.g. merged before
+                    self._add(dst_path, digest)
+                    self.stats["kept"] += 1
+                    return "kept"
+            self._forget(dst_path)
+            if existing is None:
+                # the first of its content, never hardlinked outside the store
+                first_mode = "copy" if self.mode == "copy" else "reflink"
+                method = link_file(src_path, dst_path, first_mode)
+                self._add(dst_path, digest)
+                self.stats["unique"] += 1
+            else:
+                method = link_file(existing, dst_path, self.mode)
+                self.digests[dst_path] = digest
+                if method != "copy":
+                    self.stats["bytes_saved"] += size
+            self.stats[method] += 1
+        profiler.count(f"files_{method}")
+        return method
+
+    def copy_file(self, src_path, dst_path) -> str:
+        """Place a mesh, or copy any other file."""
+        os.makedirs(os.path.dirname(os.path.abspath(dst_path)), exist_ok=True)
+        if is_mesh(src_path):
+            return self.place(src_path, dst_path)
+        method = link_file(src_path, dst_path, "copy" if self.mode == "copy" else "reflink")
+        with self.lock:
+            self.stats[method] += 1
+        return method
+
+    def copy_tree(self, src_dir, dst_dir):
+        """Materialize the tree `src_dir` at `dst_dir`, like `cp -r` when
+        `dst_dir` does not exist."""
+        for dirpath, dirs, files in os.walk(src_dir):
+            dirs.sort()
+            target_dir = os.path.join(dst_dir, os.path.relpath(dirpath, src_dir))
+            os.makedirs(target_dir, exist_ok=True)
+            for name in sorted(files):
+                self.copy_file(os.path.join(dirpath, name), os.path.join(target_dir, name))
+
+    def dedup_tree(self, root):
+        """Link the identical meshes under `root` to one of them."""
+        for dirpath, dirs, files in os.walk(root):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.abspath(os.path.join(dirpath, name))
+                if not is_mesh(name) or name.startswith(".") or os.path.islink(path):
+                    continue
+                size = os.path.getsize(path)
+                digest = self._digest(path)
+                existing = self.find(size, digest)
+                if existing is None or existing == path:
+                    self._add(path, digest)
+                    self.stats["unique"] += 1
+                elif os.path.samefile(existing, path):
+                    self.stats["kept"] += 1
+                else:
+                    method = link_file(existing, path, self.mode)
+                    self.stats[method] += 1
+                    if method != "copy":
+                        self.stats["bytes_saved"] += size
+
+    def print_stats(self):
+        stats = self.stats
+        print(
+            f"{stats['unique']} unique meshes, linked {stats['reflink']} by reflink "
+            f"and {stats['hardlink']} by hardlink, copied {stats['copy']}, "
+            f"kept {stats['kept']}, saved {stats['bytes_saved'] / 1e6:.1f} MB"
+        )
+
+
+def report_duplicates(root):
+    """Print the groups of identical meshes not sharing their inode. Reflinks
+    can not be told from copies, so they are reported too."""
+    groups: Dict[str, List[str]] = {}
+    for dirpath, dirs, files in os.walk(root):
+        for name in files:
+            path = os.path.join(dirpath, name)
+            if is_mesh(name) and not os.path.islink(path):
+                groups.setdefault(file_digest(path).hexdigest(), []).append(path)
+    saved = 0
+    for paths in groups.values():
+        inodes = {os.stat(path).st_ino for path in paths}
+        if len(inodes) > 1:
+            saved += os.path.getsize(paths[0]) * (len(inodes) - 1)
+            print(f"{len(inodes)} copies: {', '.join(sorted(paths))}")
+    print(f"Deduplicating would save {saved / 1e6:.1f} MB")
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Store identical meshes once with reflinks or hardlinks"
+    )
+    parser.add_argument(
+        "-src", "--source_dir", type=str, help="Directory to copy", default=None
+    )
+    parser.add_argument(
+        "-dst",
+        "--destination_dir",
+        type=str,
+        help="Where to materialize --source_dir",
+        default=None,
+    )
+    parser.add_argument(
+        "-root",
+        "--root_dir",
+        type=str,
+        help="Directory to deduplicate in place",
+        default=None,
+    )
+    parser.add_argument(
+        "-mode",
+        "--link_mode",
+        type=str,
+        help="How the identical meshes share their content, auto tries reflink, "
+        "then hardlink, then copy",
+        default="auto",
+        choices=LINK_MODES,
+    )
+    parser.add_argument(
+        "-n",
+        "--dry_run",
+        action="store_true",
+        help="With --root_dir, only report the duplicated meshes",
+    )
+    profiler.add_arguments(parser)
+    args = parser.parse_args(argv)
+    profiler.enable_from_args(args)
+
+    store = DedupStore(args.link_mode)
+    if args.root_dir is not None:
+        if args.dry_run:
+            report_duplicates(args.root_dir)
+            return
+        with profiler.stage("dedup"):
+            store.dedup_tree(args.root_dir)
+    else:
+        assert (
+            args.source_dir is not None and args.destination_dir is not None
+        ), "Either --root_dir or both --source_dir and --destination_dir are required"
+        with profiler.stage("materialize"):
+            if os.path.isdir(args.destination_dir):
+                store.index(args.destination_dir)
+            store.copy_tree(args.source_dir, args.destination_dir)
+    store.print_stats()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import hashlib
+import os
+import shutil
+import threading
+from typing import Optional, Union
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "urdf2xacro",
+    "meshes",
+)
+DEFAULT_MAX_SIZE = 2 * 1024**3
+
+
+def file_digest(path, hasher=None, chunk_size=1 << 20):
+    hasher = hashlib.sha256() if hasher is None else hasher
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            hasher.update(chunk)
+    return hasher
+
+
+def replace_file(src_path, dst_path, link=False):
+    """Atomically put `src_path` at `dst_path`, by hardlink (falling back to
+    copy) if `link` is True, otherwise by moving it. The old `dst_path` is
+    replaced instead of being written in place, so files sharing its inode
+    are never modified."""
+    if not link:
+        os.replace(src_path, dst_path)
+        return
+    if os.path.exists(dst_path) and os.path.samefile(src_path, dst_path):
+        # renaming a hardlink over itself is a no-op that keeps the source
+        return
+    tmp_path = os.path.join(
+        os.path.dirname(os.path.abspath(dst_path)),
+        f".tmp_{os.getpid()}_{threading.get_ident()}_{os.path.basename(dst_path)}",
+    )
+    try:
+        os.link(src_path, tmp_path)
+    except OSError:
+        shutil.copyfile(src_path, tmp_path)
+    os.replace(tmp_path, dst_path)
+
+
+class MeshCache(object):
+    """Content-addressed on-disk cache of processed meshes.
+
+    Entries are keyed by the hash of the input mesh bytes and the processing
+    parameters, and evicted in least recently used order once the total size
+    exceeds `max_size` bytes. Outputs are hardlinked to the entries when
+    possible, so they must be replaced (see `replace_file`) rather than
+    modified in place.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_size=DEFAULT_MAX_SIZE) -> None:
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._size: Optional[int] = None
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(input_path, *params: Union[str, bytes]) -> str:
+        hasher = file_digest(input_path)
+        for param in params:
+            param = param.encode() if isinstance(param, str) else param
+            hasher.update(len(param).to_bytes(8, "little"))
+            hasher.update(param)
+        return hasher.hexdigest()
+
+    def entry_path(self, key, output_path) -> str:
+        ext = os.path.splitext(output_path)[1]
+        return os.path.join(self.cache_dir, key[:2], key + ext)
+
+    def fetch(self, key, output_path) -> bool:
+        """Materialize the cached entry at `output_path` if there is one."""
+        entry = self.entry_path(key, output_path)
+        try:
+            replace_file(entry, output_path, link=True)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return False
+        # the modification time of the entries orders the eviction
+        os.utime(entry)
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def store(self, key, produced_path, output_path):
+        """Move a freshly produced mesh into the cache and materialize it at
+        `output_path`."""
+        entry = self.entry_path(key, output_path)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        os.replace(produced_path, entry)
+        replace_file(entry, output_path, link=True)
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, _, size in self._entries())
+            else:
+                self._size += os.path.getsize(entry)
+            full = self._size > self.max_size
+        if full:
+            self.evict()
+
+    def size(self) -> int:
+        return sum(size for _, _, size in self._entries())
+
+    def _entries(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_mtime, stat.st_size
+
+    def evict(self, max_size: Optional[int] = None):
+        max_size = self.max_size if max_size is None else max_size
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda entry: entry[1])
+            total = sum(size for _, _, size in entries)
+            for path, _, size in entries:
+                if total <= max_size:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                total -= size
+                self.evictions += 1
+            self._size = total
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def print_stats(self):
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        print(
+            f"Mesh cache: {self.hits} hits, {self.misses} misses "
+            f"({rate:.0%} hit rate), {self.evictions} evictions"
+        )
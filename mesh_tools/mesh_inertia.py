@@ -0,0 +1,429 @@
+import functools
+import json
+import math
+import os, sys
+import re
+import tempfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+if not __package__:
+    # run as a script rather than imported from the mesh_tools package
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    __package__ = "mesh_tools"
+from .mesh_cache import MeshCache
+from .mesh_io import iter_triangle_chunks, read_stl_triangles
+import profiler
+
+"""
+Compute the mass, center of mass and inertia tensor of the links from their
+meshes, for a uniform density or a given total mass per link, and write them
+in the links_inertial.json format used by URDFer.replace_link_inertial.
+
+The mass properties of a closed mesh are the sums of those of the signed
+tetrahedra joining the origin to each triangle. Each distinct mesh file is
+processed once, in parallel, and the results are cached by mesh content.
+
+examples:
+python3 mesh_tools/mesh_inertia.py -in robot.urdf -pp ~/ws/src -out urdf_config_robot/links_inertial.json
+python3 mesh_tools/mesh_inertia.py -in robot.urdf -src collision -d 2700 -m base_link 3.2 -m link1 1.1
+"""
+
+# change this when the output of mesh_mass_properties changes
+INERTIA_CACHE_VERSION = "mass_properties:1"
+DEFAULT_DENSITY = 1000.0  # kg/m^3
+_PREFIX_VAR = re.compile(r"^\$\{[^}]*\}")
+_FIND = re.compile(r"^\$\(find ([^)]+)\)/?")
+
+
+def triangles_mass_properties(
+    triangles: np.ndarray, chunk_size=200_000
+) -> Tuple[float, np.ndarray, np.ndarray]:
+    """Volume, first moment (volume times centroid) and second moment
+    integral of x x^T over the solid bounded by the (n, 3, 3) triangles, for
+    a unit density. The triangles are read chunk by chunk, so a memory-mapped
+    STL is never copied as a whole."""
+    volume = 0.0
+    first = np.zeros(3)
+    second = np.zeros((3, 3))
+    for chunk in iter_triangle_chunks(triangles, chunk_size):
+        a, b, c = chunk[:, 0], chunk[:, 1], chunk[:, 2]
+        # six times the signed volume of the tetrahedra (origin, a, b, c)
+        det = np.einsum("ij,ij->i", a, np.cross(b, c))
+        total = a + b + c
+        volume += det.sum() / 6.0
+        first += det @ total / 24.0
+        outer = (
+            np.einsum("i,ij,ik->jk", det, a, a)
+            + np.einsum("i,ij,ik->jk", det, b, b)
+            + np.einsum("i,ij,ik->jk", det, c, c)
+            + np.einsum("i,ij,ik->jk", det, total, total)
+        )
+        second += outer / 120.0
+    if volume < 0:
+        # the triangles are wound inwards
+        volume, first, second = -volume, -first, -second
+    return float(volume), first, second
+
+
+def read_mesh_triangles(path) -> np.ndarray:
+    if path.lower().endswith(".stl"):
+        return read_stl_triangles(path)
+    import trimesh
+
+    return trimesh.load(path, force="mesh").triangles
+
+
+def mesh_mass_properties(path) -> dict:
+    """Unit density mass properties of a mesh file, in its own frame."""
+    volume, first, second = triangles_mass_properties(read_mesh_triangles(path))
+    return {"volume": volume, "first": first.tolist(), "second": second.tolist()}
+
+
+def rpy_matrix(rpy: Iterable[float]) -> np.ndarray:
+    """Rotation of the URDF fixed axis roll, pitch and yaw angles."""
+    roll, pitch, yaw = rpy
+    cr, sr = math.cos(roll), math.sin(roll)
+    cp, sp = math.cos(pitch), math.sin(pitch)
+    cy, sy = math.cos(yaw), math.sin(yaw)
+    return np.array(
+        [
+            [cy * cp, cy * sp * sr - sy * cr, cy * sp * cr + sy * sr],
+            [sy * cp, sy * sp * sr + cy * cr, sy * sp * cr - cy * sr],
+            [-sp, cp * sr, cp * cr],
+        ]
+    )
+
+
+def transform_properties(
+    properties: dict, scale: np.ndarray, rotation: np.ndarray, translation: np.ndarray
+) -> Tuple[float, np.ndarray, np.ndarray]:
+    """Mass properties of a mesh scaled then placed by its <origin>."""
+    factor = abs(float(np.prod(scale)))
+    volume = properties["volume"] * factor
+    first = factor * scale * np.asarray(properties["first"])
+    second = factor * np.outer(scale, scale) * np.asarray(properties["second"])
+    first_rotated = rotation @ first
+    first = first_rotated + volume * translation
+    second = (
+        rotation @ second @ rotation.T
+        + np.outer(first_rotated, translation)
+        + np.outer(translation, first_rotated)
+        + volume * np.outer(translation, translation)
+    )
+    return volume, first, second
+
+
+def inertial_from_properties(
+    volume: float, first: np.ndarray, second: np.ndarray, density: float
+) -> dict:
+    """links_inertial.json entry of a solid of the given unit density
+    properties, with the inertia tensor taken at the center of mass."""
+    center = first / volume
+    covariance = density * (second - volume * np.outer(center, center))
+    inertia = np.trace(covariance) * np.eye(3) - covariance
+    return {
+        "mass": density * volume,
+        "origin": {"xyz": " ".join(f"{v:.9g}" for v in center), "rpy": "0 0 0"},
+        "inertia": {
+            "ixx": float(inertia[0, 0]),
+            "ixy": float(inertia[0, 1]),
+            "ixz": float(inertia[0, 2]),
+            "iyy": float(inertia[1, 1]),
+            "iyz": float(inertia[1, 2]),
+            "izz": float(inertia[2, 2]),
+        },
+    }
+
+
+def package_paths_from_env() -> List[str]:
+    paths = os.environ.get("ROS_PACKAGE_PATH", "")
+    return [path for path in paths.split(os.pathsep) if path]
+
+
+@functools.lru_cache(maxsize=None)
+def find_package(package, package_paths: Tuple[str, ...]) -> Optional[str]:
+    """Directory of a ROS package: one of `package_paths` or a directory
+    named `package` below one of them."""
+    for path in package_paths:
+        path = os.path.expanduser(path)
+        if os.path.basename(os.path.normpath(path)) == package:
+            return path
+        for root, dirs, _ in os.walk(path):
+            if package in dirs:
+                return os.path.join(root, package)
+    return None
+
+
+def resolve_mesh_path(
+    filename: str, base_dir, package_paths: List[str]
+) -> Optional[str]:
+    """Local path of a mesh filename of the URDF: package:// and $(find pkg)
+    are looked up in `package_paths`, relative paths are taken from
+    `base_dir`."""
+    match = _FIND.match(filename)
+    if match:
+        package, rest = match.group(1), filename[match.end() :]
+    elif filename.startswith("package://"):
+        package, _, rest = filename[len("package://") :].partition("/")
+    else:
+        if filename.startswith("file://"):
+            filename = filename[len("file://") :]
+        path = os.path.join(base_dir, os.path.expanduser(filename))
+        return path if os.path.exists(path) else None
+    root = find_package(package, tuple(package_paths))
+    if root is None:
+        return None
+    path = os.path.join(root, rest)
+    return path if os.path.exists(path) else None
+
+
+def _floats(text: Optional[str], default) -> np.ndarray:
+    return np.array([float(v) for v in text.split()]) if text else np.array(default)
+
+
+def link_meshes(link: ET.Element, source="visual") -> List[dict]:
+    """The mesh geometries of a <link> with their scale and <origin>."""
+    meshes = []
+    for element in link.findall(source):
+        mesh = element.find("geometry/mesh")
+        if mesh is None or mesh.get("filename") is None:
+            continue
+        origin = element.find("origin")
+        origin = {} if origin is None else origin.attrib
+        scale = _floats(mesh.get("scale"), [1.0, 1.0, 1.0])
+        meshes.append(
+            {
+                "filename": mesh.get("filename"),
+                "scale": scale if scale.size == 3 else np.repeat(scale[0], 3),
+                "xyz": _floats(origin.get("xyz"), [0.0, 0.0, 0.0]),
+                "rpy": _floats(origin.get("rpy"), [0.0, 0.0, 0.0]),
+            }
+        )
+    return meshes
+
+
+def compute_mass_properties(
+    paths: List[str], workers: Optional[int] = None, cache: Optional[MeshCache] = None
+) -> Dict[str, dict]:
+    """Unit density mass properties of each distinct mesh file, computed in
+    parallel processes, those found in the `cache` excepted."""
+    results: Dict[str, dict] = {}
+    keys = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        todo = []
+        for path in paths:
+            if cache is not None:
+                keys[path] = cache.key(path, INERTIA_CACHE_VERSION)
+                cached = os.path.join(tmp_dir, keys[path] + ".json")
+                if cache.fetch(keys[path], cached):
+                    with open(cached, "r", encoding="utf-8") as file:
+                        results[path] = json.load(file)
+                    profiler.count("meshes_cached")
+                    continue
+            todo.append(path)
+        workers = os.cpu_count() if workers is None else workers
+        workers = max(1, min(workers, len(todo)))
+        if workers == 1:
+            computed = map(mesh_mass_properties, todo)
+        else:
+            executor = ProcessPoolExecutor(max_workers=workers)
+            computed = executor.map(mesh_mass_properties, todo)
+        try:
+            for path, properties in zip(todo, computed):
+                results[path] = properties
+                profiler.count("meshes_read")
+                if cache is not None:
+                    produced = os.path.join(tmp_dir, f"produced_{keys[path]}.json")
+                    with open(produced, "w", encoding="utf-8") as file:
+                        json.dump(properties, file)
+                    cached = os.path.join(tmp_dir, keys[path] + ".json")
+                    cache.store(keys[path], produced, cached)
+        finally:
+            if workers > 1:
+                executor.shutdown()
+    return results
+
+
+@profiler.profiled("mesh_inertia")
+def links_mesh_inertial(
+    links: Iterable[ET.Element],
+    base_dir,
+    density=DEFAULT_DENSITY,
+    masses: Optional[Dict[str, float]] = None,
+    source="visual",
+    package_paths: Optional[List[str]] = None,
+    workers: Optional[int] = None,
+    cache: Optional[MeshCache] = None,
+) -> Dict[str, dict]:
+    """Inertial of each link computed from its `source` ("visual" or
+    "collision") meshes, keyed by the link name without its xacro prefix.
+    The links listed in `masses` get that total mass, the others `density`."""
+    masses = {} if masses is None else masses
+    package_paths = (
+        package_paths_from_env() if package_paths is None else package_paths
+    )
+    link_meshes_paths = {}
+    missing = []
+    for link in links:
+        name = _PREFIX_VAR.sub("", link.get("name"))
+        meshes = link_meshes(link, source)
+        for mesh in meshes:
+            mesh["path"] = resolve_mesh_path(mesh["filename"], base_dir, package_paths)
+            if mesh["path"] is None:
+                missing.append(mesh["filename"])
+        meshes = [mesh for mesh in meshes if mesh["path"] is not None]
+        if meshes:
+            link_meshes_paths[name] = meshes
+    if missing:
+        print(f"Meshes not found: {', '.join(sorted(set(missing)))}")
+
+    paths = sorted(
+        {mesh["path"] for meshes in link_meshes_paths.values() for mesh in meshes}
+    )
+    properties = compute_mass_properties(paths, workers, cache)
+
+    link_inertial = {}
+    for name, meshes in link_meshes_paths.items():
+        volume, first, second = 0.0, np.zeros(3), np.zeros((3, 3))
+        for mesh in meshes:
+            v, f, s = transform_properties(
+                properties[mesh["path"]],
+                mesh["scale"],
+                rpy_matrix(mesh["rpy"]),
+                mesh["xyz"],
+            )
+            volume, first, second = volume + v, first + f, second + s
+        if volume <= 0:
+            print(f"Skipping {name}: its meshes enclose no volume")
+            continue
+        link_density = masses[name] / volume if name in masses else density
+        link_inertial[name] = inertial_from_properties(
+            volume, first, second, link_density
+        )
+    return link_inertial
+
+
+def urdf_mesh_inertial(urdf_path, **kwargs) -> Dict[str, dict]:
+    """`links_mesh_inertial` of all the links of a URDF or xacro file."""
+    root = ET.parse(urdf_path).getroot()
+    base_dir = os.path.dirname(os.path.abspath(urdf_path))
+    return links_mesh_inertial(root.iter("link"), base_dir, **kwargs)
+
+
+def main(argv=None):
+    import argparse
+    from .mesh_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_SIZE
+    from extract_intertial import merge_inertials
+
+    parser = argparse.ArgumentParser(
+        description="Compute the links inertial from their meshes"
+    )
+    parser.add_argument(
+        "-in", "--input_urdf_path", type=str, help="Path to the URDF file"
+    )
+    parser.add_argument(
+        "-out",
+        "--output_json_path",
+        type=str,
+        help="Path to the links_inertial .json file, updated if it exists",
+        default="links_inertial.json",
+    )
+    parser.add_argument(
+        "-src",
+        "--source",
+        type=str,
+        help="Meshes to compute the inertial from",
+        default="visual",
+        choices=["visual", "collision"],
+    )
+    parser.add_argument(
+        "-d",
+        "--density",
+        type=float,
+        help="Density in kg/m^3 of the links without a given mass",
+        default=DEFAULT_DENSITY,
+    )
+    parser.add_argument(
+        "-m",
+        "--mass",
+        nargs=2,
+        action="append",
+        default=[],
+        help="Total mass of a link, can be given several times",
+        metavar=("link", "mass"),
+    )
+    parser.add_argument(
+        "-mf",
+        "--masses_file",
+        type=str,
+        help="A .json file of {link: mass}",
+        default=None,
+    )
+    parser.add_argument(
+        "-pp",
+        "--package_paths",
+        type=str,
+        nargs="*",
+        help="Directories to find the package:// meshes in, defaults to ROS_PACKAGE_PATH",
+        default=None,
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        help="Number of worker processes, defaults to the number of cores",
+        default=None,
+    )
+    parser.add_argument(
+        "-cache",
+        "--cache_dir",
+        type=str,
+        help="Directory of the mesh cache",
+        default=DEFAULT_CACHE_DIR,
+    )
+    parser.add_argument(
+        "-cs",
+        "--cache_size",
+        type=float,
+        help="Maximum size of the cache in MB",
+        default=DEFAULT_MAX_SIZE / 1024**2,
+    )
+    parser.add_argument(
+        "-ncache", "--no_cache", action="store_true", help="Disable the cache"
+    )
+    profiler.add_arguments(parser)
+    args = parser.parse_args(argv)
+    profiler.enable_from_args(args)
+
+    masses = {}
+    if args.masses_file is not None:
+        with open(args.masses_file, "r", encoding="utf-8") as file:
+            masses.update(json.load(file))
+    masses.update({link: float(mass) for link, mass in args.mass})
+    cache = None
+    if not args.no_cache:
+        cache = MeshCache(args.cache_dir, int(args.cache_size * 1024**2))
+    link_inertial = urdf_mesh_inertial(
+        args.input_urdf_path,
+        density=args.density,
+        masses=masses,
+        source=args.source,
+        package_paths=args.package_paths,
+        workers=args.workers,
+        cache=cache,
+    )
+    merge_inertials(args.output_json_path, link_inertial)
+    print(
+        f"Saved inertial data of {len(link_inertial)} links "
+        f"to {args.output_json_path}"
+    )
+    if cache is not None:
+        cache.print_stats()
+    print("Done!")
+
+
+if __name__ == "__main__":
+    main()
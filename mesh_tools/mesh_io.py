@@ -0,0 +1,143 @@
+import os
+from typing import Iterator, Tuple
+import numpy as np
+
+# one triangle of a binary STL file: normal, 3 vertices and the attribute byte count
+STL_DTYPE = np.dtype(
+    [("normal", "<f4", (3,)), ("vertices", "<f4", (3, 3)), ("attr", "<u2")]
+)
+STL_HEADER_SIZE = 84
+
+
+def is_binary_stl(path) -> bool:
+    size = os.path.getsize(path)
+    if size < STL_HEADER_SIZE:
+        return False
+    with open(path, "rb") as file:
+        header = file.read(STL_HEADER_SIZE)
+    count = int.from_bytes(header[80:84], "little")
+    # ASCII files start with "solid" too, so trust the size check first
+    return size == STL_HEADER_SIZE + count * STL_DTYPE.itemsize
+
+
+def is_binary_ply(path) -> bool:
+    with open(path, "rb") as file:
+        if file.readline().strip() != b"ply":
+            return False
+        return file.readline().startswith(b"format binary_")
+
+
+def read_stl_triangles(path) -> np.ndarray:
+    """Return the (n, 3, 3) float32 triangles of an STL file.
+
+    Binary files are memory-mapped and the returned array is a zero-copy view
+    of the file, so only the pages actually read are loaded. ASCII files are
+    parsed into memory.
+    """
+    if is_binary_stl(path):
+        if os.path.getsize(path) == STL_HEADER_SIZE:
+            return np.empty((0, 3, 3), dtype=np.float32)
+        records = np.memmap(path, dtype=STL_DTYPE, mode="r", offset=STL_HEADER_SIZE)
+        return records["vertices"]
+    return _read_ascii_stl(path)
+
+
+def _read_ascii_stl(path) -> np.ndarray:
+    values = []
+    with open(path, "r", encoding="ascii", errors="replace") as file:
+        for line in file:
+            line = line.strip()
+            if line.startswith("vertex"):
+                values.append(line.split()[1:4])
+    return np.asarray(values, dtype=np.float32).reshape(-1, 3, 3)
+
+
+def read_obj(path) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the vertices and the triangles of a Wavefront OBJ file, the
+    polygons being split into fans. Normals, texture coordinates, groups
+    and materials are ignored."""
+    vertices, faces = [], []
+    with open(path, "rb") as file:
+        for line in file:
+            if line.startswith(b"v "):
+                vertices.append(line.split()[1:4])
+            elif line.startswith(b"f "):
+                # "f 1 2 3", "f 1/1 2/2 3/3" or "f 1//1 2//2 3//3", 1-based or
+                # negative from the last vertex read
+                indices = [int(corner.split(b"/")[0]) for corner in line.split()[1:]]
+                indices = [i - 1 if i > 0 else len(vertices) + i for i in indices]
+                for i in range(1, len(indices) - 1):
+                    faces.append((indices[0], indices[i], indices[i + 1]))
+    vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)
+    faces = np.asarray(faces, dtype=np.int64).reshape(-1, 3)
+    return vertices, faces
+
+
+def iter_triangle_chunks(
+    triangles: np.ndarray, chunk_size=200_000
+) -> Iterator[np.ndarray]:
+    """Yield float64 copies of at most `chunk_size` triangles at a time."""
+    for start in range(0, len(triangles), chunk_size):
+        yield np.asarray(triangles[start : start + chunk_size], dtype=np.float64)
+
+
+def triangles_volume(triangles: np.ndarray, chunk_size=200_000) -> float:
+    """Signed volume enclosed by the triangles (positive for outward normals)."""
+    volume = 0.0
+    for chunk in iter_triangle_chunks(triangles, chunk_size):
+        a, b, c = chunk[:, 0], chunk[:, 1], chunk[:, 2]
+        volume += np.einsum("ij,ij->", a, np.cross(b, c)) / 6.0
+    return float(volume)
+
+
+def mesh_volume(vertices: np.ndarray, faces: np.ndarray) -> float:
+    return triangles_volume(vertices[faces])
+
+
+def write_binary_stl(path, vertices: np.ndarray, faces: np.ndarray):
+    triangles = np.asarray(vertices, dtype=np.float64)[faces]
+    normals = np.cross(
+        triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0]
+    )
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    normals = np.divide(normals, lengths, out=np.zeros_like(normals), where=lengths > 0)
+    records = np.zeros(len(faces), dtype=STL_DTYPE)
+    records["normal"] = normals
+    records["vertices"] = triangles
+    with open(path, "wb") as file:
+        file.write(b"binary STL".ljust(80, b"\0"))
+        file.write(len(faces).to_bytes(4, "little"))
+        records.tofile(file)
+
+
+def write_binary_ply(path, vertices: np.ndarray, faces: np.ndarray):
+    """Write an indexed mesh as a little-endian binary PLY file, with float32
+    vertices and int32 indices."""
+    face_records = np.zeros(
+        len(faces), dtype=[("count", "u1"), ("indices", "<i4", (3,))]
+    )
+    face_records["count"] = 3
+    face_records["indices"] = faces
+    header = (
+        "ply\n"
+        "format binary_little_endian 1.0\n"
+        f"element vertex {len(vertices)}\n"
+        "property float x\n"
+        "property float y\n"
+        "property float z\n"
+        f"element face {len(faces)}\n"
+        "property list uchar int vertex_indices\n"
+        "end_header\n"
+    )
+    with open(path, "wb") as file:
+        file.write(header.encode("ascii"))
+        np.asarray(vertices, dtype="<f4").tofile(file)
+        face_records.tofile(file)
+
+
+def compact_mesh(
+    vertices: np.ndarray, faces: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Drop the vertices not referenced by the faces and remap the indices."""
+    used, inverse = np.unique(faces, return_inverse=True)
+    return vertices[used], inverse.reshape(faces.shape)
@@ -0,0 +1,436 @@
+import json
+import math
+import os, sys
+import tempfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+if not __package__:
+    # run as a script rather than imported from the mesh_tools package
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    __package__ = "mesh_tools"
+from .decimate import read_mesh
+from .mesh_cache import MeshCache
+from .mesh_inertia import package_paths_from_env, resolve_mesh_path, rpy_matrix
+import profiler
+
+"""
+Fit a box, a cylinder or a sphere to the visual mesh of each link, to create
+primitive collision geometries instead of meshes: primitive collision checks
+are much cheaper than mesh ones.
+
+Each primitive encloses all the vertices of the (scaled) mesh. The boxes are
+aligned with the mesh axes or with the principal axes of its surface, the
+cylinders along one of these axes, and the fit error is the area weighted
+root mean square distance from the surface of the mesh to the surface of the
+primitive, relative to half the diagonal of the mesh bounding box. The
+primitive of least error is used when it is below --max_error, otherwise the
+collision stays a mesh.
+
+The output is a .json file of {link: [collision or null per <visual>]}, each
+collision being {"origin": {"xyz", "rpy"}, "geometry": {"box": {"size"}}}
+placed in the link frame, for split_mesh_paths.py -prims (or the
+fit_primitives option of the split_mesh_paths stage of pipeline.py) creating
+the collisions from the visuals.
+
+examples:
+python3 mesh_tools/primitives.py -in robot.urdf -out collision_primitives.json
+python3 mesh_tools/primitives.py -in robot.urdf -pp ~/ws/src -e 0.05 -k box cylinder
+"""
+
+# change this when the output of fit_primitives changes
+PRIMITIVES_CACHE_VERSION = "primitives:1"
+PRIMITIVES = ("box", "cylinder", "sphere")
+DEFAULT_MAX_ERROR = 0.02
+
+
+def matrix_rpy(rotation: np.ndarray) -> np.ndarray:
+    """URDF fixed axis roll, pitch and yaw angles of a rotation, the inverse
+    of `rpy_matrix`."""
+    cos_pitch = math.hypot(rotation[0, 0], rotation[1, 0])
+    pitch = math.atan2(-rotation[2, 0], cos_pitch)
+    if cos_pitch < 1e-9:
+        # gimbal lock, only roll - yaw or roll + yaw is defined
+        return np.array([0.0, pitch, math.atan2(-rotation[0, 1], rotation[1, 1])])
+    roll = math.atan2(rotation[2, 1], rotation[2, 2])
+    yaw = math.atan2(rotation[1, 0], rotation[0, 0])
+    return np.array([roll, pitch, yaw])
+
+
+def surface_samples(
+    vertices: np.ndarray, faces: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Points of the surface, the vertices and the face centers, and the
+    area they stand for."""
+    triangles = vertices[faces]
+    areas = np.linalg.norm(
+        np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0]),
+        axis=1,
+    ) / 2
+    vertex_areas = np.bincount(
+        faces.reshape(-1), np.repeat(areas / 6, 3), minlength=len(vertices)
+    )
+    points = np.concatenate([vertices, triangles.mean(axis=1)])
+    return points, np.concatenate([vertex_areas, areas / 2])
+
+
+def principal_axes(points: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """Rotation whose columns are the principal axes of the weighted points."""
+    center = weights @ points / weights.sum()
+    centered = points - center
+    _, axes = np.linalg.eigh((centered * weights[:, None]).T @ centered)
+    if np.linalg.det(axes) < 0:
+        axes[:, 0] = -axes[:, 0]
+    return axes
+
+
+def circle_center(points: np.ndarray) -> np.ndarray:
+    """Least squares center of a circle through the 2D points, from
+    x² + y² = 2 a x + 2 b y + c."""
+    matrix = np.column_stack([2 * points, np.ones(len(points))])
+    solution = np.linalg.lstsq(matrix, (points**2).sum(axis=1), rcond=None)[0]
+    return solution[:2]
+
+
+def sphere_center(points: np.ndarray) -> np.ndarray:
+    matrix = np.column_stack([2 * points, np.ones(len(points))])
+    solution = np.linalg.lstsq(matrix, (points**2).sum(axis=1), rcond=None)[0]
+    return solution[:3]
+
+
+def rms(distances: np.ndarray, weights: np.ndarray) -> float:
+    return float(np.sqrt(weights @ distances**2 / weights.sum()))
+
+
+def fit_box(vertices, samples, weights, rotation) -> dict:
+    local = vertices @ rotation
+    low, high = local.min(axis=0), local.max(axis=0)
+    center, half = (low + high) / 2, (high - low) / 2
+    # signed distance to the box surface
+    q = np.abs(samples @ rotation - center) - half
+    distances = np.linalg.norm(np.maximum(q, 0), axis=1) + np.minimum(q.max(axis=1), 0)
+    return {
+        "type": "box",
+        "center": rotation @ center,
+        "rotation": rotation,
+        "size": 2 * half,
+        "error": rms(distances, weights),
+    }
+
+
+def fit_cylinder(vertices, samples, weights, rotation, axis: int) -> dict:
+    # a cyclic permutation of the axes, to keep a rotation, puts `axis` on z
+    rotation = rotation[:, [(axis + 1) % 3, (axis + 2) % 3, axis]]
+    local = vertices @ rotation
+    center_xy = circle_center(local[:, :2])
+    radius = np.linalg.norm(local[:, :2] - center_xy, axis=1).max()
+    low, high = local[:, 2].min(), local[:, 2].max()
+    center = np.array([*center_xy, (low + high) / 2])
+    sample_local = samples @ rotation - center
+    q = np.column_stack(
+        [
+            np.linalg.norm(sample_local[:, :2], axis=1) - radius,
+            np.abs(sample_local[:, 2]) - (high - low) / 2,
+        ]
+    )
+    distances = np.linalg.norm(np.maximum(q, 0), axis=1) + np.minimum(q.max(axis=1), 0)
+    return {
+        "type": "cylinder",
+        "center": rotation @ center,
+        "rotation": rotation,
+        "radius": radius,
+        "length": high - low,
+        "error": rms(distances, weights),
+    }
+
+
+def fit_sphere(vertices, samples, weights) -> dict:
+    center = sphere_center(vertices)
+    radius = np.linalg.norm(vertices - center, axis=1).max()
+    distances = np.linalg.norm(samples - center, axis=1) - radius
+    return {
+        "type": "sphere",
+        "center": center,
+        "rotation": np.eye(3),
+        "radius": radius,
+        "error": rms(distances, weights),
+    }
+
+
+def fit_primitives(vertices: np.ndarray, faces: np.ndarray) -> Dict[str, dict]:
+    """The best enclosing box, cylinder and sphere of a mesh, in its frame,
+    the errors being relative to half the diagonal of its bounding box."""
+    vertices = np.asarray(vertices, dtype=np.float64)
+    faces = np.asarray(faces, dtype=np.int64)
+    samples, weights = surface_samples(vertices, faces)
+    if weights.sum() <= 0:
+        weights = np.ones(len(samples))
+    frames = [np.eye(3), principal_axes(samples, weights)]
+    candidates = [fit_box(vertices, samples, weights, frame) for frame in frames]
+    candidates += [
+        fit_cylinder(vertices, samples, weights, frame, axis)
+        for frame in frames
+        for axis in range(3)
+    ]
+    candidates.append(fit_sphere(vertices, samples, weights))
+    size = max(np.linalg.norm(np.ptp(vertices, axis=0)) / 2, 1e-300)
+    fits = {}
+    for candidate in candidates:
+        candidate["error"] /= size
+        best = fits.get(candidate["type"])
+        if best is None or candidate["error"] < best["error"]:
+            fits[candidate["type"]] = candidate
+    # as plain lists, for the cache
+    return {
+        kind: {
+            key: value.tolist() if isinstance(value, np.ndarray) else float(value)
+            for key, value in fit.items()
+            if key != "type"
+        }
+        for kind, fit in fits.items()
+    }
+
+
+def mesh_primitives(job: Tuple[str, Tuple[float, float, float]]) -> Dict[str, dict]:
+    path, scale = job
+    vertices, faces = read_mesh(path)
+    return fit_primitives(vertices * np.asarray(scale), faces)
+
+
+def compute_primitives(
+    jobs: List[Tuple[str, Tuple[float, float, float]]],
+    workers: Optional[int] = None,
+    cache: Optional[MeshCache] = None,
+) -> Dict[tuple, Dict[str, dict]]:
+    """The primitive fits of each distinct (mesh file, scale), computed in
+    parallel processes, those found in the `cache` excepted."""
+    results: Dict[tuple, Dict[str, dict]] = {}
+    keys = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        todo = []
+        for job in jobs:
+            if cache is not None:
+                keys[job] = cache.key(job[0], PRIMITIVES_CACHE_VERSION, repr(job[1]))
+                cached = os.path.join(tmp_dir, keys[job] + ".json")
+                if cache.fetch(keys[job], cached):
+                    with open(cached, "r", encoding="utf-8") as file:
+                        results[job] = json.load(file)
+                    profiler.count("meshes_cached")
+                    continue
+            todo.append(job)
+        workers = os.cpu_count() if workers is None else workers
+        workers = max(1, min(workers, len(todo)))
+        if workers == 1:
+            computed = map(mesh_primitives, todo)
+        else:
+            executor = ProcessPoolExecutor(max_workers=workers)
+            computed = executor.map(mesh_primitives, todo)
+        try:
+            for job, fits in zip(todo, computed):
+                results[job] = fits
+                profiler.count("meshes_read")
+                if cache is not None:
+                    produced = os.path.join(tmp_dir, f"produced_{keys[job]}.json")
+                    with open(produced, "w", encoding="utf-8") as file:
+                        json.dump(fits, file)
+                    cached = os.path.join(tmp_dir, keys[job] + ".json")
+                    cache.store(keys[job], produced, cached)
+        finally:
+            if workers > 1:
+                executor.shutdown()
+    return results
+
+
+def _floats(text: Optional[str], default) -> np.ndarray:
+    return np.array([float(v) for v in text.split()]) if text else np.array(default)
+
+
+def _format(values: Iterable[float]) -> str:
+    # + 0.0 writes -0.0 as 0
+    return " ".join(f"{v + 0.0:.9g}" for v in values)
+
+
+def primitive_collision(fit: dict, kind: str, visual: ET.Element) -> dict:
+    """Collision of a primitive fit in the frame of a mesh <visual>, placed
+    in the link frame by the <origin> of the visual."""
+    origin = visual.find("origin")
+    origin = {} if origin is None else origin.attrib
+    visual_rotation = rpy_matrix(_floats(origin.get("rpy"), [0.0, 0.0, 0.0]))
+    xyz = visual_rotation @ np.asarray(fit["center"]) + _floats(
+        origin.get("xyz"), [0.0, 0.0, 0.0]
+    )
+    rpy = matrix_rpy(visual_rotation @ np.asarray(fit["rotation"]))
+    if kind == "box":
+        geometry = {"size": _format(fit["size"])}
+    elif kind == "cylinder":
+        geometry = {"radius": f"{fit['radius']:.9g}", "length": f"{fit['length']:.9g}"}
+    else:
+        geometry = {"radius": f"{fit['radius']:.9g}"}
+    return {
+        "origin": {"xyz": _format(xyz), "rpy": _format(rpy)},
+        "geometry": {kind: geometry},
+        "error": fit["error"],
+    }
+
+
+@profiler.profiled("primitives")
+def links_primitives(
+    links: Iterable[ET.Element],
+    base_dir,
+    max_error=DEFAULT_MAX_ERROR,
+    kinds: Iterable[str] = PRIMITIVES,
+    package_paths: Optional[List[str]] = None,
+    workers: Optional[int] = None,
+    cache: Optional[MeshCache] = None,
+) -> Dict[str, List[Optional[dict]]]:
+    """The primitive collision of each <visual> of the links, None for the
+    visuals without a mesh or whose mesh no primitive of `kinds` fits within
+    `max_error`, keyed by link name."""
+    kinds = list(kinds)
+    for kind in kinds:
+        assert kind in PRIMITIVES, f"Unknown primitive {kind}, choose from {PRIMITIVES}"
+    package_paths = (
+        package_paths_from_env() if package_paths is None else package_paths
+    )
+    link_visuals = {}
+    missing = []
+    for link in links:
+        visuals = []
+        for visual in link.findall("visual"):
+            mesh = visual.find("geometry/mesh")
+            job = None
+            if mesh is not None and mesh.get("filename") is not None:
+                path = resolve_mesh_path(mesh.get("filename"), base_dir, package_paths)
+                scale = _floats(mesh.get("scale"), [1.0, 1.0, 1.0])
+                scale = scale if scale.size == 3 else np.repeat(scale[0], 3)
+                if path is None:
+                    missing.append(mesh.get("filename"))
+                else:
+                    job = (path, tuple(float(s) for s in scale))
+            visuals.append((visual, job))
+        link_visuals[link.get("name")] = visuals
+    if missing:
+        print(f"Meshes not found: {', '.join(sorted(set(missing)))}")
+
+    jobs = sorted({job for visuals in link_visuals.values() for _, job in visuals if job})
+    fits = compute_primitives(jobs, workers, cache)
+    collisions = {}
+    for name, visuals in link_visuals.items():
+        collisions[name] = []
+        for visual, job in visuals:
+            collision = None
+            if job is not None:
+                kind = min(kinds, key=lambda kind: fits[job][kind]["error"])
+                if fits[job][kind]["error"] <= max_error:
+                    collision = primitive_collision(fits[job][kind], kind, visual)
+            collisions[name].append(collision)
+    return collisions
+
+
+def urdf_primitives(urdf_path, **kwargs) -> Dict[str, List[Optional[dict]]]:
+    root = ET.parse(urdf_path).getroot()
+    base_dir = os.path.dirname(os.path.abspath(urdf_path))
+    return links_primitives(root.iter("link"), base_dir, **kwargs)
+
+
+def main(argv=None):
+    import argparse
+    from .mesh_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_SIZE
+
+    parser = argparse.ArgumentParser(
+        description="Fit primitive collision geometries to the link meshes"
+    )
+    parser.add_argument(
+        "-in", "--input_urdf_path", type=str, help="Path to the URDF file"
+    )
+    parser.add_argument(
+        "-out",
+        "--output_json_path",
+        type=str,
+        help="Path to the .json file of the collisions",
+        default="collision_primitives.json",
+    )
+    parser.add_argument(
+        "-e",
+        "--max_error",
+        type=float,
+        help="Largest fit error relative to the mesh size to use a primitive",
+        default=DEFAULT_MAX_ERROR,
+    )
+    parser.add_argument(
+        "-k",
+        "--kinds",
+        type=str,
+        nargs="+",
+        help="Primitives to fit",
+        default=list(PRIMITIVES),
+        choices=PRIMITIVES,
+    )
+    parser.add_argument(
+        "-pp",
+        "--package_paths",
+        type=str,
+        nargs="*",
+        help="Directories to find the package:// meshes in, defaults to ROS_PACKAGE_PATH",
+        default=None,
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        help="Number of worker processes, defaults to the number of cores",
+        default=None,
+    )
+    parser.add_argument(
+        "-cache",
+        "--cache_dir",
+        type=str,
+        help="Directory of the mesh cache",
+        default=DEFAULT_CACHE_DIR,
+    )
+    parser.add_argument(
+        "-cs",
+        "--cache_size",
+        type=float,
+        help="Maximum size of the cache in MB",
+        default=DEFAULT_MAX_SIZE / 1024**2,
+    )
+    parser.add_argument(
+        "-ncache", "--no_cache", action="store_true", help="Disable the cache"
+    )
+    profiler.add_arguments(parser)
+    args = parser.parse_args(argv)
+    profiler.enable_from_args(args)
+
+    cache = None
+    if not args.no_cache:
+        cache = MeshCache(args.cache_dir, int(args.cache_size * 1024**2))
+    collisions = urdf_primitives(
+        args.input_urdf_path,
+        max_error=args.max_error,
+        kinds=args.kinds,
+        package_paths=args.package_paths,
+        workers=args.workers,
+        cache=cache,
+    )
+    fitted = 0
+    for name, link_collisions in collisions.items():
+        for collision in link_collisions:
+            if collision is None:
+                continue
+            fitted += 1
+            kind = next(iter(collision["geometry"]))
+            print(f"{name}: {kind} (error {collision['error']:.4f})")
+    total = sum(len(link_collisions) for link_collisions in collisions.values())
+    print(f"Fitted {fitted}/{total} visuals, the others keep a mesh collision")
+    with open(args.output_json_path, "w", encoding="utf-8") as file:
+        json.dump(collisions, file, indent=4)
+    print(f"Saved to {args.output_json_path}")
+    if cache is not None:
+        cache.print_stats()
+
+
+if __name__ == "__main__":
+    main()
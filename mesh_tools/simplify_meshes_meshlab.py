@@ -1,8 +1,18 @@
-import os
+import os, sys
 import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Optional
 
+if not __package__:
+    # run as a script rather than imported from the mesh_tools package
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    __package__ = "mesh_tools"
+from .mesh_cache import MeshCache, file_digest, replace_file
+import profiler
 
-def process_with_meshlab(input_filepath, output_filepath, script):
+
+def process_with_meshlab(input_filepath, output_filepath, script, timeout=None):
     command = [
         "meshlabserver",
         "-i",
@@ -12,20 +22,135 @@ def process_with_meshlab(input_filepath, output_filepath, script):
         "-s",
         script,
     ]
-    subprocess.run(command, check=True)
-    print(f"Processed {input_filepath} -> {output_filepath}")
+    subprocess.run(
+        command,
+        check=True,
+        timeout=timeout,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+    )
+
 
+def _run_job(
+    input_filepath,
+    output_filepath,
+    script,
+    timeout,
+    cache: Optional[MeshCache],
+    script_digest: Optional[str],
+) -> dict:
+    result = {
+        "input": input_filepath,
+        "output": output_filepath,
+        "error": None,
+        "cached": False,
+    }
+    start = time.perf_counter()
+    # write to a temporary file first so that an output hardlinked elsewhere
+    # (or the input itself when the prefix is empty) is replaced, not modified
+    out_dir, out_name = os.path.split(output_filepath)
+    tmp_filepath = os.path.join(out_dir, f".tmp_{out_name}")
+    try:
+        key = None
+        if cache is not None:
+            out_ext = os.path.splitext(out_name)[1]
+            key = cache.key(input_filepath, script_digest, out_ext)
+            if cache.fetch(key, output_filepath):
+                result["cached"] = True
+                result["seconds"] = time.perf_counter() - start
+                return result
+        process_with_meshlab(input_filepath, tmp_filepath, script, timeout)
+        if cache is not None:
+            cache.store(key, tmp_filepath, output_filepath)
+        else:
+            replace_file(tmp_filepath, output_filepath)
+    except subprocess.TimeoutExpired:
+        result["error"] = f"timed out after {timeout}s"
+    except subprocess.CalledProcessError as e:
+        output = e.output.decode(errors="replace").strip() if e.output else ""
+        result["error"] = f"meshlabserver exited with {e.returncode}: {output}"
+    except OSError as e:
+        result["error"] = str(e)
+    finally:
+        if os.path.exists(tmp_filepath):
+            os.remove(tmp_filepath)
+    result["seconds"] = time.perf_counter() - start
+    return result
 
-def process_directory(in_dir, out_dir, prefix, script, mesh_format):
-    for filename in os.listdir(in_dir):
-        if filename.endswith(f".{mesh_format}"):
+
+@profiler.profiled("meshlab")
+def process_directory(
+    in_dir,
+    out_dir,
+    prefix,
+    script,
+    mesh_format,
+    workers: Optional[int] = None,
+    timeout: Optional[float] = None,
+    cache: Optional[MeshCache] = None,
+) -> List[dict]:
+    """Run meshlabserver on all the meshes of the directory with at most
+    `workers` concurrent processes. Failed or timed out meshes are collected
+    in the returned results instead of stopping the run. Meshes found in the
+    `cache` for the same script are not processed again."""
+    jobs = []
+    for filename in sorted(os.listdir(in_dir)):
+        if filename.endswith(f".{mesh_format}") and not filename.startswith("."):
             input_filepath = os.path.join(in_dir, filename)
             output_filepath = os.path.join(out_dir, prefix + filename)
-            process_with_meshlab(input_filepath, output_filepath, script)
+            jobs.append((input_filepath, output_filepath))
+    if len(jobs) == 0:
+        print(f"No .{mesh_format} meshes found in {in_dir}")
+        return []
 
+    workers = os.cpu_count() if workers is None else workers
+    script_digest = file_digest(script).hexdigest() if cache is not None else None
+    results = []
+    # meshlabserver does the work in its own process, so threads are enough
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = [
+            executor.submit(
+                _run_job,
+                input_filepath,
+                output_filepath,
+                script,
+                timeout,
+                cache,
+                script_digest,
+            )
+            for input_filepath, output_filepath in jobs
+        ]
+        for index, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            status = "OK" if result["error"] is None else "FAILED"
+            status = "CACHED" if result["cached"] else status
+            print(
+                f"[{index}/{len(jobs)}] {status} {os.path.basename(result['input'])} "
+                f"({result['seconds']:.2f}s)"
+            )
+            if result["error"] is not None:
+                print(f"    {result['error']}")
+            results.append(result)
 
-if __name__ == "__main__":
+    failed = [result for result in results if result["error"] is not None]
+    # counted here, the workers run in threads
+    cached = sum(result["cached"] for result in results)
+    profiler.count("files_read", len(results))
+    profiler.count("files_cached", cached)
+    profiler.count("files_failed", len(failed))
+    profiler.count("files_written", len(results) - len(failed))
+    profiler.count("subprocesses", len(results) - cached)
+    print(f"Simplified {len(results) - len(failed)}/{len(results)} meshes")
+    for result in failed:
+        print(f"Failed: {result['input']}")
+    if cache is not None:
+        cache.print_stats()
+    return results
+
+
+def main(argv=None):
     import argparse, os
+    from .mesh_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_SIZE
 
     current_directory = os.path.dirname(os.path.abspath(__file__))
 
@@ -58,7 +183,40 @@ if __name__ == "__main__":
         default="STL",
         choices=["STL", "stl", "OBJ", "obj"],
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        help="Number of concurrent meshlabserver processes, defaults to the number of cores",
+        default=None,
+    )
+    parser.add_argument(
+        "-to",
+        "--timeout",
+        type=float,
+        help="Timeout in seconds for each mesh",
+        default=None,
+    )
+    parser.add_argument(
+        "-cache",
+        "--cache_dir",
+        type=str,
+        help="Directory of the simplified meshes cache",
+        default=DEFAULT_CACHE_DIR,
+    )
+    parser.add_argument(
+        "-cs",
+        "--cache_size",
+        type=float,
+        help="Maximum size of the cache in MB",
+        default=DEFAULT_MAX_SIZE / 1024**2,
+    )
+    parser.add_argument(
+        "-ncache", "--no_cache", action="store_true", help="Disable the cache"
+    )
+    profiler.add_arguments(parser)
+    args = parser.parse_args(argv)
+    profiler.enable_from_args(args)
     in_dir = args.input_dir
     out_dir = args.output_dir
     script = args.script_path
@@ -66,6 +224,24 @@ if __name__ == "__main__":
     mesh_format = args.mesh_format
 
     out_dir = out_dir if out_dir is not None else in_dir
-    process_directory(in_dir, out_dir, name_prefix, script, mesh_format)
+    cache = None
+    if not args.no_cache:
+        cache = MeshCache(args.cache_dir, int(args.cache_size * 1024**2))
+    results = process_directory(
+        in_dir,
+        out_dir,
+        name_prefix,
+        script,
+        mesh_format,
+        args.workers,
+        args.timeout,
+        cache,
+    )
+
+    print("Done!")
+    if any(result["error"] is not None for result in results):
+        sys.exit(1)
 
-    print("Done!")
\ No newline at end of file
+
+if __name__ == "__main__":
+    main()
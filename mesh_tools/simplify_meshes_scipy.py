@@ -1,18 +1,76 @@
-import os
-import trimesh
+import os, sys
+from typing import Optional, Tuple
+import numpy as np
 from scipy.spatial import ConvexHull
+from scipy.spatial import QhullError
+
+if not __package__:
+    # run as a script rather than imported from the mesh_tools package
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    __package__ = "mesh_tools"
+from .mesh_cache import MeshCache, replace_file
+import profiler
+from .mesh_io import (
+    compact_mesh,
+    iter_triangle_chunks,
+    mesh_volume,
+    read_stl_triangles,
+    triangles_volume,
+    write_binary_stl,
+)
+
+# change this when the output of convex_hull_simplification changes
+HULL_CACHE_VERSION = "convex_hull:2"
 
 
 def compute_volume(mesh):
     return mesh.volume
 
 
-def convex_hull_simplification(mesh):
-    points = mesh.vertices
+def convex_hull_arrays(points: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the vertices and outward oriented faces of the convex hull of
+    the points, with only the hull vertices kept."""
     hull = ConvexHull(points)
+    faces = hull.simplices
+    # qhull does not orient the simplices, flip those against the facet normals
+    triangles = points[faces]
+    normals = np.cross(
+        triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0]
+    )
+    flip = np.einsum("ij,ij->i", normals, hull.equations[:, :3]) < 0
+    faces[flip] = faces[flip][:, ::-1]
+    return compact_mesh(points, faces)
+
+
+def triangles_convex_hull(
+    triangles: np.ndarray, chunk_size=200_000
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Convex hull of (n, 3, 3) triangles computed chunk by chunk, so that a
+    memory-mapped STL is never copied as a whole: only one chunk and the hull
+    candidates of the previous chunks are in memory."""
+    candidates = []
+    for chunk in iter_triangle_chunks(triangles, chunk_size):
+        points = chunk.reshape(-1, 3)
+        try:
+            hull = ConvexHull(points)
+        except QhullError:
+            # a flat chunk, its points may still be on the final hull
+            candidates.append(np.unique(points, axis=0))
+        else:
+            candidates.append(points[hull.vertices])
+    return convex_hull_arrays(np.concatenate(candidates))
+
+
+def stl_convex_hull(path, chunk_size=200_000) -> Tuple[np.ndarray, np.ndarray]:
+    return triangles_convex_hull(read_stl_triangles(path), chunk_size)
+
 
-    # 使用原始点集和凸包算法生成的面索引来创建简化的网格
-    simplified_mesh = trimesh.Trimesh(vertices=points, faces=hull.simplices)
+def convex_hull_simplification(mesh):
+    # trimesh is slow to import and only needed by this helper
+    import trimesh
+
+    vertices, faces = convex_hull_arrays(np.asarray(mesh.vertices, dtype=np.float64))
+    simplified_mesh = trimesh.Trimesh(vertices=vertices, faces=faces, process=False)
 
     return simplified_mesh
 
@@ -42,43 +100,88 @@ def compare_meshes(original_mesh, simplified_mesh):
     return comparison
 
 
-def process_stl_files(directory):
+@profiler.profiled("hull_simplification")
+def process_stl_files(directory, cache: Optional[MeshCache] = None):
     for filename in os.listdir(directory):
+        if filename.startswith("simplified_") or filename.startswith("."):
+            continue
         if filename.endswith(".stl") or filename.endswith(".STL"):
             file_path = os.path.join(directory, filename)
-            original_mesh = trimesh.load(file_path)
+            simplified_path = os.path.join(directory, f"simplified_{filename}")
+            key = None
+            if cache is not None:
+                key = cache.key(file_path, HULL_CACHE_VERSION)
+                if cache.fetch(key, simplified_path):
+                    profiler.count("files_cached")
+                    print(f"File: {filename} (cached)")
+                    print("-" * 50)
+                    continue
+            with profiler.stage("read_stl"):
+                triangles = read_stl_triangles(file_path)
+                original_volume = triangles_volume(triangles)
+            profiler.count("files_read")
+            profiler.count("triangles_read", len(triangles))
 
             # Perform convex hull simplification
-            simplified_mesh = convex_hull_simplification(original_mesh)
-
-            # Compare original and simplified meshes
-            comparison = compare_meshes(original_mesh, simplified_mesh)
+            with profiler.stage("convex_hull"):
+                vertices, faces = triangles_convex_hull(triangles)
 
             # Print results
             print(f"File: {filename}")
+            print(f"Original - Faces: {len(triangles)}, Volume: {original_volume}")
             print(
-                f"Original - Vertices: {comparison['original']['vertices']}, "
-                f"Faces: {comparison['original']['faces']}, "
-                f"Volume: {comparison['original']['volume']}"
-            )
-            print(
-                f"Simplified - Vertices: {comparison['simplified']['vertices']}, "
-                f"Faces: {comparison['simplified']['faces']}, "
-                f"Volume: {comparison['simplified']['volume']}"
+                f"Simplified - Vertices: {len(vertices)}, "
+                f"Faces: {len(faces)}, "
+                f"Volume: {mesh_volume(vertices, faces)}"
             )
             print("-" * 50)
 
             # Optionally save the simplified mesh
-            simplified_path = os.path.join(directory, f"simplified_{filename}")
-            simplified_mesh.export(simplified_path)
-
-
-if __name__ == "__main__":
+            tmp_path = os.path.join(directory, f".tmp_simplified_{filename}")
+            with profiler.stage("write_stl"):
+                write_binary_stl(tmp_path, vertices, faces)
+            profiler.count("files_written")
+            if cache is not None:
+                cache.store(key, tmp_path, simplified_path)
+            else:
+                replace_file(tmp_path, simplified_path)
+    if cache is not None:
+        cache.print_stats()
+
+
+def main(argv=None):
     import argparse
+    from .mesh_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_SIZE
 
     parser = argparse.ArgumentParser(description="Simplify meshes using convex hulls")
     parser.add_argument(
         "-in", "--directory", type=str, help="Directory containing STL files"
     )
-    args = parser.parse_args()
-    process_stl_files(args.directory)
+    parser.add_argument(
+        "-cache",
+        "--cache_dir",
+        type=str,
+        help="Directory of the simplified meshes cache",
+        default=DEFAULT_CACHE_DIR,
+    )
+    parser.add_argument(
+        "-cs",
+        "--cache_size",
+        type=float,
+        help="Maximum size of the cache in MB",
+        default=DEFAULT_MAX_SIZE / 1024**2,
+    )
+    parser.add_argument(
+        "-ncache", "--no_cache", action="store_true", help="Disable the cache"
+    )
+    profiler.add_arguments(parser)
+    args = parser.parse_args(argv)
+    profiler.enable_from_args(args)
+    cache = None
+    if not args.no_cache:
+        cache = MeshCache(args.cache_dir, int(args.cache_size * 1024**2))
+    process_stl_files(args.directory, cache)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,372 @@
+import json
+import os, sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+if not __package__:
+    # run as a script rather than imported from the mesh_tools package
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    __package__ = "mesh_tools"
+from .decimate import MESH_FORMATS, remove_degenerate_faces
+from .mesh_cache import MeshCache, replace_file
+from .mesh_io import (
+    compact_mesh,
+    is_binary_ply,
+    is_binary_stl,
+    read_obj,
+    read_stl_triangles,
+    write_binary_ply,
+    write_binary_stl,
+)
+import profiler
+
+"""
+Transcode meshes, e.g. the ASCII STL and OBJ files of vendor packages, to a
+compact binary format: binary STL, read by every URDF tool, or binary PLY,
+which stores each vertex once. Binary files are several times smaller than
+ASCII ones and much faster to load in RViz, Gazebo or MuJoCo.
+
+The vertices can be quantized to a grid step (--quantize, in mesh units) and
+welded (--weld): the vertices with the same coordinates after quantization
+are merged and the faces collapsed by the merge are dropped.
+
+Each mesh <name>.<ext> becomes <name>.<format> in the output directory; the
+meshes that changed name are listed in the transcoded.json manifest of the
+output directory, {"<name>.<ext>": "<name>.<format>"}. split_mesh_paths.py
+-renamed (or the transcode stage of pipeline.py) rewrites the mesh filenames
+of the URDF accordingly.
+
+examples:
+python3 mesh_tools/transcode.py -in meshes/visual
+python3 mesh_tools/transcode.py -in vendor/meshes -out meshes/visual -f ply -w -q 1e-6 -j 8
+python3 mesh_tools/transcode.py -in meshes/collision -w -rm
+"""
+
+# change this when the output of transcode_file changes
+TRANSCODE_CACHE_VERSION = "transcode:1"
+TRANSCODE_FORMATS = ("stl", "ply")
+TRANSCODED_MANIFEST = "transcoded.json"
+# whether a file is already in the binary format
+IS_BINARY = {"stl": is_binary_stl, "ply": is_binary_ply}
+
+
+def read_transcode_input(path) -> Tuple[np.ndarray, np.ndarray]:
+    """Vertices and faces of a mesh as stored in its file: the triangles of
+    an STL file are not welded."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".stl":
+        triangles = read_stl_triangles(path)
+        faces = np.arange(len(triangles) * 3).reshape(-1, 3)
+        return np.asarray(triangles, dtype=np.float64).reshape(-1, 3), faces
+    if extension == ".obj":
+        return read_obj(path)
+    import trimesh
+
+    mesh = trimesh.load(path, force="mesh", process=False)
+    return np.asarray(mesh.vertices, dtype=np.float64), np.asarray(mesh.faces)
+
+
+def quantize_vertices(vertices: np.ndarray, step: float) -> np.ndarray:
+    return np.round(vertices / step) * step
+
+
+def weld_mesh(vertices: np.ndarray, faces: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Merge the vertices with the same coordinates and drop the faces using
+    a vertex twice or the same vertices as a previous face."""
+    vertices, inverse = np.unique(vertices, axis=0, return_inverse=True)
+    faces = remove_degenerate_faces(inverse.reshape(-1)[faces])
+    return compact_mesh(vertices, faces)
+
+
+def transcoded_name(name, file_type) -> str:
+    """`name` with the extension of `file_type`, unchanged if it already has
+    it in another case, e.g. "part.STL" for "stl"."""
+    stem, extension = os.path.splitext(name)
+    if extension.lower() == f".{file_type}":
+        return name
+    return f"{stem}.{file_type}"
+
+
+def transcode_file(
+    input_path,
+    produced_path,
+    file_type="stl",
+    weld=False,
+    quantize: Optional[float] = None,
+) -> dict:
+    """Write the mesh of `input_path` to `produced_path` as a binary
+    `file_type` file. Never raises: the error is returned in the result."""
+    result = {"input": input_path, "error": None, "cached": False}
+    start = time.perf_counter()
+    try:
+        vertices, faces = read_transcode_input(input_path)
+        if quantize is not None:
+            vertices = quantize_vertices(vertices, quantize)
+        new_vertices, new_faces = vertices, faces
+        if weld:
+            new_vertices, new_faces = weld_mesh(vertices, faces)
+        result["faces"] = [len(faces), len(new_faces)]
+        result["vertices"] = [len(vertices), len(new_vertices)]
+        if file_type == "ply":
+            write_binary_ply(produced_path, new_vertices, new_faces)
+        else:
+            write_binary_stl(produced_path, new_vertices, new_faces)
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+        if os.path.exists(produced_path):
+            os.remove(produced_path)
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def _transcode_job(args) -> dict:
+    return transcode_file(*args)
+
+
+def read_transcoded_manifest(out_dir) -> Dict[str, str]:
+    path = os.path.join(out_dir, TRANSCODED_MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def write_transcoded_manifest(out_dir, manifest: Dict[str, str]):
+    path = os.path.join(out_dir, TRANSCODED_MANIFEST)
+    tmp_path = os.path.join(out_dir, f".tmp_{os.getpid()}_{TRANSCODED_MANIFEST}")
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=4, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+@profiler.profiled("transcode")
+def transcode_files(
+    paths: List[str],
+    out_dir,
+    file_type="stl",
+    weld=False,
+    quantize: Optional[float] = None,
+    remove_sources=False,
+    workers: Optional[int] = None,
+    cache: Optional[MeshCache] = None,
+) -> Dict[str, str]:
+    """Transcode the meshes into `out_dir` with `workers` processes, a failed
+    mesh being reported and left unchanged, update the manifest of the
+    renamed meshes of `out_dir` and return it. With `remove_sources`, the
+    inputs replaced by a file of another name are deleted.
+
+    The files already in the binary format, transcoded in place without
+    weld or quantization, are skipped, there is nothing to gain."""
+    assert file_type in TRANSCODE_FORMATS, f"Unknown format {file_type}"
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = read_transcoded_manifest(out_dir)
+    params = f"{TRANSCODE_CACHE_VERSION}:{file_type}:{weld}:{quantize}"
+    # the meshes transcoded in place by a previous run, from sources still there
+    names = {os.path.basename(path) for path in paths}
+    products = {new for old, new in manifest.items() if old in names}
+    paths = [
+        path
+        for path in paths
+        if not (
+            os.path.basename(path) in products
+            and os.path.abspath(os.path.dirname(path)) == os.path.abspath(out_dir)
+        )
+    ]
+    outputs = [
+        os.path.join(out_dir, transcoded_name(os.path.basename(path), file_type))
+        for path in paths
+    ]
+    # measured before the cache replaces the meshes transcoded in place
+    input_bytes = [os.path.getsize(path) for path in paths]
+    sources: Dict[str, List[str]] = {}
+    for input_path, output_path in zip(paths, outputs):
+        sources.setdefault(output_path, []).append(input_path)
+    results = [None] * len(paths)
+    jobs, pending = [], []
+    for index, (input_path, output_path) in enumerate(zip(paths, outputs)):
+        result = {"input": input_path, "error": None, "cached": False, "seconds": 0.0}
+        in_place = os.path.abspath(input_path) == os.path.abspath(output_path)
+        if len(sources[output_path]) > 1:
+            colliding = [os.path.basename(path) for path in sources[output_path]]
+            result["error"] = (
+                f"{', '.join(colliding)} would all be written to {output_path}"
+            )
+            results[index] = result
+            continue
+        if in_place and not weld and quantize is None:
+            if IS_BINARY[file_type](input_path):
+                results[index] = dict(result, skipped=True)
+                continue
+        key = None
+        if cache is not None:
+            key = cache.key(input_path, params)
+            if cache.fetch(key, output_path):
+                results[index] = dict(result, cached=True)
+                continue
+        # keep the extension, it gives the format
+        out_name = os.path.basename(output_path)
+        produced_path = os.path.join(
+            out_dir, f".tmp_transcode_{os.getpid()}_{out_name}"
+        )
+        jobs.append((input_path, produced_path, file_type, weld, quantize))
+        pending.append((index, output_path, produced_path, key))
+
+    workers = os.cpu_count() if workers is None else workers
+    workers = max(1, min(workers, len(jobs)))
+    if workers == 1:
+        produced = list(map(_transcode_job, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            produced = list(executor.map(_transcode_job, jobs))
+    for (index, output_path, produced_path, key), result in zip(pending, produced):
+        if result["error"] is None:
+            if cache is not None:
+                cache.store(key, produced_path, output_path)
+            else:
+                replace_file(produced_path, output_path)
+        results[index] = result
+
+    total = [0, 0]
+    for index, result in enumerate(results, 1):
+        name = os.path.basename(result["input"])
+        if result["error"] is not None:
+            print(f"[{index}/{len(results)}] FAILED {name} ({result['seconds']:.2f}s)")
+            print(f"    {result['error']}")
+            continue
+        if result.get("skipped"):
+            print(f"[{index}/{len(results)}] SKIPPED {name}, already binary")
+            continue
+        new_name = os.path.basename(outputs[index - 1])
+        if new_name != name:
+            manifest[name] = new_name
+            if remove_sources:
+                os.remove(result["input"])
+        sizes = [input_bytes[index - 1], os.path.getsize(outputs[index - 1])]
+        total = [total[0] + sizes[0], total[1] + sizes[1]]
+        status = "CACHED" if result["cached"] else "OK"
+        faces = ""
+        if "faces" in result and result["faces"][0] != result["faces"][1]:
+            faces = f", {result['faces'][0]} -> {result['faces'][1]} faces"
+        print(
+            f"[{index}/{len(results)}] {status} {name} -> {new_name}, "
+            f"{sizes[0] / 1e6:.2f} -> {sizes[1] / 1e6:.2f} MB{faces} "
+            f"({result['seconds']:.2f}s)"
+        )
+    write_transcoded_manifest(out_dir, manifest)
+    failed = sum(result["error"] is not None for result in results)
+    profiler.count("files_read", len(results))
+    profiler.count("files_cached", sum(result["cached"] for result in results))
+    profiler.count("files_failed", failed)
+    profiler.count("bytes_read", total[0])
+    profiler.count("bytes_written", total[1])
+    print(
+        f"Transcoded {len(results) - failed}/{len(results)} meshes, "
+        f"{total[0] / 1e6:.1f} -> {total[1] / 1e6:.1f} MB"
+    )
+    if cache is not None:
+        cache.print_stats()
+    return manifest
+
+
+def main(argv=None):
+    import argparse
+    from .mesh_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_SIZE
+
+    parser = argparse.ArgumentParser(
+        description="Transcode meshes to a compact binary format"
+    )
+    parser.add_argument(
+        "-in", "--input_dir", type=str, help="Directory containing the meshes"
+    )
+    parser.add_argument(
+        "-out",
+        "--output_dir",
+        type=str,
+        help="Directory of the transcoded meshes and their manifest, the input "
+        "one by default",
+        default=None,
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        type=str,
+        help="Format of the transcoded meshes",
+        default="stl",
+        choices=TRANSCODE_FORMATS,
+    )
+    parser.add_argument(
+        "-w",
+        "--weld",
+        action="store_true",
+        help="Merge the vertices with the same coordinates and drop the "
+        "degenerate faces",
+    )
+    parser.add_argument(
+        "-q",
+        "--quantize",
+        type=float,
+        help="Round the vertex coordinates to multiples of this step",
+        default=None,
+    )
+    parser.add_argument(
+        "-rm",
+        "--remove_sources",
+        action="store_true",
+        help="Delete the meshes replaced by a file of another name",
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        help="Number of worker processes, defaults to the number of cores",
+        default=None,
+    )
+    parser.add_argument(
+        "-cache",
+        "--cache_dir",
+        type=str,
+        help="Directory of the transcoded meshes cache",
+        default=DEFAULT_CACHE_DIR,
+    )
+    parser.add_argument(
+        "-cs",
+        "--cache_size",
+        type=float,
+        help="Maximum size of the cache in MB",
+        default=DEFAULT_MAX_SIZE / 1024**2,
+    )
+    parser.add_argument(
+        "-ncache", "--no_cache", action="store_true", help="Disable the cache"
+    )
+    profiler.add_arguments(parser)
+    args = parser.parse_args(argv)
+    profiler.enable_from_args(args)
+
+    out_dir = args.input_dir if args.output_dir is None else args.output_dir
+    paths = [
+        os.path.join(args.input_dir, name)
+        for name in sorted(os.listdir(args.input_dir))
+        if name.lower().endswith(MESH_FORMATS) and not name.startswith(".")
+    ]
+    if len(paths) == 0:
+        print(f"No meshes found in {args.input_dir}")
+        return
+    cache = None
+    if not args.no_cache:
+        cache = MeshCache(args.cache_dir, int(args.cache_size * 1024**2))
+    transcode_files(
+        paths,
+        out_dir,
+        args.format,
+        args.weld,
+        args.quantize,
+        args.remove_sources,
+        args.workers,
+        cache,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,496 @@
+import json
+import os, sys
+from typing import Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from urdf_to_xacro import URDFer, load_config
+import profiler
+
+"""
+Run several URDF modifying stages on one parsed tree in a single process.
+
+examples:
+python3 pipeline.py -in robot.urdf -cfg urdf_config.py -st joints_limit links_inertial to_xacro_style format
+python3 pipeline.py -in robot.urdf -spec pipeline.json
+
+pipeline.json:
+{
+    "config": "urdf_config_robot/urdf_config.py",
+    "stages": [
+        {"stage": "rename", "pattern": "World_robot_robot", "replacement": "base_link"},
+        {"stage": "split_mesh_paths", "old_visual_path": "meshes", "new_visual_path": "package://robot/meshes/visual", "create_collision": true, "fit_primitives": {"max_error": 0.02}},
+        {"stage": "joints_limit"},
+        {"stage": "links_inertial"},
+        {"stage": "mesh_inertial", "density": 1000.0, "masses": {"base_link": 3.2}, "package_paths": ["~/ws/src"]},
+        {"stage": "transcode", "file_type": "stl", "weld": true, "workers": 4},
+        {"stage": "decimate", "ratio": 0.1, "source": "collision", "prefix": "decimated_", "workers": 4},
+        {"stage": "convex_decomposition", "max_pieces": 8, "max_concavity": 0.01},
+        {"stage": "to_xacro_style", "prefix": "prefix"},
+        {"stage": "format"}
+    ]
+}
+"""
+
+STAGES: Dict[str, Callable] = {}
+
+
+def stage(name):
+    def register(func):
+        STAGES[name] = func
+        return func
+
+    return register
+
+
+@stage("rename")
+def rename_stage(pipeline: "Pipeline", pattern, replacement):
+    pipeline.urdfer.replace_in_tree(pattern, replacement)
+
+
+@stage("split_mesh_paths")
+def split_mesh_paths_stage(
+    pipeline: "Pipeline",
+    old_visual_path,
+    new_visual_path,
+    old_collision_path=None,
+    new_collision_path=None,
+    create_collision=False,
+    collision_pieces=None,
+    collision_primitives=None,
+    fit_primitives=None,
+    renamed_meshes=None,
+):
+    """`collision_pieces` is a pieces.json manifest of convex pieces, or its
+    path, see mesh_tools/convex_decomposition.py. `collision_primitives` are
+    the primitives to create the collisions with, or the path of their .json,
+    see mesh_tools/primitives.py; with `fit_primitives`, the keyword
+    arguments of its links_primitives (e.g. {"max_error": 0.02}), they are
+    fitted to the visual meshes first. `renamed_meshes` is a transcoded.json
+    manifest of mesh_tools/transcode.py, or its path."""
+    if isinstance(renamed_meshes, str):
+        with open(renamed_meshes, "r", encoding="utf-8") as file:
+            renamed_meshes = json.load(file)
+    if isinstance(collision_pieces, str):
+        with open(collision_pieces, "r", encoding="utf-8") as file:
+            collision_pieces = json.load(file)
+    if isinstance(collision_primitives, str):
+        with open(collision_primitives, "r", encoding="utf-8") as file:
+            collision_primitives = json.load(file)
+    if fit_primitives is not None:
+        from mesh_tools.primitives import links_primitives
+
+        urdfer = pipeline.urdfer
+        collision_primitives = links_primitives(
+            urdfer.links.values(),
+            os.path.dirname(os.path.abspath(urdfer.file_path)),
+            cache=pipeline.mesh_cache(),
+            **fit_primitives,
+        )
+    old_collision_path = (
+        old_visual_path if old_collision_path is None else old_collision_path
+    )
+    new_collision_path = (
+        new_visual_path if new_collision_path is None else new_collision_path
+    )
+    pipeline.urdfer.split_mesh_paths(
+        old_visual_path,
+        new_visual_path,
+        old_collision_path,
+        new_collision_path,
+        create_collision,
+        collision_pieces,
+        collision_primitives,
+        renamed_meshes,
+    )
+
+
+@stage("joints_limit")
+def joints_limit_stage(pipeline: "Pipeline", joints_limit=None):
+    joints_limit = pipeline.config_value("joints_limit", joints_limit)
+    if joints_limit is not None:
+        pipeline.urdfer.replace_joint_limits(joints_limit)
+
+
+@stage("links_inertial")
+def links_inertial_stage(pipeline: "Pipeline", links_inertial=None):
+    links_inertial = pipeline.config_value("links_inertial", links_inertial)
+    if links_inertial is not None:
+        pipeline.urdfer.replace_link_inertial(links_inertial)
+
+
+@stage("mesh_inertial")
+def mesh_inertial_stage(
+    pipeline: "Pipeline",
+    density=1000.0,
+    masses=None,
+    source="visual",
+    package_paths=None,
+    workers=None,
+):
+    """Compute the links inertial from their meshes and apply them."""
+    from mesh_tools.mesh_inertia import links_mesh_inertial
+
+    urdfer = pipeline.urdfer
+    link_inertial = links_mesh_inertial(
+        urdfer.links.values(),
+        os.path.dirname(os.path.abspath(urdfer.file_path)),
+        density=density,
+        masses=masses,
+        source=source,
+        package_paths=package_paths,
+        workers=workers,
+        cache=pipeline.mesh_cache(),
+    )
+    urdfer.replace_link_inertial(link_inertial)
+
+
+@stage("decimate")
+def decimate_stage(
+    pipeline: "Pipeline",
+    target_faces=None,
+    ratio=None,
+    max_error=None,
+    source="collision",
+    package_paths=None,
+    workers=None,
+    prefix="decimated_",
+    in_place=False,
+):
+    """Simplify the `source` meshes of the links into `prefix` + name next
+    to them and rename their files in the links, the meshes already named
+    with `prefix` excepted. With `in_place` the meshes are overwritten
+    instead, so running it again decimates them again. The meshes also used
+    by the other kind of geometry are left unchanged."""
+    from mesh_tools.decimate import decimate_files
+    from mesh_tools.mesh_inertia import (
+        link_meshes,
+        package_paths_from_env,
+        resolve_mesh_path,
+    )
+
+    assert in_place or prefix, "An empty prefix needs in_place set to true"
+    package_paths = (
+        package_paths_from_env() if package_paths is None else package_paths
+    )
+    base_dir = os.path.dirname(os.path.abspath(pipeline.urdfer.file_path))
+    other = "visual" if source == "collision" else "collision"
+    shared = set()
+    for link in pipeline.urdfer.links.values():
+        for mesh in link_meshes(link, other):
+            path = resolve_mesh_path(mesh["filename"], base_dir, package_paths)
+            if path is not None:
+                shared.add(os.path.realpath(path))
+    # the <mesh> elements of each source mesh to decimate
+    handles: Dict[str, list] = {}
+    for link in pipeline.urdfer.links.values():
+        for mesh_handle in link.iterfind(f"{source}/geometry/mesh"):
+            filename = mesh_handle.get("filename")
+            if filename is None:
+                continue
+            path = resolve_mesh_path(filename, base_dir, package_paths)
+            if path is None:
+                print(f"Mesh not found: {filename}")
+                continue
+            if os.path.realpath(path) in shared:
+                print(f"Not decimating the {other} mesh {path}")
+            elif in_place or not os.path.basename(path).startswith(prefix):
+                handles.setdefault(os.path.abspath(path), []).append(mesh_handle)
+    jobs = []
+    for path in sorted(handles):
+        directory, name = os.path.split(path)
+        jobs.append((path, path if in_place else os.path.join(directory, prefix + name)))
+    if not jobs:
+        return
+    results = decimate_files(
+        jobs, target_faces, ratio, max_error, workers, pipeline.mesh_cache()
+    )
+    if in_place:
+        return
+    for (path, _), result in zip(jobs, results):
+        if result["error"] is not None:
+            continue
+        for mesh_handle in handles[path]:
+            directory, slash, name = mesh_handle.get("filename").rpartition("/")
+            mesh_handle.set("filename", directory + slash + prefix + name)
+
+
+@stage("convex_decomposition")
+def convex_decomposition_stage(
+    pipeline: "Pipeline",
+    max_pieces=8,
+    max_concavity=0.01,
+    package_paths=None,
+    workers=None,
+):
+    """Split the collision meshes of the links into convex pieces, written
+    next to them, and replace each collision by one per piece."""
+    from mesh_tools.convex_decomposition import decompose_files
+    from mesh_tools.mesh_inertia import (
+        link_meshes,
+        package_paths_from_env,
+        resolve_mesh_path,
+    )
+    from urdf_to_xacro import split_collision_pieces
+
+    package_paths = (
+        package_paths_from_env() if package_paths is None else package_paths
+    )
+    base_dir = os.path.dirname(os.path.abspath(pipeline.urdfer.file_path))
+    directories: Dict[str, set] = {}
+    for link in pipeline.urdfer.links.values():
+        for mesh in link_meshes(link, "collision"):
+            path = resolve_mesh_path(mesh["filename"], base_dir, package_paths)
+            if path is None:
+                print(f"Mesh not found: {mesh['filename']}")
+                continue
+            directories.setdefault(os.path.dirname(path), set()).add(path)
+    collision_pieces = {}
+    for directory, paths in sorted(directories.items()):
+        manifest = decompose_files(
+            sorted(paths),
+            directory,
+            max_pieces,
+            max_concavity,
+            workers,
+            pipeline.mesh_cache(),
+        )
+        for path in paths:
+            name = os.path.basename(path)
+            if name in manifest:
+                collision_pieces[name] = manifest[name]
+    for link in pipeline.urdfer.links.values():
+        split_collision_pieces(link, collision_pieces)
+
+
+@stage("transcode")
+def transcode_stage(
+    pipeline: "Pipeline",
+    file_type="stl",
+    weld=False,
+    quantize=None,
+    remove_sources=False,
+    package_paths=None,
+    workers=None,
+):
+    """Transcode the visual and collision meshes of the links next to them
+    and rename their files in the links, e.g. part.obj to part.stl."""
+    from mesh_tools.mesh_inertia import (
+        link_meshes,
+        package_paths_from_env,
+        resolve_mesh_path,
+    )
+    from mesh_tools.transcode import transcode_files
+    from urdf_to_xacro import rename_link_meshes
+
+    package_paths = (
+        package_paths_from_env() if package_paths is None else package_paths
+    )
+    base_dir = os.path.dirname(os.path.abspath(pipeline.urdfer.file_path))
+    directories: Dict[str, set] = {}
+    for link in pipeline.urdfer.links.values():
+        for kind in ("visual", "collision"):
+            for mesh in link_meshes(link, kind):
+                path = resolve_mesh_path(mesh["filename"], base_dir, package_paths)
+                if path is None:
+                    print(f"Mesh not found: {mesh['filename']}")
+                    continue
+                directories.setdefault(os.path.dirname(path), set()).add(path)
+    renamed_meshes = {}
+    for directory, paths in sorted(directories.items()):
+        manifest = transcode_files(
+            sorted(paths),
+            directory,
+            file_type,
+            weld,
+            quantize,
+            remove_sources,
+            workers,
+            pipeline.mesh_cache(),
+        )
+        for path in paths:
+            name = os.path.basename(path)
+            if name in manifest:
+                renamed_meshes[name] = manifest[name]
+    for link in pipeline.urdfer.links.values():
+        rename_link_meshes(link, renamed_meshes)
+
+
+@stage("to_xacro_style")
+def to_xacro_style_stage(pipeline: "Pipeline", prefix="prefix"):
+    pipeline.urdfer.to_xacro_style(prefix)
+
+
+@stage("format")
+def format_stage(pipeline: "Pipeline"):
+    pipeline.formatted = True
+
+
+class Pipeline(object):
+    """A declared list of stages applied in order to one URDFer instance.
+
+    Each stage is a dict with a "stage" key naming one of the registered
+    STAGES and the keyword arguments of that stage. The file is parsed once
+    and written once at the end of `run`. The mesh stages share a MeshCache
+    in `cache_dir` (the default cache directory if None) of at most
+    `cache_size` bytes, unless `use_cache` is False.
+    """
+
+    def __init__(
+        self,
+        stages: List[dict],
+        config: Optional[dict] = None,
+        cache_dir: Optional[str] = None,
+        cache_size: Optional[int] = None,
+        use_cache=True,
+    ) -> None:
+        for item in stages:
+            assert (
+                item.get("stage") in STAGES
+            ), f"Unknown stage {item.get('stage')}, choose from {list(STAGES)}"
+        self.stages = stages
+        self.config = config
+        self.urdfer: Optional[URDFer] = None
+        self.formatted = False
+        self.cache_dir = cache_dir
+        self.cache_size = cache_size
+        self.use_cache = use_cache
+        self._mesh_cache = None
+
+    @classmethod
+    def from_spec(cls, spec_path, **kwargs):
+        with open(spec_path, "r", encoding="utf-8") as file:
+            spec: dict = json.load(file)
+        config = None
+        config_path = spec.get("config")
+        if config_path is not None:
+            if not os.path.isabs(config_path):
+                spec_dir = os.path.dirname(os.path.abspath(spec_path))
+                config_path = os.path.join(spec_dir, config_path)
+            config = load_config(config_path)
+        return cls(spec["stages"], config, **kwargs)
+
+    def mesh_cache(self):
+        """The MeshCache of the mesh stages, created when first used."""
+        if self.use_cache and self._mesh_cache is None:
+            from mesh_tools.mesh_cache import (
+                DEFAULT_CACHE_DIR,
+                DEFAULT_MAX_SIZE,
+                MeshCache,
+            )
+
+            self._mesh_cache = MeshCache(
+                DEFAULT_CACHE_DIR if self.cache_dir is None else self.cache_dir,
+                DEFAULT_MAX_SIZE if self.cache_size is None else self.cache_size,
+            )
+        return self._mesh_cache
+
+    def config_value(self, key, value=None):
+        if value is not None or self.config is None:
+            return value
+        return self.config.get(key)
+
+    def default_output_path(self, input_path: str) -> str:
+        if any(item["stage"] == "to_xacro_style" for item in self.stages):
+            return input_path.replace(".urdf", ".xacro")
+        return input_path
+
+    def run(self, input_path, output_path=None) -> URDFer:
+        output_path = (
+            self.default_output_path(input_path) if output_path is None else output_path
+        )
+        self.formatted = False
+        self.urdfer = URDFer(input_path)
+        for item in self.stages:
+            params = {k: v for k, v in item.items() if k != "stage"}
+            print(f"Running stage {item['stage']}...")
+            with profiler.stage(f"stage:{item['stage']}"):
+                STAGES[item["stage"]](self, **params)
+        self.urdfer.save(output_path, pretty=self.formatted)
+        print(f"Output file saved to {output_path}")
+        return self.urdfer
+
+
+def main(argv=None):
+    import argparse
+    from mesh_tools.mesh_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_SIZE
+
+    parser = argparse.ArgumentParser(
+        description="Run URDF modifying stages on one parsed tree"
+    )
+    parser.add_argument(
+        "-in", "--input_urdf_path", type=str, help="Path to the URDF file"
+    )
+    parser.add_argument(
+        "-out",
+        "--output_urdf_path",
+        type=str,
+        help="Path to the output file",
+        default=None,
+    )
+    parser.add_argument(
+        "-spec",
+        "--spec_path",
+        type=str,
+        help="Path to a .json file declaring the config and the stages",
+        default=None,
+    )
+    parser.add_argument(
+        "-cfg",
+        "--config_file_path",
+        type=str,
+        help="Path to the configuration .py file, used with --stages",
+        default=None,
+    )
+    parser.add_argument(
+        "-st",
+        "--stages",
+        type=str,
+        nargs="*",
+        help="Stages without parameters to run in order, used without --spec_path",
+        default=["joints_limit", "links_inertial", "to_xacro_style", "format"],
+        choices=["joints_limit", "links_inertial", "to_xacro_style", "format"],
+    )
+    parser.add_argument(
+        "-cache",
+        "--cache_dir",
+        type=str,
+        help="Directory of the mesh cache of the mesh stages",
+        default=DEFAULT_CACHE_DIR,
+    )
+    parser.add_argument(
+        "-cs",
+        "--cache_size",
+        type=float,
+        help="Maximum size of the cache in MB",
+        default=DEFAULT_MAX_SIZE / 1024**2,
+    )
+    parser.add_argument(
+        "-ncache", "--no_cache", action="store_true", help="Disable the cache"
+    )
+    profiler.add_arguments(parser)
+    args = parser.parse_args(argv)
+    profiler.enable_from_args(args)
+    input_path: str = args.input_urdf_path
+    output_path: str = args.output_urdf_path
+    spec_path: str = args.spec_path
+    config_path: str = args.config_file_path
+
+    cache_options = dict(
+        cache_dir=args.cache_dir,
+        cache_size=int(args.cache_size * 1024**2),
+        use_cache=not args.no_cache,
+    )
+
+    if spec_path is not None:
+        pipeline = Pipeline.from_spec(spec_path, **cache_options)
+    else:
+        config = load_config(config_path) if config_path is not None else None
+        pipeline = Pipeline(
+            [{"stage": name} for name in args.stages], config, **cache_options
+        )
+    pipeline.run(input_path, output_path)
+    print("Done!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+import atexit
+import contextlib
+import functools
+import json
+import sys
+import time
+from typing import Dict, List, Optional
+
+"""
+Opt-in instrumentation of the tools: wall and CPU time per stage, peak memory
+per stage and counters (elements visited, files read, bytes rewritten...),
+written as a JSON report when the process exits.
+
+Nothing is recorded until `enable` is called, which the entry points do when
+`--profile` is given. Disabled, `stage` returns a shared no-op context and
+`count` and the `profiled` functions return after one global check, so the
+instrumented code runs as before. Counters that are costly to compute are
+guarded by `active()`.
+
+examples:
+python3 urdf_to_xacro.py -in robot.urdf -cfg urdf_config.py -ml all --profile
+python3 rename.py -path pkg -in old -out new --profile rename_profile.json --profile_memory
+"""
+
+DEFAULT_REPORT_PATH = "profile.json"
+
+
+def max_rss_bytes() -> Optional[int]:
+    """Peak resident memory of the process, None where the resource module
+    is not available (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # in bytes on macOS, in KB on Linux
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+class Profiler(object):
+    def __init__(self, memory=False) -> None:
+        self.memory = memory
+        self.stages: Dict[str, dict] = {}
+        self.counters: Dict[str, int] = {}
+        # [name, wall start, cpu start, traced bytes at start, inner peak]
+        self._stack: List[list] = []
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        if memory:
+            # imported only when memory is traced, it slows the startup down
+            import tracemalloc
+
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if self.memory:
+            import tracemalloc
+
+            if self._stack:
+                # keep the peak reached so far by the enclosing stage
+                outer = self._stack[-1]
+                outer[4] = max(outer[4], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            traced = tracemalloc.get_traced_memory()[0]
+        else:
+            traced = 0
+        self._stack.append([name, time.perf_counter(), time.process_time(), traced, 0])
+        try:
+            yield
+        finally:
+            name, wall, cpu, traced, inner_peak = self._stack.pop()
+            record = self.stages.setdefault(
+                name, {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0}
+            )
+            record["calls"] += 1
+            record["wall_seconds"] += time.perf_counter() - wall
+            record["cpu_seconds"] += time.process_time() - cpu
+            if self.memory:
+                peak = max(tracemalloc.get_traced_memory()[1], inner_peak)
+                record["peak_bytes"] = max(record.get("peak_bytes", 0), peak - traced)
+                if self._stack:
+                    outer = self._stack[-1]
+                    outer[4] = max(outer[4], peak)
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self) -> dict:
+        return {
+            "argv": sys.argv,
+            "wall_seconds": time.perf_counter() - self._wall,
+            "cpu_seconds": time.process_time() - self._cpu,
+            "max_rss_bytes": max_rss_bytes(),
+            "memory_traced": self.memory,
+            "stages": self.stages,
+            "counters": self.counters,
+        }
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.report(), file, indent=2)
+        print(f"Profile saved to {path}")
+
+
+PROFILER: Optional[Profiler] = None
+_NO_STAGE = contextlib.nullcontext()
+
+
+def active() -> bool:
+    return PROFILER is not None
+
+
+def stage(name):
+    """Context manager timing the enclosed code as the stage `name`."""
+    if PROFILER is None:
+        return _NO_STAGE
+    return PROFILER.stage(name)
+
+
+def count(name, value=1):
+    if PROFILER is not None:
+        PROFILER.count(name, value)
+
+
+def profiled(name=None):
+    """Decorator recording each call of the function as a stage, named after
+    the function by default."""
+
+    def decorate(func):
+        stage_name = func.__name__ if name is None else name
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if PROFILER is None:
+                return func(*args, **kwargs)
+            with PROFILER.stage(stage_name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def enable(report_path=DEFAULT_REPORT_PATH, memory=False) -> Profiler:
+    """Start recording and write the report to `report_path` at exit."""
+    global PROFILER
+    PROFILER = Profiler(memory)
+    atexit.register(PROFILER.save, report_path)
+    return PROFILER
+
+
+def add_arguments(parser):
+    """Add the --profile options to an argparse parser."""
+    parser.add_argument(
+        "--profile",
+        type=str,
+        nargs="?",
+        const=DEFAULT_REPORT_PATH,
+        default=None,
+        help=f"Record the stage timings and counters into a .json report "
+        f"({DEFAULT_REPORT_PATH} by default)",
+    )
+    parser.add_argument(
+        "--profile_memory",
+        action="store_true",
+        help="Also record the peak memory of each stage, slowing the run down",
+    )
+
+
+def enable_from_args(args):
+    if args.profile is not None:
+        enable(args.profile, args.profile_memory)
@@ -1,14 +1,123 @@
 import os
 import re
+import json
+import mmap
+import shutil
+import tempfile
 import argparse
+import sys
+from typing import List, Tuple, Union
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import profiler
 
 """
 examples:
 python3 replace_name.py -path package_path -in 'in_name' -out 'out_name'
 python3 replace_name.py -path package_path -in 'path://path_name' -out 'path://new_name'
+python3 replace_name.py -path package_path -r 'in_name' 'out_name' -r 'in_name2' 'out_name2'
+python3 replace_name.py -path package_path -map mapping.json
 """
 
 
+# backreferences, named groups and global inline flags, whose meaning changes
+# once the pattern is a group of a combined regex
+NOT_COMBINABLE = re.compile(r"\\[1-9]|\(\?P[<=]|\(\?[aiLmsux]+\)")
+# escapes matching differently on str and on UTF-8 bytes
+UNICODE_ESCAPES = re.compile(r"\\[wWsSdDbB]")
+
+
+def is_ascii_safe(pattern: str) -> bool:
+    """Whether `pattern` matches the UTF-8 bytes of a text exactly where it
+    matches the text: no `.`, negated set, Unicode class or case folding,
+    which match one byte instead of one character."""
+    if not pattern.isascii() or UNICODE_ESCAPES.search(pattern):
+        return False
+    unescaped = re.sub(r"\\.", "", pattern)
+    return not re.search(r"\.|\[\^|\(\?[aLmsux]*i", unescaped)
+
+
+class Replacer(object):
+    """Several pattern/replacement pairs applied in a single pass with one
+    combined regex. Each match is replaced by the replacement of the first
+    pattern matching at that position, so unlike chained `re.sub` calls a
+    replaced text is never matched again by the following patterns.
+
+    Patterns that can not be combined (see NOT_COMBINABLE) are applied by
+    chained `re.sub` calls instead."""
+
+    def __init__(self, replacements: List[Tuple[str, str]]) -> None:
+        assert len(replacements) > 0, "No replacements given"
+        self.replacements = list(replacements)
+        self.patterns = [re.compile(pattern) for pattern, _ in self.replacements]
+        if any(NOT_COMBINABLE.search(pattern.pattern) for pattern in self.patterns):
+            self.regex = None
+            self.bytes_regex = None
+            return
+        # wrap each pattern in a group and remember its index, the groups
+        # of the patterns themselves shift the following indexes
+        self.group_indexes = {}
+        index = 1
+        for i, pattern in enumerate(self.patterns):
+            self.group_indexes[index] = i
+            index += pattern.groups + 1
+        self.regex = re.compile(
+            "|".join(f"({pattern.pattern})" for pattern in self.patterns)
+        )
+        # the same regex on raw bytes, used to skip files without any match
+        # before decoding them, when it finds the same matches
+        self.bytes_regex = None
+        if all(is_ascii_safe(pattern.pattern) for pattern in self.patterns):
+            try:
+                self.bytes_regex = re.compile(self.regex.pattern.encode("ascii"))
+            except re.error:
+                pass
+
+    def _replace(self, match: re.Match) -> str:
+        i = self.group_indexes[match.lastindex]
+        replacement = self.replacements[i][1]
+        if "\\" not in replacement:
+            return replacement
+        # expand group references with the original pattern at the same position
+        sub_match = self.patterns[i].match(match.string, match.start())
+        return sub_match.expand(replacement)
+
+    def sub(self, text: str) -> str:
+        if self.regex is None:
+            for pattern, (_, replacement) in zip(self.patterns, self.replacements):
+                text = pattern.sub(replacement, text)
+            return text
+        return self.regex.sub(self._replace, text)
+
+
+def load_mapping(mapping_path) -> List[Tuple[str, str]]:
+    """Load replacements from a .json file, either a {pattern: replacement}
+    object or a list of [pattern, replacement] pairs."""
+    with open(mapping_path, "r", encoding="utf-8") as file:
+        mapping = json.load(file)
+    if isinstance(mapping, dict):
+        return list(mapping.items())
+    return [tuple(pair) for pair in mapping]
+
+
+# contents of these files are never modified
+SKIP_CONTENT_EXTENSIONS = {
+    ".stl",
+    ".png",
+    ".jpg",
+    ".jpeg",
+    ".bmp",
+    ".gif",
+    ".tif",
+    ".tiff",
+    ".pdf",
+    ".zip",
+    ".gz",
+    ".so",
+    ".pyc",
+}
+
+
 def is_binary_file(file_path):
     try:
         with open(file_path, "rb") as file:
@@ -21,52 +130,121 @@ def is_binary_file(file_path):
         return False
 
 
-def replace_in_file(file_path, pattern, replacement):
+def _as_replacer(replacements: Union[Replacer, List[Tuple[str, str]]]) -> Replacer:
+    if isinstance(replacements, Replacer):
+        return replacements
+    return Replacer(replacements)
+
+
+def replace_in_file(file_path, pattern, replacement) -> bool:
+    return replace_all_in_file(file_path, [(pattern, replacement)])
+
+
+def is_text_candidate(file_path) -> bool:
+    ext = os.path.splitext(file_path)[1].lower()
+    return ext not in SKIP_CONTENT_EXTENSIONS and not is_binary_file(file_path)
+
+
+def _contains_match(file_path, replacer: Replacer) -> bool:
+    if replacer.bytes_regex is None:
+        return True
+    with open(file_path, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        profiler.count("bytes_scanned", size)
+        if size == 0:
+            return False
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return replacer.bytes_regex.search(mapped) is not None
+
+
+def replace_all_in_file(file_path, replacements) -> bool:
+    """Replace the patterns in the file contents and return whether the file
+    changed. Files without any match are only scanned, not decoded, and a
+    changed file is replaced atomically."""
+    replacer = _as_replacer(replacements)
+    if not _contains_match(file_path, replacer):
+        return False
     try:
-        with open(file_path, "r", encoding="utf-8") as file:
+        with open(file_path, "r", encoding="utf-8", newline="") as file:
             content = file.read()
     except UnicodeDecodeError:
         print(f"Ignore modifying contents in {file_path}")
-    else:
-        new_content = re.sub(pattern, replacement, content)
+        return False
+    new_content = replacer.sub(content)
+    if new_content == content:
+        return False
 
-        with open(file_path, "w", encoding="utf-8") as file:
+    dir_path = os.path.dirname(os.path.abspath(file_path))
+    fd, tmp_path = tempfile.mkstemp(dir=dir_path, prefix=".tmp_rename_")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8", newline="") as file:
             file.write(new_content)
+        shutil.copymode(file_path, tmp_path)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    if profiler.active():
+        profiler.count("bytes_rewritten", os.path.getsize(file_path))
+    return True
 
 
 def rename_items(root_dir, pattern, replacement):
+    rename_all_items(root_dir, [(pattern, replacement)])
+
+
+@profiler.profiled("rename")
+def rename_all_items(root_dir, replacements):
+    """Apply all the replacements to the names of the files and directories
+    and to the file contents in one walk of the package."""
+    replacer = _as_replacer(replacements)
+    scanned = modified = skipped = renamed = 0
     for root, dirs, files in os.walk(root_dir, topdown=False):
         # print(f"Processing {root}")
         for name in files:
             # print("Processing file: ", name)
             old_file_path = os.path.join(root, name)
-            new_file_name = re.sub(pattern, replacement, name)
+            new_file_name = replacer.sub(name)
             new_file_path = os.path.join(root, new_file_name)
 
             # Replace the pattern in the content of the file
-            if ".STL" not in name and ".stl" not in name:  # skip STL files
-                # print(f"Modifying contents in {old_file_path}")
-                replace_in_file(old_file_path, pattern, replacement)
+            if is_text_candidate(old_file_path):  # skip binary files
+                scanned += 1
+                modified += replace_all_in_file(old_file_path, replacer)
             else:
-                print(f"Ignore modifying contents in {old_file_path}")
+                skipped += 1
 
             if new_file_path != old_file_path:
                 os.rename(old_file_path, new_file_path)
+                renamed += 1
 
         for name in dirs:
             # print("Processing directory: ", name)
             old_dir_path = os.path.join(root, name)
-            new_dir_name = re.sub(pattern, replacement, name)
+            new_dir_name = replacer.sub(name)
             new_dir_path = os.path.join(root, new_dir_name)
 
             if new_dir_path != old_dir_path:
                 os.rename(old_dir_path, new_dir_path)
+                renamed += 1
+    profiler.count("files_scanned", scanned)
+    profiler.count("files_modified", modified)
+    profiler.count("files_skipped", skipped)
+    profiler.count("paths_renamed", renamed)
+    print(
+        f"Modified contents of {modified} of {scanned} scanned files, "
+        f"skipped {skipped} binary files"
+    )
 
 
 def rename_path(path, pattern, replacement):
+    return rename_path_all(path, [(pattern, replacement)])
+
+
+def rename_path_all(path, replacements):
     dir = os.path.dirname(path)
     old_name = os.path.basename(path)
-    new_name = re.sub(pattern, replacement, old_name)
+    new_name = _as_replacer(replacements).sub(old_name)
     new_path = os.path.join(dir, new_name)
 
     if new_path != path:
@@ -75,40 +253,78 @@ def rename_path(path, pattern, replacement):
     return new_path
 
 
+_FILENAME_ATTR = re.compile(rb"""\sfilename\s*=\s*(["'])(.*?)\1""", re.S)
+
+
+@profiler.profiled()
 def replace_mesh_paths(
     urdf_path,
     old_visual_path,
     old_collision_path,
     new_visual_path,
     new_collision_path,
-) -> None:
-    # 读取URDF文件内容
-    with open(urdf_path, "r") as file:
-        urdf_content = file.read()
-    # 替换 <collision> 中的路径
-    urdf_content = re.sub(
-        r'(<collision>[\s\S]*?<mesh filename=")'
-        + re.escape(old_collision_path)
-        + r'([^"]+")',
-        r"\1" + new_collision_path + r"\2",
-        urdf_content,
-    )
+) -> int:
+    """Replace the leading `old_*_path` of the mesh filenames inside <visual>
+    and <collision> elements, and return the number of replaced paths.
 
-    # 替换 <visual> 中的路径
-    urdf_content = re.sub(
-        r'(<visual>[\s\S]*?<mesh filename=")'
-        + re.escape(old_visual_path)
-        + r'([^"]+")',
-        r"\1" + new_visual_path + r"\2",
-        urdf_content,
-    )
+    The file is parsed once by a streaming XML parser that records where the
+    <mesh> tags are, then only those attribute values are spliced, so the
+    rest of the file is kept byte for byte.
+    """
+    from xml.parsers import expat
 
-    with open(urdf_path, "w") as file:
-        file.write(urdf_content)
+    with open(urdf_path, "rb") as file:
+        content = file.read()
 
+    paths = {
+        "visual": (old_visual_path.encode(), new_visual_path.encode()),
+        "collision": (old_collision_path.encode(), new_collision_path.encode()),
+    }
+    kinds = []  # the open <visual> and <collision> elements
+    meshes = []  # (byte offset of the <mesh> tag, kind)
+    parser = expat.ParserCreate()
 
-if __name__ == "__main__":
+    def start_element(name, attrs):
+        if name in paths:
+            kinds.append(name)
+        elif name == "mesh" and kinds:
+            meshes.append((parser.CurrentByteIndex, kinds[-1]))
 
+    def end_element(name):
+        if name in paths:
+            kinds.pop()
+
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.Parse(content, True)
+
+    chunks = []
+    last = 0
+    count = 0
+    for offset, kind in meshes:
+        old_path, new_path = paths[kind]
+        tag_end = content.index(b">", offset)
+        match = _FILENAME_ATTR.search(content, offset, tag_end)
+        if match is None or not match.group(2).startswith(old_path):
+            continue
+        start = match.start(2)
+        chunks.append(content[last:start])
+        chunks.append(new_path)
+        last = start + len(old_path)
+        count += 1
+    profiler.count("mesh_paths_replaced", count)
+    if count == 0:
+        return 0
+    chunks.append(content[last:])
+
+    content = b"".join(chunks)
+    with open(urdf_path, "wb") as file:
+        file.write(content)
+    profiler.count("bytes_rewritten", len(content))
+    return count
+
+
+def main(argv=None):
     parser = argparse.ArgumentParser(
         description="Replace a pattern in the names of files and directories and in the content of files."
     )
@@ -119,6 +335,20 @@ if __name__ == "__main__":
     parser.add_argument(
         "-out", "--replacement_string", help="The string to replace the pattern with."
     )
+    parser.add_argument(
+        "-r",
+        "--replace",
+        nargs=2,
+        action="append",
+        default=[],
+        help="A pattern and its replacement, can be given several times.",
+        metavar=("pattern", "replacement"),
+    )
+    parser.add_argument(
+        "-map",
+        "--mapping_file",
+        help="A .json file of {pattern: replacement} or [[pattern, replacement], ...].",
+    )
 
     parser.add_argument(
         "-mesh",
@@ -133,16 +363,28 @@ if __name__ == "__main__":
             "new_collision_path",
         ),
     )
+    profiler.add_arguments(parser)
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    profiler.enable_from_args(args)
 
     replace_mesh_path = args.replace_mesh_path
     if replace_mesh_path is not None:
-        replace_mesh_paths(*replace_mesh_path)
+        count = replace_mesh_paths(*replace_mesh_path)
+        print(f"Replaced {count} mesh paths")
     else:
         path = os.path.expanduser(args.package_path)
-        search_pattern = args.search_pattern
-        replacement_string = args.replacement_string
-        rename_items(path, search_pattern, replacement_string)
-        rename_path(path, search_pattern, replacement_string)
+        replacements = []
+        if args.search_pattern is not None:
+            replacements.append((args.search_pattern, args.replacement_string))
+        replacements.extend(tuple(pair) for pair in args.replace)
+        if args.mapping_file is not None:
+            replacements.extend(load_mapping(args.mapping_file))
+        replacer = Replacer(replacements)
+        rename_all_items(path, replacer)
+        rename_path_all(path, replacer)
     print("Done!")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,57 +1,104 @@
-import xml.etree.ElementTree as ET
 import argparse
+import json
 import sys, os
 
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 from urdf_to_xacro import URDFer
+import profiler
 
-parser = argparse.ArgumentParser(
-    "Split mesh paths in URDF file to visual and collision paths"
-)
-
-parser.add_argument(
-    "-path", "--input_urdf_path", type=str, help="Path to the input URDF file"
-)
-parser.add_argument(
-    "-out", "--output_urdf_path", type=str, help="Path to the output URDF file"
-)
-parser.add_argument("-ov", "--old_visual_path", type=str, help="Old visual mesh path")
-parser.add_argument(
-    "-oc", "--old_collision_path", type=str, help="Old collision mesh path"
-)
-parser.add_argument("-nv", "--new_visual_path", type=str, help="New visual mesh path")
-parser.add_argument(
-    "-nc", "--new_collision_path", type=str, help="New collision mesh path"
-)
-parser.add_argument("-cc", "--create_collision", action="store_true")
-
-args = parser.parse_args()
-
-input_urdf_path: str = args.input_urdf_path
-output_urdf_path: str = args.output_urdf_path
-old_visual_path: str = args.old_visual_path
-old_collision_path: str = args.old_collision_path
-new_visual_path: str = args.new_visual_path
-new_collision_path: str = args.new_collision_path
-create_collision: bool = args.create_collision
-
-output_urdf_path = input_urdf_path if output_urdf_path is None else output_urdf_path
-old_collision_path = (
-    old_visual_path if old_collision_path is None else old_collision_path
-)
-new_collision_path = (
-    new_visual_path if new_collision_path is None else new_collision_path
-)
-
-urdfer = URDFer(input_urdf_path)
-urdfer.split_mesh_paths(
-    old_visual_path,
-    new_visual_path,
-    old_collision_path,
-    new_collision_path,
-    create_collision,
-)
-urdfer.save(output_urdf_path)
-urdfer.format(output_urdf_path)
-
-print("Done!")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Split mesh paths in URDF file to visual and collision paths"
+    )
+
+    parser.add_argument(
+        "-path", "--input_urdf_path", type=str, help="Path to the input URDF file"
+    )
+    parser.add_argument(
+        "-out", "--output_urdf_path", type=str, help="Path to the output URDF file"
+    )
+    parser.add_argument("-ov", "--old_visual_path", type=str, help="Old visual mesh path")
+    parser.add_argument(
+        "-oc", "--old_collision_path", type=str, help="Old collision mesh path"
+    )
+    parser.add_argument("-nv", "--new_visual_path", type=str, help="New visual mesh path")
+    parser.add_argument(
+        "-nc", "--new_collision_path", type=str, help="New collision mesh path"
+    )
+    parser.add_argument("-cc", "--create_collision", action="store_true")
+    parser.add_argument(
+        "-pieces",
+        "--collision_pieces",
+        type=str,
+        help="Path to the pieces.json of mesh_tools/convex_decomposition.py, to "
+        "replace each collision by one per convex piece of its mesh",
+        default=None,
+    )
+    parser.add_argument(
+        "-prims",
+        "--collision_primitives",
+        type=str,
+        help="Path to the .json of mesh_tools/primitives.py, to create primitive "
+        "collisions instead of meshes with --create_collision",
+        default=None,
+    )
+    parser.add_argument(
+        "-renamed",
+        "--renamed_meshes",
+        type=str,
+        help="Path to the transcoded.json of mesh_tools/transcode.py, to rename "
+        "the mesh files transcoded to another format",
+        default=None,
+    )
+    profiler.add_arguments(parser)
+
+    args = parser.parse_args(argv)
+    profiler.enable_from_args(args)
+
+    input_urdf_path: str = args.input_urdf_path
+    output_urdf_path: str = args.output_urdf_path
+    old_visual_path: str = args.old_visual_path
+    old_collision_path: str = args.old_collision_path
+    new_visual_path: str = args.new_visual_path
+    new_collision_path: str = args.new_collision_path
+    create_collision: bool = args.create_collision
+    collision_pieces = None
+    if args.collision_pieces is not None:
+        with open(args.collision_pieces, "r", encoding="utf-8") as file:
+            collision_pieces = json.load(file)
+    collision_primitives = None
+    if args.collision_primitives is not None:
+        with open(args.collision_primitives, "r", encoding="utf-8") as file:
+            collision_primitives = json.load(file)
+    renamed_meshes = None
+    if args.renamed_meshes is not None:
+        with open(args.renamed_meshes, "r", encoding="utf-8") as file:
+            renamed_meshes = json.load(file)
+
+    output_urdf_path = input_urdf_path if output_urdf_path is None else output_urdf_path
+    old_collision_path = (
+        old_visual_path if old_collision_path is None else old_collision_path
+    )
+    new_collision_path = (
+        new_visual_path if new_collision_path is None else new_collision_path
+    )
+
+    urdfer = URDFer(input_urdf_path)
+    urdfer.split_mesh_paths(
+        old_visual_path,
+        new_visual_path,
+        old_collision_path,
+        new_collision_path,
+        create_collision,
+        collision_pieces,
+        collision_primitives,
+        renamed_meshes,
+    )
+    urdfer.save(output_urdf_path)
+
+    print("Done!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import multiprocessing
+import os
+
+import pytest
+
+import batch
+
+URDF = """<?xml version="1.0"?>
+<robot name="{name}">
+  <link name="base_link"/>
+</robot>
+"""
+
+
+def make_jobs(tmp_path, names):
+    jobs = []
+    for name in names:
+        path = tmp_path / f"{name}.urdf"
+        path.write_text(URDF.format(name=name))
+        jobs.append(batch.make_job(str(path)))
+    return jobs
+
+
+def test_run_batch_converts_every_job(tmp_path):
+    jobs = make_jobs(tmp_path, [f"robot_{i}" for i in range(4)])
+    results = batch.run_batch(jobs, workers=2)
+    assert sorted(result["input"] for result in results) == sorted(
+        job["input"] for job in jobs
+    )
+    assert all(result["ok"] for result in results)
+    assert all(os.path.exists(job["input"].replace(".urdf", ".xacro")) for job in jobs)
+
+
+@pytest.mark.skipif(
+    multiprocessing.get_start_method() != "fork",
+    reason="the workers must be forked to run the patched job",
+)
+def test_a_dead_worker_fails_only_the_started_jobs(tmp_path, monkeypatch):
+    names = ["crash"] + [f"robot_{i}" for i in range(7)]
+    jobs = make_jobs(tmp_path, names)
+    run_job = batch.run_job
+
+    def crashing_run_job(job):
+        if "crash" in job["input"]:
+            os._exit(1)
+        return run_job(job)
+
+    monkeypatch.setattr(batch, "run_job", crashing_run_job)
+    workers = 2
+    results = batch.run_batch(jobs, workers=workers)
+
+    assert sorted(result["input"] for result in results) == sorted(
+        job["input"] for job in jobs
+    )
+    failed = [result for result in results if not result["ok"]]
+    crash = next(result for result in results if "crash" in result["input"])
+    assert crash in failed
+    assert crash["error"].startswith("BrokenProcessPool")
+    # at most one job per worker had started when the pool broke, the other
+    # ones are run again by a new pool
+    assert len(failed) <= workers
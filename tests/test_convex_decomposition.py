@@ -0,0 +1,74 @@
+import json
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+trimesh = pytest.importorskip("trimesh")
+
+from mesh_tools.convex_decomposition import (
+    PIECES_MANIFEST,
+    convex_decomposition,
+    decompose_files,
+)
+from mesh_tools.mesh_io import mesh_volume, write_binary_stl
+
+
+def l_prism():
+    """An L-shaped prism, the union of two boxes, with outward faces."""
+    outline = np.array([[0, 0], [2, 0], [2, 1], [1, 1], [1, 2], [0, 2]], float)
+    vertices = np.vstack([np.c_[outline, np.zeros(6)], np.c_[outline, np.ones(6)]])
+    top = [[0, 1, 2], [0, 2, 3], [0, 3, 4], [0, 4, 5]]
+    faces = [[a, c, b] for a, b, c in top] + [[a + 6, b + 6, c + 6] for a, b, c in top]
+    for i in range(6):
+        j = (i + 1) % 6
+        faces += [[i, j, j + 6], [i, j + 6, i + 6]]
+    return vertices, np.array(faces)
+
+
+def test_l_prism_is_a_valid_mesh():
+    mesh = trimesh.Trimesh(*l_prism(), process=False)
+    assert mesh.is_watertight and mesh.is_winding_consistent
+    assert mesh.volume == pytest.approx(3.0)
+
+
+def test_concave_mesh_is_split_into_convex_pieces():
+    vertices, faces = l_prism()
+    hulls = convex_decomposition(vertices, faces, max_pieces=8, max_concavity=0.01)
+    assert 2 <= len(hulls) <= 8
+    volumes = [mesh_volume(*hull) for hull in hulls]
+    assert all(volume > 0 for volume in volumes)
+    # the pieces cover the mesh, not much more than its volume
+    assert 3.0 - 1e-6 <= sum(volumes) < 3.0 * 1.2
+
+
+def test_convex_mesh_is_one_piece():
+    box = trimesh.creation.box()
+    hulls = convex_decomposition(box.vertices, box.faces)
+    assert len(hulls) == 1
+
+
+def test_manifest_drops_the_stale_pieces(tmp_path):
+    mesh_path = str(tmp_path / "l.stl")
+    write_binary_stl(mesh_path, *l_prism())
+    out_dir = str(tmp_path / "pieces")
+
+    manifest = decompose_files([mesh_path], out_dir, max_pieces=8, workers=1)
+    pieces = manifest["l.stl"]
+    assert len(pieces) >= 2
+    assert sorted(os.listdir(out_dir)) == sorted(pieces + [PIECES_MANIFEST])
+    with open(os.path.join(out_dir, PIECES_MANIFEST), encoding="utf-8") as file:
+        assert json.load(file) == manifest
+
+    manifest = decompose_files([mesh_path], out_dir, max_pieces=1, workers=1)
+    assert manifest == {"l.stl": ["l_piece0.stl"]}
+    assert sorted(os.listdir(out_dir)) == ["l_piece0.stl", PIECES_MANIFEST]
+
+
+def test_failed_mesh_is_left_out_of_the_manifest(tmp_path):
+    broken_path = str(tmp_path / "broken.stl")
+    with open(broken_path, "wb") as file:
+        file.write(b"not a mesh")
+    out_dir = str(tmp_path / "pieces")
+    assert decompose_files([broken_path], out_dir, workers=1) == {}
+    assert os.listdir(out_dir) == [PIECES_MANIFEST]
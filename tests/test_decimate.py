@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+trimesh = pytest.importorskip("trimesh")
+
+from mesh_tools.decimate import decimate_files, quadric_decimate
+from mesh_tools.mesh_cache import MeshCache
+
+
+def icosphere(subdivisions=3):
+    mesh = trimesh.creation.icosphere(subdivisions)
+    return np.asarray(mesh.vertices), np.asarray(mesh.faces)
+
+
+def test_decimated_icosphere_stays_watertight():
+    vertices, faces = icosphere()
+    new_vertices, new_faces = quadric_decimate(vertices, faces, target_faces=200)
+    mesh = trimesh.Trimesh(new_vertices, new_faces, process=False)
+    assert len(new_faces) <= 200
+    assert mesh.is_watertight
+    assert mesh.is_winding_consistent
+    # outward faces, close to the volume of the unit sphere
+    assert mesh.volume == pytest.approx(4 / 3 * np.pi, rel=0.1)
+
+
+def test_max_error_bounds_the_collapses():
+    vertices, faces = icosphere()
+    _, coarse_faces = quadric_decimate(vertices, faces, max_error=5e-2)
+    _, fine_faces = quadric_decimate(vertices, faces, max_error=1e-3)
+    assert len(coarse_faces) < len(fine_faces) == len(faces)
+
+
+def test_flat_faces_collapse_without_error():
+    box = trimesh.creation.box()
+    vertices, faces = trimesh.remesh.subdivide(box.vertices, box.faces)
+    vertices, faces = trimesh.remesh.subdivide(vertices, faces)
+    new_vertices, new_faces = quadric_decimate(vertices, faces, max_error=1e-9)
+    mesh = trimesh.Trimesh(new_vertices, new_faces, process=False)
+    assert len(new_faces) < len(faces)
+    assert mesh.is_watertight
+    assert mesh.volume == pytest.approx(box.volume)
+
+
+def test_decimate_files_replaces_the_cached_outputs(tmp_path):
+    mesh_path = str(tmp_path / "sphere.stl")
+    trimesh.creation.icosphere(3).export(mesh_path)
+    out_path = str(tmp_path / "decimated_sphere.stl")
+    cache = MeshCache(str(tmp_path / "cache"))
+
+    results = decimate_files([(mesh_path, out_path)], ratio=0.2, workers=1, cache=cache)
+    assert results[0]["error"] is None and not results[0]["cached"]
+    content = open(out_path, "rb").read()
+    results = decimate_files([(mesh_path, out_path)], ratio=0.2, workers=1, cache=cache)
+    assert results[0]["cached"]
+    assert open(out_path, "rb").read() == content
+    assert os.path.getsize(mesh_path) > len(content)
+
+
+def test_decimate_files_reports_a_failed_mesh(tmp_path):
+    broken_path = str(tmp_path / "broken.stl")
+    with open(broken_path, "wb") as file:
+        file.write(b"not a mesh")
+    out_path = str(tmp_path / "out.stl")
+    results = decimate_files([(broken_path, out_path)], ratio=0.5, workers=1)
+    assert results[0]["error"] is not None
+    assert not os.path.exists(out_path)
@@ -0,0 +1,89 @@
+import os
+
+from rename import Replacer, rename_all_items, replace_mesh_paths
+
+
+def test_first_pattern_wins_on_overlapping_matches():
+    assert Replacer([("ab", "X"), ("abc", "Y")]).sub("abcd") == "Xcd"
+    assert Replacer([("abc", "Y"), ("ab", "X")]).sub("abcd") == "Yd"
+
+
+def test_replaced_text_is_not_matched_again():
+    # chained re.sub calls would give "cc"
+    assert Replacer([("a", "b"), ("b", "c")]).sub("ab") == "bc"
+
+
+def test_group_references_of_each_pattern():
+    replacer = Replacer([(r"(\w+)_left", r"left_\1"), (r"x(\d)", r"y\1")])
+    assert replacer.sub("arm_left x1") == "left_arm y1"
+
+
+def test_not_combinable_patterns_are_chained():
+    replacer = Replacer([(r"(a)\1", "b"), ("b", "c")])
+    assert replacer.regex is None
+    assert replacer.sub("aab") == "cc"
+
+
+def test_rename_all_items_in_one_walk(tmp_path):
+    package = tmp_path / "old_robot"
+    (package / "urdf").mkdir(parents=True)
+    (package / "urdf" / "old_robot.urdf").write_text(
+        '<robot name="old_robot"><link name="old_base"/></robot>'
+    )
+    (package / "meshes").mkdir()
+    (package / "meshes" / "old_base.stl").write_bytes(b"old_robot\x00")
+
+    rename_all_items(str(package), [("old_robot", "new_robot"), ("old_base", "base")])
+
+    urdf_path = package / "urdf" / "new_robot.urdf"
+    expected = '<robot name="new_robot"><link name="base"/></robot>'
+    assert urdf_path.read_text() == expected
+    # binary contents are never modified
+    assert (package / "meshes" / "base.stl").read_bytes() == b"old_robot\x00"
+    assert sorted(os.listdir(package / "urdf")) == ["new_robot.urdf"]
+
+
+URDF = """<?xml version="1.0"?>
+<!-- <mesh filename="meshes/commented.stl"/> -->
+<robot name="r">
+  <link name="a">
+    <visual>
+      <geometry><mesh  filename = 'meshes/a.stl' scale="1 1 1"/></geometry>
+    </visual>
+    <collision>
+      <geometry>
+        <mesh scale="1 1 1"
+              filename="meshes/a.stl"/>
+      </geometry>
+    </collision>
+  </link>
+  <gazebo><mesh filename="meshes/gazebo.stl"/></gazebo>
+</robot>
+"""
+
+
+def test_replace_mesh_paths_splices_only_the_mesh_filenames(tmp_path):
+    urdf_path = tmp_path / "r.urdf"
+    urdf_path.write_text(URDF)
+
+    count = replace_mesh_paths(
+        str(urdf_path),
+        "meshes",
+        "meshes",
+        "package://r/meshes/visual",
+        "package://r/meshes/collision",
+    )
+
+    assert count == 2
+    assert urdf_path.read_text() == URDF.replace(
+        "'meshes/a.stl'", "'package://r/meshes/visual/a.stl'"
+    ).replace('"meshes/a.stl"', '"package://r/meshes/collision/a.stl"')
+
+
+def test_replace_mesh_paths_leaves_unmatched_files_untouched(tmp_path):
+    urdf_path = tmp_path / "r.urdf"
+    urdf_path.write_text(URDF)
+    mtime = os.path.getmtime(urdf_path)
+    assert replace_mesh_paths(str(urdf_path), "other", "other", "new", "new") == 0
+    assert urdf_path.read_text() == URDF
+    assert os.path.getmtime(urdf_path) == mtime
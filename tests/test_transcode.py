@@ -0,0 +1,86 @@
+import json
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+trimesh = pytest.importorskip("trimesh")
+
+from mesh_tools.decimate import MESH_FORMATS
+from mesh_tools.mesh_cache import MeshCache
+from mesh_tools.mesh_io import is_binary_stl, read_stl_triangles
+from mesh_tools.transcode import TRANSCODED_MANIFEST, transcode_files
+
+
+def mesh_paths(directory) -> list:
+    return [
+        os.path.join(directory, name)
+        for name in sorted(os.listdir(directory))
+        if name.lower().endswith(MESH_FORMATS)
+    ]
+
+
+def snapshot(directory) -> dict:
+    return {
+        name: open(os.path.join(directory, name), "rb").read()
+        for name in sorted(os.listdir(directory))
+    }
+
+
+@pytest.fixture
+def meshes(tmp_path):
+    directory = tmp_path / "meshes"
+    directory.mkdir()
+    trimesh.creation.box().export(str(directory / "box.obj"))
+    sphere_path = str(directory / "sphere.stl")
+    trimesh.creation.icosphere(2).export(sphere_path, file_type="stl_ascii")
+    return str(directory)
+
+
+def test_manifest_lists_the_renamed_meshes(meshes):
+    manifest = transcode_files(mesh_paths(meshes), meshes, workers=1)
+    assert manifest == {"box.obj": "box.stl"}
+    with open(os.path.join(meshes, TRANSCODED_MANIFEST), encoding="utf-8") as file:
+        assert json.load(file) == manifest
+    for name in ("box.stl", "sphere.stl"):
+        assert is_binary_stl(os.path.join(meshes, name))
+    assert len(read_stl_triangles(os.path.join(meshes, "box.stl"))) == 12
+
+
+def test_transcoding_twice_in_place_is_a_no_op(meshes, tmp_path):
+    cache = MeshCache(str(tmp_path / "cache"))
+    first = transcode_files(mesh_paths(meshes), meshes, workers=1, cache=cache)
+    before = snapshot(meshes)
+    inode = os.stat(os.path.join(meshes, "sphere.stl")).st_ino
+
+    second = transcode_files(mesh_paths(meshes), meshes, workers=1, cache=cache)
+
+    assert second == first
+    assert snapshot(meshes) == before
+    # the binary STL transcoded in place is skipped, not rewritten
+    assert os.stat(os.path.join(meshes, "sphere.stl")).st_ino == inode
+
+
+def test_remove_sources(meshes):
+    paths = mesh_paths(meshes)
+    manifest = transcode_files(paths, meshes, remove_sources=True, workers=1)
+    assert manifest == {"box.obj": "box.stl"}
+    assert sorted(os.listdir(meshes)) == ["box.stl", "sphere.stl", TRANSCODED_MANIFEST]
+
+
+def test_colliding_outputs_are_reported_and_left_out(meshes):
+    trimesh.creation.box().export(os.path.join(meshes, "box.ply"))
+    manifest = transcode_files(mesh_paths(meshes), meshes, workers=1)
+    assert manifest == {}
+    assert not os.path.exists(os.path.join(meshes, "box.stl"))
+
+
+def test_weld_merges_the_stl_vertices(meshes, tmp_path):
+    out_dir = str(tmp_path / "ply")
+    sphere_path = os.path.join(meshes, "sphere.stl")
+    manifest = transcode_files([sphere_path], out_dir, "ply", weld=True, workers=1)
+    assert manifest == {"sphere.stl": "sphere.ply"}
+    mesh = trimesh.load(os.path.join(out_dir, "sphere.ply"), process=False)
+    sphere = trimesh.creation.icosphere(2)
+    assert len(mesh.vertices) == len(sphere.vertices)
+    assert len(mesh.faces) == len(sphere.faces)
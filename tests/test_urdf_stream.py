@@ -0,0 +1,98 @@
+import pytest
+
+from urdf_to_xacro import convert
+
+URDF = """<?xml version="1.0" encoding="utf-8"?>
+<robot name="arm">
+  <!-- the base -->
+  <link name="base_link">
+    <inertial>
+      <mass value="1.0"/>
+    </inertial>
+    <visual>
+      <geometry><mesh filename="meshes/base_link.stl"/></geometry>
+    </visual>
+  </link>
+  <joint name="joint1" type="revolute">
+    <parent link="base_link"/>
+    <child link="link1"/>
+    <limit lower="-1" upper="1" effort="1" velocity="1"/>
+  </joint>
+  <link name="link1"/>
+  <joint name="joint2" type="revolute">
+    <parent link="link1"/>
+    <child link="link2"/>
+  </joint>
+  <link name="link2"/>
+  <gazebo reference="link2"><material>Gazebo/Grey</material></gazebo>
+</robot>
+"""
+
+MACRO = """<?xml version="1.0"?>
+<robot name="arm" xmlns:xacro="http://www.ros.org/wiki/xacro">
+  <xacro:macro name="arm" params="side">
+    <link name="${side}base_link"/>
+    <joint name="${side}joint1" type="revolute">
+      <parent link="${side}base_link"/>
+      <child link="${side}link1"/>
+    </joint>
+    <link name="${side}link1"/>
+  </xacro:macro>
+</robot>
+"""
+
+CONFIG = {
+    "joints_limit": {
+        "joint1": {"lower": -2.0, "upper": 2.0, "effort": 5, "velocity": 0.5},
+        "joint2": {"lower": -0.5, "upper": 0.5, "effort": 5, "velocity": 0.5},
+    },
+    "links_inertial": {
+        "base_link": {"mass": 2.0, "origin": {"xyz": "0 0 0.1", "rpy": "0 0 0"}},
+        "link1": {"mass": 0.5},
+        "link2": None,
+    },
+}
+
+
+def convert_both(tmp_path, urdf, **kwargs):
+    input_path = tmp_path / "arm.urdf"
+    input_path.write_text(urdf)
+    outputs = []
+    for stream in (False, True):
+        output_path = tmp_path / f"arm_{stream}.xacro"
+        convert(str(input_path), str(output_path), stream=stream, **kwargs)
+        outputs.append(output_path.read_bytes())
+    return outputs
+
+
+@pytest.mark.parametrize("prefix", ["prefix", "side"])
+def test_stream_output_is_byte_identical_to_the_tree(tmp_path, prefix):
+    tree, stream = convert_both(
+        tmp_path, URDF, config=CONFIG, modify_list=["all"], prefix=prefix
+    )
+    assert stream == tree
+    assert f'<joint name="${{{prefix}}}joint1"'.encode() in tree
+
+
+def test_stream_modifies_an_existing_macro_like_the_tree(tmp_path):
+    tree, stream = convert_both(tmp_path, MACRO, config=CONFIG, modify_list=["all"])
+    assert stream == tree
+    assert b'lower="-2.0"' in tree
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_unprefixed_names_inside_a_macro_match_the_config(tmp_path, stream):
+    input_path = tmp_path / "arm.urdf"
+    input_path.write_text(MACRO.replace("${side}", ""))
+    output_path = tmp_path / "arm.xacro"
+    convert(
+        str(input_path),
+        str(output_path),
+        config=CONFIG,
+        modify_list=["all"],
+        stream=stream,
+    )
+    output = output_path.read_text()
+    assert '<limit lower="-2.0" upper="2.0" effort="5" velocity="0.5"/>' in output
+    assert '<mass value="2.0"/>' in output
+    assert '<mass value="0.5"/>' in output
@@ -0,0 +1,68 @@
+import shutil
+import subprocess
+
+import pytest
+
+import xml_format
+
+HEADER_COMMENTED = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<!-- top --><?xml-stylesheet href="robot.xsl"?>\n'
+    '<robot name="r" xmlns:xacro="http://www.ros.org/wiki/xacro">'
+    '<!-- inside --><link name="a"/><xacro:property name="x" value="1"/></robot>\n'
+    "<!-- tail -->\n"
+)
+
+FORMATTED = """<?xml version="1.0" encoding="UTF-8"?>
+<!-- top -->
+<?xml-stylesheet href="robot.xsl"?>
+<robot xmlns:xacro="http://www.ros.org/wiki/xacro" name="r">
+  <!-- inside -->
+  <link name="a"/>
+  <xacro:property name="x" value="1"/>
+</robot>
+<!-- tail -->
+"""
+
+
+def test_format_keeps_the_prolog_and_the_declaration(tmp_path):
+    path = tmp_path / "robot.urdf"
+    path.write_text(HEADER_COMMENTED)
+    xml_format.format_file(str(path))
+    assert path.read_text() == FORMATTED
+    # formatting a formatted file changes nothing
+    xml_format.format_file(str(path))
+    assert path.read_text() == FORMATTED
+
+
+@pytest.mark.skipif(shutil.which("xmllint") is None, reason="xmllint not installed")
+def test_format_matches_xmllint(tmp_path):
+    path = tmp_path / "robot.urdf"
+    path.write_text(HEADER_COMMENTED)
+    expected = subprocess.run(
+        ["xmllint", "--format", str(path)], check=True, capture_output=True
+    ).stdout
+    xml_format.format_file(str(path))
+    assert path.read_bytes() == expected
+
+
+def test_format_writes_in_the_declared_encoding(tmp_path):
+    path = tmp_path / "robot.urdf"
+    path.write_bytes(
+        b'<?xml version="1.0" encoding="ISO-8859-1"?>\n<robot name="caf\xe9"/>'
+    )
+    xml_format.format_file(str(path))
+    assert path.read_bytes() == (
+        b'<?xml version="1.0" encoding="ISO-8859-1"?>\n<robot name="caf\xe9"/>\n'
+    )
+
+
+def test_parse_drops_the_prolog_from_the_tree(tmp_path):
+    path = tmp_path / "robot.urdf"
+    path.write_text(HEADER_COMMENTED)
+    root, namespaces = xml_format.parse(str(path), comments=False)
+    assert [child.tag for child in root] == [
+        "link",
+        "{http://www.ros.org/wiki/xacro}property",
+    ]
+    assert namespaces == {"http://www.ros.org/wiki/xacro": "xacro"}
@@ -0,0 +1,111 @@
+import importlib
+import os, sys
+from typing import Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+"""
+Single entry point of the tools, each script being a subcommand taking the
+same arguments as when it is run directly. The module of a subcommand is only
+imported when it is run, so `convert` does not load numpy, scipy or trimesh.
+
+examples:
+urdf2xacro convert -in robot.urdf -cfg urdf_config.toml -ml all
+urdf2xacro rename -path pkg -in old_name -out new_name
+urdf2xacro simplify -in pkg/meshes/collision
+urdf2xacro decimate -in pkg/meshes/collision -r 0.1 -j 8
+urdf2xacro merge temp_urdf/my_gripper ~/ws/src/arm-models gripper
+python3 urdf2xacro.py convert --help
+"""
+
+__version__ = "0.1.0"
+
+# subcommand: (module, help)
+SUBCOMMANDS: Dict[str, Tuple[str, str]] = {
+    "convert": ("urdf_to_xacro", "Modify a URDF file and convert it to xacro"),
+    "rename": ("rename", "Rename a package: folders, files and contents"),
+    "split-meshes": (
+        "split_mesh_paths",
+        "Split the mesh paths into visual and collision paths",
+    ),
+    "extract-inertial": (
+        "extract_intertial",
+        "Extract the links inertial from SolidWorks mass properties",
+    ),
+    "mesh-inertia": (
+        "mesh_tools.mesh_inertia",
+        "Compute the links inertial from their meshes",
+    ),
+    "simplify": (
+        "mesh_tools.simplify_meshes_scipy",
+        "Replace meshes by their convex hulls, in-process with SciPy",
+    ),
+    "simplify-meshlab": (
+        "mesh_tools.simplify_meshes_meshlab",
+        "Replace meshes by their convex hulls by running meshlabserver",
+    ),
+    "decimate": (
+        "mesh_tools.decimate",
+        "Simplify meshes by quadric error edge collapses",
+    ),
+    "decompose": (
+        "mesh_tools.convex_decomposition",
+        "Split meshes into convex pieces for the collisions",
+    ),
+    "primitives": (
+        "mesh_tools.primitives",
+        "Fit boxes, cylinders or spheres to the link meshes",
+    ),
+    "transcode": (
+        "mesh_tools.transcode",
+        "Transcode meshes to a compact binary format",
+    ),
+    "pipeline": ("pipeline", "Run several stages on one parsed URDF"),
+    "batch": ("batch", "Convert many URDF files in parallel"),
+    "watch": ("watch", "Regenerate the xacro files when their inputs change"),
+    "format": ("xml_format", "Format XML files like xmllint --format"),
+    "config": ("config_loader", "Validate and cache a .toml or .json config"),
+    "build-cache": ("build_cache", "Show or clear the manifest of built outputs"),
+    "merge": ("merge_into_repo", "Merge a converted package into a repository"),
+    "dedup": ("mesh_tools.dedup", "Store identical meshes once with links"),
+}
+
+
+def usage() -> str:
+    width = max(len(name) for name in SUBCOMMANDS)
+    lines = [
+        "usage: urdf2xacro [-h] [--version] <command> [<args>]",
+        "",
+        "Tools for modifying URDF packages and converting URDF into xacro.",
+        "",
+        "commands:",
+    ]
+    lines.extend(
+        f"  {name:<{width}}  {help}" for name, (_, help) in SUBCOMMANDS.items()
+    )
+    lines.append("")
+    lines.append("Run `urdf2xacro <command> -h` for the arguments of a command.")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ("-h", "--help"):
+        print(usage())
+        return 0 if argv else 2
+    if argv[0] == "--version":
+        print(f"urdf2xacro {__version__}")
+        return 0
+    name = argv[0]
+    if name not in SUBCOMMANDS:
+        print(usage(), file=sys.stderr)
+        print(f"\nurdf2xacro: unknown command: {name}", file=sys.stderr)
+        return 2
+    module = importlib.import_module(SUBCOMMANDS[name][0])
+    # argparse takes the program name of the usage messages from argv[0]
+    sys.argv = [f"urdf2xacro {name}"] + argv[1:]
+    return module.main(argv[1:])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
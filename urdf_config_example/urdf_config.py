@@ -1,4 +1,4 @@
-import numpy as np
+import math
 import json
 import os
 
@@ -23,7 +23,7 @@ joints_limit = {
     },
     "joint3": {
         "lower": -0.08722,
-        "upper": np.pi,
+        "upper": math.pi,
         "effort": max_effort_1_2_3,
         "velocity": max_velocity_1_2_3,
     },
@@ -16,18 +16,16 @@ export REPO_DIR="/home/ghz/Work/airbot_play/arm-models"
 
 # automatically generated variables
 export TARGET_DIR="package://airbot_description/meshes/${NAME}"
-export target_meshes_dir=${REPO_DIR}/meshes/${NAME}
 
-# copy raw urdf files to temp folder
-cp -r ${OLD_NAME} ./temp_urdf/ && cd ./temp_urdf
+# copy raw urdf files to temp folder, the identical meshes are stored once
+python3 ${urdf2xacro}/mesh_tools/dedup.py -src ${OLD_NAME} -dst ./temp_urdf/${OLD_NAME} && cd ./temp_urdf
 
 # create urdf folder and move all urdf files into it
 mkdir -p ${OLD_NAME}/urdf
 mv ${OLD_NAME}/*.urdf ${OLD_NAME}/urdf/
 
 # rename base_link and name of&in urdf files
-python3 ${urdf2xacro}/rename.py -path ${OLD_NAME} -in World_${OLD_NAME}_${OLD_NAME} -out base_link
-python3 ${urdf2xacro}/rename.py -path ${OLD_NAME} -in name=\"${OLD_NAME}\" -out name=\"${NAME}\"
+python3 ${urdf2xacro}/rename.py -path ${OLD_NAME} -r World_${OLD_NAME}_${OLD_NAME} base_link -r name=\"${OLD_NAME}\" name=\"${NAME}\"
 if [ $OLD_NAME != $NAME ]; then
     rm -rf ${NAME} && mv ${OLD_NAME} ${NAME}
     mv ${NAME}/urdf/${OLD_NAME}.urdf ${NAME}/urdf/${NAME}.urdf
@@ -37,23 +35,34 @@ fi
 mv ${NAME}/meshes ${NAME}/visual
 mkdir -p ${NAME}/meshes
 mv ${NAME}/visual ${NAME}/meshes/
-cp -r ${NAME}/meshes/visual ${NAME}/meshes/collision
-# TODO: the path is used in TARGET_DIR, not current urdf package
-python3 ${urdf2xacro}/split_mesh_paths.py -path ${NAME}/urdf/${NAME}.urdf -ov "meshes" -oc "meshes" -nv "${TARGET_DIR}/visual" -nc "${TARGET_DIR}/collision" -cc
+# the collision meshes start as reflinks (copy-on-write clones) of the visual
+# ones where the filesystem supports them (btrfs, XFS), as plain copies
+# otherwise (ext4), so editing one never changes the other
+python3 ${urdf2xacro}/mesh_tools/dedup.py -src ${NAME}/meshes/visual -dst ${NAME}/meshes/collision
 
-# convert urdf to xacro
-python3 ${urdf2xacro}/urdf_to_xacro.py -ml all -in ${NAME}/urdf/${NAME}.urdf -cfg ${CONFIGS_DIR}/urdf_config_${NAME}/urdf_config.py
+# split mesh paths, modify and convert urdf to xacro in one process
+# TODO: the path is used in TARGET_DIR, not current urdf package
+cat > pipeline_${NAME}.json <<EOF
+{
+    "config": "${CONFIGS_DIR}/urdf_config_${NAME}/urdf_config.py",
+    "stages": [
+        {"stage": "split_mesh_paths", "old_visual_path": "meshes", "new_visual_path": "${TARGET_DIR}/visual", "new_collision_path": "${TARGET_DIR}/collision", "create_collision": true},
+        {"stage": "joints_limit"},
+        {"stage": "links_inertial"},
+        {"stage": "to_xacro_style", "prefix": "prefix"},
+        {"stage": "format"}
+    ]
+}
+EOF
+python3 ${urdf2xacro}/pipeline.py -in ${NAME}/urdf/${NAME}.urdf -spec pipeline_${NAME}.json
 
 # simplify meshes
 python3 ${urdf2xacro}/mesh_tools/simplify_meshes_meshlab.py -pre "" -in ${NAME}/meshes/collision -fmt obj
+# or without meshlabserver, keeping the mesh files:
+# python3 ${urdf2xacro}/mesh_tools/decimate.py -in ${NAME}/meshes/collision -r 0.1 -e 0.0005
 
-# merge_into_repo
-mkdir -p ${target_meshes_dir}/collision
-mkdir -p ${target_meshes_dir}/visual
-mv ${NAME}/meshes/collision/* ${target_meshes_dir}/collision/
-mv ${NAME}/meshes/visual/* ${target_meshes_dir}/visual/
-
-# move all the xacro files into the target urdf directory
-cp ${NAME}/urdf/*.xacro ${REPO_DIR}/urdf/${type}s/
-
-echo "Merged $NAME into $REPO_DIR"
+# merge_into_repo, linking the meshes to the identical ones already in the repo;
+# hardlinked meshes share their inode: the mesh_tools scripts and git replace
+# a file instead of writing into it, which is safe, while writing into it in
+# place (e.g. >> or a mesh editor saving over it) changes every linked copy
+python3 ${urdf2xacro}/merge_into_repo.py ${NAME} ${REPO_DIR} ${type}
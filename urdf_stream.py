@@ -0,0 +1,291 @@
+import xml.etree.ElementTree as ET
+from typing import Dict, List, Optional
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import xml_format
+from urdf_to_xacro import (
+    KNOWN_NAMESPACES,
+    XACRO_NS,
+    macro_prefix_var,
+    prefix_joint,
+    prefix_keys,
+    prefix_link,
+    split_link_mesh_paths,
+    update_joint_limit,
+    update_link_inertial,
+)
+
+"""
+Bounded-memory version of URDFer for very large generated URDF files.
+
+The file is parsed incrementally and each top level element (link, joint,
+gazebo, ...) is modified, written to the output and dropped as soon as its
+end tag is parsed, so the whole tree is never held in memory.
+
+examples:
+python3 urdf_to_xacro.py -in cell.urdf -cfg urdf_config.py -ml all --stream
+"""
+
+
+class StreamingURDFer(object):
+    """Same modifications as URDFer, recorded first and then applied element
+    by element while the input is streamed into the output by `save`.
+
+    Unlike URDFer, namespaces declared on <robot> are written back even when
+    they are not used.
+    """
+
+    def __init__(self, file_path, chunk_size=1 << 16) -> None:
+        self.file_path = file_path
+        self.chunk_size = chunk_size
+        self.joint_limits: Optional[Dict[str, dict]] = None
+        self.link_inertial: Optional[Dict[str, dict]] = None
+        self.mesh_paths: Optional[tuple] = None
+        self.prefix: Optional[str] = None
+        self.counts = {"link": 0, "joint": 0, "other": 0}
+
+    def replace_joint_limits(self, joint_limits: Dict[str, dict]):
+        self.joint_limits = joint_limits
+
+    def replace_link_inertial(self, link_inertial: Dict[str, dict]):
+        self.link_inertial = link_inertial
+
+    def split_mesh_paths(
+        self,
+        old_visual_path,
+        new_visual_path,
+        old_collision_path,
+        new_collision_path,
+        create_collision,
+        collision_pieces: Optional[Dict[str, List[str]]] = None,
+        collision_primitives: Optional[Dict[str, List[Optional[dict]]]] = None,
+        renamed_meshes: Optional[Dict[str, str]] = None,
+    ):
+        self.mesh_paths = (
+            old_visual_path,
+            new_visual_path,
+            old_collision_path,
+            new_collision_path,
+            create_collision,
+            collision_pieces,
+            collision_primitives,
+            renamed_meshes,
+        )
+
+    def to_xacro_style(self, params):
+        self.prefix = params
+
+    @staticmethod
+    def _config_of(
+        config: Dict[str, dict], prefixed: Optional[Dict[str, dict]], name
+    ) -> Optional[Dict[str, dict]]:
+        """The config with a key for an element name: the plain one first,
+        then the prefixed one inside a macro, as URDFer._find looks up the
+        plain name before the prefixed name."""
+        if name in config:
+            return config
+        if prefixed is not None and name in prefixed:
+            return prefixed
+        return None
+
+    def _modify(self, element: ET.Element, in_macro: bool):
+        """Apply the recorded modifications to one top level element."""
+        name = element.get("name")
+        if element.tag == "joint":
+            self.counts["joint"] += 1
+            if self.joint_limits is not None:
+                joint_limits = self._config_of(
+                    self.joint_limits,
+                    self._prefixed_limits if in_macro else None,
+                    name,
+                )
+                if joint_limits is not None:
+                    update_joint_limit(element, joint_limits[name])
+                    self._matched_joints.add(name)
+            if self._wrap:
+                prefix_joint(element, self.prefix)
+        elif element.tag == "link":
+            self.counts["link"] += 1
+            if self.link_inertial is not None:
+                link_inertial = self._config_of(
+                    self.link_inertial,
+                    self._prefixed_inertial if in_macro else None,
+                    name,
+                )
+                if link_inertial is not None:
+                    update_link_inertial(element, link_inertial[name])
+                    self._matched_links.add(name)
+                else:
+                    self._missing_links.append(name)
+            if self.mesh_paths is not None:
+                split_link_mesh_paths(element, *self.mesh_paths)
+            if self._wrap:
+                prefix_link(element, self.prefix)
+        else:
+            self.counts["other"] += 1
+
+    def _write_element(self, element: ET.Element, level, in_macro: bool):
+        self._modify(element, in_macro)
+        used = xml_format.collect_namespaces(element, self._namespaces)
+        declare = {uri: prefix for uri, prefix in used.items() if uri not in self._nsmap}
+        self._nsmap.update(declare)
+        for line in xml_format.iter_formatted(element, self._nsmap, level, declare):
+            self._output.write(line)
+
+    def _decide(self, wrap: bool):
+        """Decide whether the content is wrapped in a new xacro macro, once
+        it is known whether the file is already a macro."""
+        self._wrap = wrap
+        if wrap:
+            macro = ET.Element(
+                f"{{{self._xacro_ns}}}macro",
+                {"name": self._robot_name, "params": self.prefix},
+            )
+            self._output.write(
+                xml_format.INDENT + xml_format.start_tag(macro, self._nsmap) + "\n"
+            )
+        for element in self._pending:
+            self._write_element(element, 2 if wrap else 1, False)
+        self._pending = []
+
+    def save(self, path):
+        """Stream the input file into `path`, formatted like xmllint."""
+        assert os.path.abspath(path) != os.path.abspath(
+            self.file_path
+        ), "Streaming can not write into its input file"
+        self._namespaces = dict(KNOWN_NAMESPACES)  # uri: prefix of the input
+        self._nsmap: Dict[str, str] = {}  # uri: prefix declared in the output
+        self._pending: List[ET.Element] = []  # top level elements not written yet
+        self._wrap: Optional[bool] = None
+        # the config keyed by the names inside a macro, once it is found
+        self._prefix_var = "prefix"
+        self._prefixed_limits: Optional[Dict[str, dict]] = None
+        self._prefixed_inertial: Optional[Dict[str, dict]] = None
+        self.counts = {"link": 0, "joint": 0, "other": 0}
+        self._matched_joints = set()
+        self._matched_links = set()
+        self._missing_links: List[str] = []
+        macro_tags = {f"{{{uri}}}macro" for uri in KNOWN_NAMESPACES}
+        parser = ET.XMLPullParser(events=("start-ns", "start", "end"))
+        stack: List[ET.Element] = []
+        root_declared: Dict[str, str] = {}
+        macro: Optional[ET.Element] = None
+
+        with open(self.file_path, "rb") as source, open(
+            path, "w", encoding="utf-8"
+        ) as output:
+            self._output = output
+            output.write(xml_format.DECLARATION)
+            for chunk in iter(lambda: source.read(self.chunk_size), b""):
+                parser.feed(chunk)
+                for event, item in parser.read_events():
+                    if event == "start-ns":
+                        prefix, uri = item
+                        self._namespaces.setdefault(uri, prefix)
+                        if not stack:
+                            root_declared.setdefault(uri, prefix)
+                        continue
+                    element: ET.Element = item
+                    if event == "start":
+                        stack.append(element)
+                        if len(stack) == 1:
+                            self._start_root(element, root_declared)
+                        elif (
+                            len(stack) == 2
+                            and element.tag in macro_tags
+                            and element.get("name") == self._robot_name
+                        ):
+                            # already a macro, modify its children instead
+                            macro = element
+                            self._start_macro(element)
+                            if self._wrap is None:
+                                self._decide(False)
+                            start = ET.Element(element.tag, element.attrib)
+                            output.write(
+                                xml_format.INDENT
+                                + xml_format.start_tag(start, self._nsmap)
+                                + "\n"
+                            )
+                        continue
+                    # end event
+                    stack.pop()
+                    parent = stack[-1] if stack else None
+                    if parent is None:
+                        if self._wrap is None:
+                            self._decide(self.prefix is not None)
+                        if self._wrap:
+                            output.write(
+                                xml_format.INDENT
+                                + f"</{self._nsmap[self._xacro_ns]}:macro>\n"
+                            )
+                        output.write(xml_format.end_tag(element, self._nsmap) + "\n")
+                    elif element is macro:
+                        output.write(
+                            xml_format.INDENT
+                            + xml_format.end_tag(element, self._nsmap)
+                            + "\n"
+                        )
+                        parent.remove(element)
+                    elif parent is macro:
+                        self._write_element(element, 2, True)
+                        # drop the written element to keep the memory flat
+                        parent.remove(element)
+                    elif len(stack) == 1:
+                        parent.remove(element)
+                        if self._wrap is None and element.tag in ("link", "joint"):
+                            self._decide(self.prefix is not None)
+                        if self._wrap is None:
+                            self._pending.append(element)
+                        else:
+                            self._write_element(element, 2 if self._wrap else 1, False)
+            parser.close()
+        self._output = None
+        print(
+            f"Streamed {self.counts['link']} links, {self.counts['joint']} joints "
+            f"and {self.counts['other']} other elements"
+        )
+        self._report_unmatched()
+
+    def _start_macro(self, macro: ET.Element):
+        self._prefix_var = macro_prefix_var(macro.get("params", "prefix"))
+        if self.joint_limits is not None:
+            self._prefixed_limits = prefix_keys(self.joint_limits, self._prefix_var)
+        if self.link_inertial is not None:
+            self._prefixed_inertial = prefix_keys(self.link_inertial, self._prefix_var)
+
+    def _report_unmatched(self):
+        """Print the config keys and links left unmatched, as URDFer does."""
+
+        def unmatched(config: Dict[str, dict], matched: set) -> List[str]:
+            return [
+                key
+                for key, prefixed in zip(config, prefix_keys(config, self._prefix_var))
+                if key not in matched and prefixed not in matched
+            ]
+
+        if self.joint_limits is not None:
+            keys = unmatched(self.joint_limits, self._matched_joints)
+            if keys:
+                print(f"Joints not found in the URDF: {', '.join(keys)}")
+        if self.link_inertial is not None:
+            if self._missing_links:
+                missing = ", ".join(self._missing_links)
+                print(f"Links not found in link_inertial config: {missing}")
+            keys = unmatched(self.link_inertial, self._matched_links)
+            if keys:
+                print(f"Links not found in the URDF: {', '.join(keys)}")
+
+    def _start_root(self, root: ET.Element, root_declared: Dict[str, str]):
+        self._robot_name = root.get("name")
+        assert self._robot_name is not None, "Robot name not found"
+        print(f"Robot name: {self._robot_name}")
+        declare = dict(root_declared)
+        # wrap into the xacro namespace the file already declares, if any
+        self._xacro_ns = next(
+            (uri for uri in declare if uri in KNOWN_NAMESPACES), XACRO_NS
+        )
+        if self.prefix is not None:
+            declare.setdefault(self._xacro_ns, "xacro")
+        self._nsmap.update(declare)
+        self._output.write(xml_format.start_tag(root, self._nsmap, declare) + "\n")
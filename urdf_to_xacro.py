@@ -1,17 +1,209 @@
 import xml.etree.ElementTree as ET
-from typing import Dict, Optional
-import subprocess, os, sys
+from typing import Dict, List, Optional
+import os, sys, re
 from copy import deepcopy
 
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
-from rename import replace_in_file
+import xml_format
+import profiler
+
+XACRO_NS = "http://wiki.ros.org/xacro"
+# namespaces written back with these prefixes, the ones declared in the
+# parsed file are kept as well
+KNOWN_NAMESPACES = {
+    XACRO_NS: "xacro",
+    "http://www.ros.org/wiki/xacro": "xacro",
+}
+ET.register_namespace("xacro", XACRO_NS)
+
+
+def prefix_keys(config: Dict[str, dict], name="prefix") -> Dict[str, dict]:
+    """Return a copy of the config with `${name}` added before the keys, to
+    match the names inside a xacro macro."""
+    return {f"${{{name}}}{key}": value for key, value in config.items()}
+
+
+def macro_prefix_var(params) -> str:
+    """Name of the xacro variable prefixing the names inside a macro: its
+    first parameter, without default value or block marker, e.g. "prefix"
+    for params="prefix:=left_ parent *origin"."""
+    tokens = params.split()
+    if not tokens:
+        return "prefix"
+    return tokens[0].lstrip("*").split(":=")[0].split("=")[0]
+
+
+def update_joint_limit(joint: ET.Element, new_limits: dict):
+    limit_element = joint.find("limit")
+    continuous = None in (new_limits["lower"], new_limits["upper"])
+    if continuous:
+        joint.set("type", "continuous")
+        return
+    else:
+        joint.set("type", "revolute")
+    if limit_element is None:
+        # create a new limit element
+        limit_element = ET.Element("limit")
+        joint.append(limit_element)
+    # update the limit element
+    if "lower" in new_limits:
+        limit_element.set("lower", str(new_limits["lower"]))
+    if "upper" in new_limits:
+        limit_element.set("upper", str(new_limits["upper"]))
+    if "effort" in new_limits:
+        limit_element.set("effort", str(new_limits["effort"]))
+    if "velocity" in new_limits:
+        limit_element.set("velocity", str(new_limits["velocity"]))
+
+
+def update_link_inertial(link: ET.Element, inertial: Optional[dict]):
+    virtual = inertial is None
+    if virtual:
+        return
+    inertial_element = link.find("inertial")
+    if inertial_element is None:
+        # create a new inertial element
+        inertial_element = ET.Element("inertial")
+        link.append(inertial_element)
+    # update the inertial element
+    for key, value in inertial.items():
+        handle = inertial_element.find(key)
+        if handle is None:
+            handle = ET.SubElement(inertial_element, key)
+        if isinstance(value, dict):
+            for k, v in value.items():
+                handle.set(k, str(v))
+        else:
+            handle.set("value", str(value))
+
+
+def prefix_joint(joint: ET.Element, name):
+    parent = joint.find("parent")
+    parent.set("link", f"${{{name}}}{parent.get('link')}")
+    child = joint.find("child")
+    child.set("link", f"${{{name}}}{child.get('link')}")
+    joint.set("name", f"${{{name}}}{joint.get('name')}")
+
+
+def prefix_link(link: ET.Element, name):
+    link.set("name", f"${{{name}}}{link.get('name')}")
+
+
+def split_collision_pieces(link: ET.Element, collision_pieces: Dict[str, List[str]]):
+    """Replace each <collision> of a mesh listed in `collision_pieces`, a
+    {mesh file name: [piece file names]} dict such as the pieces.json of
+    mesh_tools/convex_decomposition.py, by one <collision> per piece, the
+    pieces being in the directory of the mesh."""
+    for index, collision in reversed(list(enumerate(link))):
+        mesh_handle = collision.find("geometry/mesh")
+        if collision.tag != "collision" or mesh_handle is None:
+            continue
+        directory, _, name = mesh_handle.get("filename", "").rpartition("/")
+        pieces = collision_pieces.get(name)
+        if not pieces:
+            continue
+        link.remove(collision)
+        for i, piece in reversed(list(enumerate(pieces))):
+            piece_collision = deepcopy(collision)
+            piece_collision.find("geometry/mesh").set(
+                "filename", f"{directory}/{piece}" if directory else piece
+            )
+            if collision.get("name") is not None:
+                piece_collision.set("name", f"{collision.get('name')}_{i}")
+            link.insert(index, piece_collision)
+
+
+def rename_link_meshes(link: ET.Element, renamed_meshes: Dict[str, str]):
+    """Rename the mesh files of the visuals and collisions listed in
+    `renamed_meshes`, a {mesh file name: new file name} dict such as the
+    transcoded.json of mesh_tools/transcode.py, keeping their directory."""
+    for kind in ("visual", "collision"):
+        for mesh_handle in link.iterfind(f"{kind}/geometry/mesh"):
+            directory, slash, name = mesh_handle.get("filename", "").rpartition("/")
+            if name in renamed_meshes:
+                mesh_handle.set("filename", directory + slash + renamed_meshes[name])
+
+
+def primitive_collision(primitive: dict) -> ET.Element:
+    """A <collision> of a primitive geometry, {"origin": {"xyz", "rpy"},
+    "geometry": {"box": {"size": ...}}} as fitted by mesh_tools/primitives.py."""
+    collision = ET.Element("collision")
+    ET.SubElement(collision, "origin", primitive["origin"])
+    geometry = ET.SubElement(collision, "geometry")
+    for tag, attributes in primitive["geometry"].items():
+        ET.SubElement(geometry, tag, attributes)
+    return collision
+
+
+def split_link_mesh_paths(
+    link: ET.Element,
+    old_visual_path,
+    new_visual_path,
+    old_collision_path,
+    new_collision_path,
+    create_collision,
+    collision_pieces: Optional[Dict[str, List[str]]] = None,
+    collision_primitives: Optional[Dict[str, List[Optional[dict]]]] = None,
+    renamed_meshes: Optional[Dict[str, str]] = None,
+):
+    if renamed_meshes is not None:
+        rename_link_meshes(link, renamed_meshes)
+    visuals = link.findall("visual")
+    collisions = link.findall("collision")
+    primitives = []
+    if collision_primitives is not None:
+        primitives = collision_primitives.get(link.get("name")) or []
+
+    if len(visuals) > 0:
+        for index, visual in enumerate(visuals):
+            geo = visual.find("geometry")
+            # create collision tag if it doesn't exist
+            if len(collisions) == 0 and create_collision:
+                if index < len(primitives) and primitives[index] is not None:
+                    link.append(primitive_collision(primitives[index]))
+                else:
+                    collision = ET.Element("collision")
+                    origin = visual.find("origin")
+                    if origin is not None:
+                        collision.append(deepcopy(origin))
+                    collision.append(deepcopy(geo))
+                    link.append(collision)
+            mesh_handle = geo.find("mesh")
+            new_name = mesh_handle.get("filename").replace(
+                old_visual_path, new_visual_path
+            )
+            mesh_handle.set("filename", new_name)
+    else:
+        print(f"There is no visual tag in {link.get('name')}")
+
+    collisions = link.findall("collision")  # update the collisions list
+    if len(collisions) > 0:
+        for collision in collisions:
+            geo = collision.find("geometry")
+            mesh_handle = geo.find("mesh")
+            if mesh_handle is None:
+                continue
+            new_name = mesh_handle.get("filename").replace(
+                old_collision_path, new_collision_path
+            )
+            mesh_handle.set("filename", new_name)
+        if collision_pieces is not None:
+            split_collision_pieces(link, collision_pieces)
+    else:
+        print(f"There is no collision tag in {link.get('name')}")
 
 
 class URDFer(object):
     def __init__(self, file_path) -> None:
         self.file_path = file_path
-        self.tree = ET.parse(file_path)
-        self.root = self.tree.getroot()
+        with profiler.stage("parse"):
+            self.root, namespaces = xml_format.parse(file_path, comments=False)
+        if profiler.active():
+            profiler.count("files_read")
+            profiler.count("bytes_read", os.path.getsize(file_path))
+            profiler.count("elements_parsed", sum(1 for _ in self.root.iter()))
+        self.tree = ET.ElementTree(self.root)
+        self.namespaces = {**KNOWN_NAMESPACES, **namespaces}
         self.robot_name = self.root.get("name")
         macro = self.is_macro()
         self._is_macro = macro is not None
@@ -19,94 +211,167 @@ class URDFer(object):
         self._is_xacro = is_xacro if not self._is_macro else True
         self._to_xacro = False
         self.handle = self.root if not self._is_macro else macro
+        # name of the xacro variable prefixing the names inside the macro
+        self.prefix_var = "prefix"
+        if self._is_macro:
+            self.prefix_var = macro_prefix_var(macro.get("params", "prefix"))
         print(f"Robot name: {self.robot_name}")
         assert self.robot_name is not None, "Robot name not found"
+        self.build_index()
+
+    @profiler.profiled()
+    def build_index(self):
+        """Index the links and joints by name and build the kinematic graph,
+        called again whenever the names change."""
+        self.links: Dict[str, ET.Element] = {}
+        self.joints: Dict[str, ET.Element] = {}
+        self.child_joints: Dict[str, List[str]] = {}
+        self.parent_joint: Dict[str, str] = {}
+        for link in self.handle.iterfind("link"):
+            self.links[link.get("name")] = link
+        for joint in self.handle.iterfind("joint"):
+            name = joint.get("name")
+            self.joints[name] = joint
+            parent = joint.find("parent")
+            child = joint.find("child")
+            if parent is not None:
+                self.child_joints.setdefault(parent.get("link"), []).append(name)
+            if child is not None:
+                self.parent_joint[child.get("link")] = name
+
+    def copy(self) -> "URDFer":
+        """A copy to modify without parsing the file again, e.g. to convert a
+        tree kept in memory several times."""
+        other = object.__new__(URDFer)
+        other.__dict__.update(self.__dict__)
+        other.root = deepcopy(self.root)
+        other.tree = ET.ElementTree(other.root)
+        other.namespaces = dict(self.namespaces)
+        other.handle = other.root if not self._is_macro else other.is_macro()
+        other.build_index()
+        return other
+
+    def _find(self, index: Dict[str, ET.Element], name) -> Optional[ET.Element]:
+        """Find an element by its config name, which has no prefix inside a macro."""
+        element = index.get(name)
+        if element is None and self._is_macro:
+            element = index.get(f"${{{self.prefix_var}}}{name}")
+        return element
+
+    def joint_links(self, joint_name) -> tuple:
+        joint = self.joints[joint_name]
+        return joint.find("parent").get("link"), joint.find("child").get("link")
+
+    def child_links(self, link_name) -> List[str]:
+        return [
+            self.joint_links(joint)[1] for joint in self.child_joints.get(link_name, [])
+        ]
+
+    def parent_link(self, link_name) -> Optional[str]:
+        joint = self.parent_joint.get(link_name)
+        return None if joint is None else self.joint_links(joint)[0]
+
+    def root_links(self) -> List[str]:
+        return [link for link in self.links if link not in self.parent_joint]
+
+    def orphan_links(self) -> List[str]:
+        """Links used by no joint, in a model with more than one link."""
+        if len(self.links) < 2:
+            return []
+        return [
+            link
+            for link in self.links
+            if link not in self.parent_joint and link not in self.child_joints
+        ]
+
+    def chain(self, base_link, tip_link) -> List[str]:
+        """Names of the joints from `base_link` to `tip_link`."""
+        joints = []
+        link = tip_link
+        while link != base_link:
+            joint = self.parent_joint.get(link)
+            if joint is None:
+                raise ValueError(f"{tip_link} is not a descendant of {base_link}")
+            joints.append(joint)
+            link = self.joint_links(joint)[0]
+        return joints[::-1]
 
     def is_macro(self):
-        for item in list(self.root):
-            # useless methods
-            # ET.register_namespace('xacro', 'http://wiki.ros.org/xacro')
-            # print(item.tag)
-            # print(self.root.get('{http://wiki.ros.org/xacro}macro'))
-            if "macro" in item.tag and item.get("name") == self.robot_name:
-                return item
+        for uri in KNOWN_NAMESPACES:
+            for item in self.root.iterfind(f"{{{uri}}}macro"):
+                if item.get("name") == self.robot_name:
+                    return item
         return None
 
-    def replace_joint_limits(self, joint_limits):
-        for joint in self.handle.findall("joint"):
-            joint_name = joint.get("name")
-            if joint_name in joint_limits:
-                limit_element = joint.find("limit")
-                new_limits = joint_limits[joint_name]
-                continuous = None in (new_limits["lower"], new_limits["upper"])
-                if continuous:
-                    joint.set("type", "continuous")
-                    continue
-                else:
-                    joint.set("type", "revolute")
-                if limit_element is None:
-                    # create a new limit element
-                    limit_element = ET.Element("limit")
-                    joint.append(limit_element)
-                # update the limit element
-                if "lower" in new_limits:
-                    limit_element.set("lower", str(new_limits["lower"]))
-                if "upper" in new_limits:
-                    limit_element.set("upper", str(new_limits["upper"]))
-                if "effort" in new_limits:
-                    limit_element.set("effort", str(new_limits["effort"]))
-                if "velocity" in new_limits:
-                    limit_element.set("velocity", str(new_limits["velocity"]))
-
-    def replace_link_inertial(self, link_inertial: Dict[str, dict]):
-        if self._is_macro:
-            for key, value in link_inertial.items():
-                link_inertial[f"${{prefix}}{key}"] = value
-                del link_inertial[key]
-        for link in self.handle.findall("link"):
-            link_name = link.get("name")
-            if link_name in link_inertial:
-                inertial_element = link.find("inertial")
-                virtual = link_inertial[link_name] is None
-                if virtual:
-                    continue
-                if inertial_element is None:
-                    # create a new inertial element
-                    inertial_element = ET.Element("inertial")
-                    link.append(inertial_element)
-                # update the inertial element
-                for key, value in link_inertial[link_name].items():
-                    handle = inertial_element.find(key)
-                    if isinstance(value, dict):
-                        for k, v in value.items():
-                            handle.set(k, str(v))
-                    else:
-                        handle.set("value", str(value))
+    @profiler.profiled()
+    def replace_joint_limits(self, joint_limits) -> List[str]:
+        """Update the joints found in the config and return the config keys
+        matching no joint."""
+        unmatched = []
+        for joint_name, new_limits in joint_limits.items():
+            joint = self._find(self.joints, joint_name)
+            if joint is None:
+                unmatched.append(joint_name)
+            else:
+                update_joint_limit(joint, new_limits)
+        profiler.count("joints_updated", len(joint_limits) - len(unmatched))
+        if unmatched:
+            print(f"Joints not found in the URDF: {', '.join(unmatched)}")
+        return unmatched
+
+    @profiler.profiled()
+    def replace_link_inertial(self, link_inertial: Dict[str, dict]) -> List[str]:
+        """Update the links found in the config and return the config keys
+        matching no link."""
+        unmatched = []
+        updated = set()
+        for link_name, inertial in link_inertial.items():
+            link = self._find(self.links, link_name)
+            if link is None:
+                unmatched.append(link_name)
             else:
-                print(f"Link {link_name} not found in link_inertial config")
+                update_link_inertial(link, inertial)
+                updated.add(link.get("name"))
+        profiler.count("links_updated", len(updated))
+        missing = [link for link in self.links if link not in updated]
+        if missing:
+            print(f"Links not found in link_inertial config: {', '.join(missing)}")
+        if unmatched:
+            print(f"Links not found in the URDF: {', '.join(unmatched)}")
+        return unmatched
+
+    @profiler.profiled()
+    def replace_in_tree(self, pattern, replacement):
+        """Apply a regex replacement to all attribute values and texts of the tree,
+        which is what rename.py does to the URDF file contents."""
+        for element in self.root.iter():
+            for key, value in element.attrib.items():
+                element.set(key, re.sub(pattern, replacement, value))
+            if element.text is not None and element.text.strip():
+                element.text = re.sub(pattern, replacement, element.text)
+        self.robot_name = self.root.get("name")
+        self.build_index()
 
     def add_robot_attributes(self, attributes: dict):
         for attr, value in attributes.items():
             self.root.set(attr, value)
 
+    @profiler.profiled()
     def to_xacro_style(self, params):
         if self._is_macro:
             print("Already a macro")
             return
-        # 添加 xacro 标志
-        self.add_robot_attributes({"xmlns:xacro": "http://wiki.ros.org/xacro"})
+        # xacro 命名空间在保存时声明
         # 获取 <robot> 标签内的所有元素
         robot_children = list(self.root)
         # 清空 <robot> 标签内的元素
-        for child in robot_children:
-            self.root.remove(child)
+        del self.root[:]
         # 创建新的 <xacro:macro> 标签
         xacro_macro = ET.Element(
-            "xacro:macro", {"name": self.robot_name, "params": params}
+            f"{{{XACRO_NS}}}macro", {"name": self.robot_name, "params": params}
         )
         # 将之前的元素添加到 <xacro:macro> 标签内
-        for child in robot_children:
-            xacro_macro.append(child)
+        xacro_macro.extend(robot_children)
         # 将 <xacro:macro> 标签添加到 <robot> 标签内
         self.root.append(xacro_macro)
         # 修改全局变量
@@ -114,18 +379,17 @@ class URDFer(object):
         self._to_xacro = True
         self._is_xacro = True
         self.handle = xacro_macro
-        self.add_prefix_var(prefix)
+        self.prefix_var = params
+        self.add_prefix_var(params)
 
     def add_prefix_var(self, name):
-        for joint in self.handle.findall("joint"):
-            parent = joint.find("parent")
-            parent.set("link", f"${{{name}}}{parent.get('link')}")
-            child = joint.find("child")
-            child.set("link", f"${{{name}}}{child.get('link')}")
-            joint.set("name", f"${{{name}}}{joint.get('name')}")
-        for link in self.handle.findall("link"):
-            link.set("name", f"${{{name}}}{link.get('name')}")
+        for joint in self.joints.values():
+            prefix_joint(joint, name)
+        for link in self.links.values():
+            prefix_link(link, name)
+        self.build_index()
 
+    @profiler.profiled()
     def split_mesh_paths(
         self,
         old_visual_path,
@@ -133,69 +397,143 @@ class URDFer(object):
         old_collision_path,
         new_collision_path,
         create_collision,
+        collision_pieces: Optional[Dict[str, List[str]]] = None,
+        collision_primitives: Optional[Dict[str, List[Optional[dict]]]] = None,
+        renamed_meshes: Optional[Dict[str, str]] = None,
     ):
-        for link in self.handle.findall("link"):
-            visuals = link.findall("visual")
-            collisions = link.findall("collision")
-
-            if len(visuals) > 0:
-                for visual in visuals:
-                    geo = visual.find("geometry")
-                    # create collision tag if it doesn't exist
-                    if len(collisions) == 0 and create_collision:
-                        collision = ET.Element("collision")
-                        collision.append(visual.find("origin"))
-                        collision.append(deepcopy(geo))
-                        link.append(collision)
-                    mesh_handle = geo.find("mesh")
-                    new_name = mesh_handle.get("filename").replace(
-                        old_visual_path, new_visual_path
-                    )
-                    mesh_handle.set("filename", new_name)
-            else:
-                print(f"There is no visual tag in {link.get('name')}")
-
-            collisions = link.findall("collision")  # update the collisions list
-            if len(collisions) > 0:
-                for collision in collisions:
-                    geo = collision.find("geometry")
-                    mesh_handle = geo.find("mesh")
-                    new_name = mesh_handle.get("filename").replace(
-                        old_collision_path, new_collision_path
-                    )
-                    mesh_handle.set("filename", new_name)
-            else:
-                print(f"There is no collision tag in {link.get('name')}")
+        """Replace the mesh paths of the visuals and collisions, creating the
+        collisions from the visuals if `create_collision`; with
+        `collision_pieces`, a collision is replaced by one per convex piece
+        of its mesh (see `split_collision_pieces`). The collisions created
+        for the visuals of a link in `collision_primitives`, {link: [fitted
+        primitive or None per visual]}, are primitives instead of meshes.
+        The mesh files in `renamed_meshes` are renamed first (see
+        `rename_link_meshes`)."""
+        for link in self.links.values():
+            split_link_mesh_paths(
+                link,
+                old_visual_path,
+                new_visual_path,
+                old_collision_path,
+                new_collision_path,
+                create_collision,
+                collision_pieces,
+                collision_primitives,
+                renamed_meshes,
+            )
 
     @staticmethod
     def format(output_path):
-        result = subprocess.run(
-            ["xmllint", "--format", output_path, "-o", output_path],
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-        )
-        return result
+        """Format an existing file in place like `xmllint --format`."""
+        xml_format.format_file(output_path)
 
-    def save(self, path=None):
+    @profiler.profiled()
+    def save(self, path=None, pretty=True):
+        """Write the tree, formatted like `xmllint --format` unless `pretty` is False.
+        Namespaces keep their original prefixes, e.g. `xacro:`."""
         path = path if path is not None else self.file_path
-        self.tree.write(path, encoding="utf-8", xml_declaration=True, method="xml")
-        if not self._to_xacro and self._is_xacro:
-            self.restore_xacro(path)
+        if pretty:
+            xml_format.write(self.root, path, self.namespaces)
+        else:
+            for uri in xml_format.collect_namespaces(self.root):
+                if uri in self.namespaces:
+                    try:
+                        ET.register_namespace(self.namespaces[uri], uri)
+                    except ValueError:
+                        pass  # reserved ns<N> prefixes
+            self.tree.write(path, encoding="utf-8", xml_declaration=True, method="xml")
+        if profiler.active():
+            profiler.count("files_written")
+            profiler.count("bytes_written", os.path.getsize(path))
 
-    def restore_xacro(self, path):
-        replace_in_file(path, ":ns0", ":xacro")
-        replace_in_file(path, "ns0:", "xacro:")
 
+MODIFY_CHOICES = ["joints_limit", "links_inertial", "all"]
 
-if __name__ == "__main__":
+
+def modify_keys(modify_list: List[str]) -> List[str]:
+    """The CONFIG keys applied by a modify list."""
+    return MODIFY_CHOICES[:-1] if "all" in modify_list else list(modify_list)
+
+
+@profiler.profiled()
+def load_config(config_path) -> Optional[dict]:
+    """Return the CONFIG dict of a declarative .json or .toml config (see
+    config_loader.py), or import the configuration .py file for it."""
+    from importlib.util import module_from_spec, spec_from_file_location
+
+    assert os.path.exists(config_path), f"Configuration file not found at {config_path}"
+    if not config_path.endswith(".py"):
+        import config_loader
+
+        return config_loader.load_config(config_path)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(config_path)))
+    module_name = os.path.basename(config_path).replace(".py", "")
+    print(f"Importing configuration file from {config_path}")
+    # load by location so that configs with the same file name do not shadow
+    # each other when several robots are converted in one process
+    spec = spec_from_file_location(module_name, config_path)
+    config = module_from_spec(spec)
+    spec.loader.exec_module(config)
+    return config.CONFIG
+
+
+@profiler.profiled()
+def convert(
+    input_path: str,
+    output_path: Optional[str] = None,
+    config: Optional[dict] = None,
+    modify_list: List[str] = (),
+    prefix: str = "prefix",
+    stream: bool = False,
+) -> str:
+    """Modify a URDF file with the CONFIG dict and save it as a formatted xacro file.
+    With `stream`, the file is converted element by element in bounded memory."""
+    output_path = (
+        input_path.replace(".urdf", ".xacro") if output_path is None else output_path
+    )
+    # initialize URDFer
+    if stream:
+        from urdf_stream import StreamingURDFer
+
+        urdfer = StreamingURDFer(input_path)
+    else:
+        urdfer = URDFer(input_path)
+    return convert_urdfer(urdfer, output_path, config, modify_list, prefix)
+
+
+def convert_urdfer(
+    urdfer: URDFer,
+    output_path: str,
+    config: Optional[dict] = None,
+    modify_list: List[str] = (),
+    prefix: str = "prefix",
+) -> str:
+    """The modifications and saving of `convert`, on a parsed URDFer."""
+    # modify URDF file
+    modify_list = modify_keys(modify_list)
+    process_dict = {
+        "joints_limit": urdfer.replace_joint_limits,
+        "links_inertial": urdfer.replace_link_inertial,
+    }
+    if config is not None:
+        for key in modify_list:
+            value = config.get(key)
+            if value is not None:
+                print(f"Modifying {key}...")
+                process_dict[key](value)
+    # change the URDF file to xacro style
+    urdfer.to_xacro_style(prefix)
+    # save modified URDF file, formatted
+    urdfer.save(output_path)
+    print(f"Output file saved to {output_path}")
+    return output_path
+
+
+def main(argv=None):
     import argparse
-    from importlib import import_module
-    import os, sys
+    import build_cache
 
     current_dir = os.path.dirname(os.path.abspath(__file__))
-    modify_choices = ["joints_limit", "links_inertial", "all"]
     parser = argparse.ArgumentParser(description="Replace joint limits in URDF file")
     parser.add_argument(
         "-in", "--input_urdf_path", type=str, help="Path to the URDF file"
@@ -211,7 +549,7 @@ if __name__ == "__main__":
         "-cfg",
         "--config_file_path",
         type=str,
-        help="Path to the configuration .py file",
+        help="Path to the configuration .py, .toml or .json file",
         default=f"{current_dir}/example_config/urdf_config.py",
     )
     parser.add_argument(
@@ -228,47 +566,50 @@ if __name__ == "__main__":
         nargs="*",
         help="List of components to modify",
         default=[],
-        choices=modify_choices,
+        choices=MODIFY_CHOICES,
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Convert element by element in bounded memory, for very large files",
     )
-    args = parser.parse_args()
+    build_cache.add_arguments(parser)
+    profiler.add_arguments(parser)
+    args = parser.parse_args(argv)
+    profiler.enable_from_args(args)
     input_path: str = args.input_urdf_path
     output_path: str = args.output_urdf_path
     config_path: str = args.config_file_path
     modify_list: list = args.modify_list
     prefix: str = args.prefix
-
     output_path = (
         input_path.replace(".urdf", ".xacro") if output_path is None else output_path
     )
 
     # import configuration file and get CONFIG dict
-    assert os.path.exists(config_path), f"Configuration file not found at {config_path}"
-    sys.path.insert(0, os.path.dirname(config_path))
-    module_name = os.path.basename(config_path).replace(".py", "")
-    print(f"Importing configuration file from {config_path}")
-    config = import_module(module_name)
-    CONFIG: Optional[dict] = config.CONFIG
+    CONFIG: Optional[dict] = load_config(config_path)
+    cache = build_cache.from_args(args)
+    if cache is not None:
+        entry = build_cache.build_entry(
+            input_path,
+            CONFIG,
+            modify_keys(modify_list),
+            prefix,
+            cache.get(output_path),
+            args.stream,
+        )
+        reasons = ["forced"] if args.force else cache.stale_reasons(output_path, entry)
+        if not reasons:
+            cache.save()
+            print(f"Up to date: {output_path}")
+            return
+        print(f"Rebuilding {output_path}: {', '.join(reasons)}")
+    convert(input_path, output_path, CONFIG, modify_list, prefix, args.stream)
+    if cache is not None:
+        cache.record(output_path, entry)
+        cache.save()
+    print("Done!")
 
-    # initialize URDFer
-    urdfer = URDFer(input_path)
-    # modify URDF file
-    modify_list = modify_choices[:-1] if "all" in modify_list else modify_list
-    process_dict = {
-        "joints_limit": urdfer.replace_joint_limits,
-        "links_inertial": urdfer.replace_link_inertial,
-    }
-    if CONFIG is not None:
-        for key in modify_list:
-            value = CONFIG.get(key)
-            if value is not None:
-                print(f"Modifying {key}...")
-                process_dict[key](value)
-    # change the URDF file to xacro style
-    urdfer.to_xacro_style(prefix)
-    # save modified URDF file
-    urdfer.save(output_path)
-    print(f"Output file saved to {output_path}")
 
-    print("Formatting the output file...")
-    urdfer.format(output_path)
-    print("Done!")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,420 @@
+import ctypes, ctypes.util
+import io
+import os, sys
+import select
+import struct
+import time
+import traceback
+from contextlib import redirect_stdout
+from typing import Dict, Iterable, List, Optional, Set
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from urdf_to_xacro import URDFer, convert_urdfer, load_config
+import batch
+import profiler
+
+"""
+Watch the URDF files and their configs and regenerate the .xacro outputs when
+they change, until interrupted with Ctrl+C.
+
+The parsed URDF trees and the loaded configs are kept in memory: saving a
+config only re-runs the modifications on a copy of the parsed trees using it,
+saving a URDF file only parses that file again. The changes are received from
+inotify on Linux, or by polling the modification times elsewhere (or with
+--poll), and the changes arriving within --debounce seconds of each other are
+rebuilt once.
+
+The config of a job is watched with the files it depends on: the files a
+.toml or .json config refers to, and the .json files next to a .py config,
+which usually loads its links_inertial.json from there.
+
+examples:
+python3 watch.py -in robot/urdf/robot.urdf -cfg urdf_config_robot/urdf_config.py -ml all
+python3 watch.py -root robots_dir -cfgd configs_dir -ml all
+python3 watch.py -manifest batch.json --poll -i 1
+"""
+
+DEFAULT_DEBOUNCE = 0.2
+DEFAULT_INTERVAL = 0.5
+
+# inotify constants, see <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+# editors often write a temporary file and rename it over the original, so the
+# directories are watched rather than the files
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class InotifyWatcher(object):
+    """Report the changed files of the watched directories with inotify."""
+
+    def __init__(self, directories: Iterable[str]) -> None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.directories: Dict[int, str] = {}
+        for directory in directories:
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+            if wd < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed: {directory}")
+            self.directories[wd] = directory
+        self.overflowed = False
+
+    def changes(self, timeout: Optional[float]) -> Set[str]:
+        """The paths changed within `timeout` seconds, waiting forever if it is
+        None. After a queue overflow all the watched files must be checked,
+        which `overflowed` tells."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        paths = set()
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset : offset + length].rstrip(b"\0")
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    self.overflowed = True
+                elif wd in self.directories and name:
+                    paths.add(os.path.join(self.directories[wd], os.fsdecode(name)))
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher(object):
+    """Report the changed files by comparing their modification times."""
+
+    def __init__(self, paths: Iterable[str], interval=DEFAULT_INTERVAL) -> None:
+        self.interval = interval
+        self.stats = {path: self._stat(path) for path in paths}
+        self.overflowed = False
+
+    @staticmethod
+    def _stat(path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def changes(self, timeout: Optional[float]) -> Set[str]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            paths = set()
+            for path, old in self.stats.items():
+                new = self._stat(path)
+                if new != old:
+                    self.stats[path] = new
+                    paths.add(path)
+            if paths:
+                return paths
+            if deadline is not None and time.monotonic() >= deadline:
+                return paths
+            wait = self.interval
+            if deadline is not None:
+                wait = min(wait, max(0.0, deadline - time.monotonic()))
+            time.sleep(wait)
+
+    def close(self):
+        pass
+
+
+def config_inputs(config_path) -> List[str]:
+    """The files a config is loaded from, itself included."""
+    import config_loader
+
+    config_path = os.path.abspath(config_path)
+    if not config_path.endswith(".py"):
+        return config_loader.config_dependencies(config_path)
+    # a .py config may read anything, its .json files are a good guess
+    config_dir = os.path.dirname(config_path)
+    return [config_path] + [
+        os.path.join(config_dir, name)
+        for name in sorted(os.listdir(config_dir))
+        if name.endswith(".json")
+    ]
+
+
+class Watcher(object):
+    """The jobs of batch.py, with their parsed URDF files and loaded configs
+    kept in memory, rebuilt when their inputs change."""
+
+    def __init__(self, jobs: List[dict]) -> None:
+        self.jobs = jobs
+        for job in jobs:
+            job["input"] = os.path.abspath(job["input"])
+            if job["config"] is not None:
+                job["config"] = os.path.abspath(job["config"])
+            if job["output"] is None:
+                job["output"] = job["input"].replace(".urdf", ".xacro")
+        self.urdfers: Dict[str, URDFer] = {}
+        self.configs: Dict[str, dict] = {}
+        # watched path: URDF or config paths to reload when it changes
+        self.inputs: Dict[str, Set[str]] = {}
+        self.update_inputs()
+
+    def update_inputs(self):
+        self.inputs = {}
+        for job in self.jobs:
+            self.inputs.setdefault(job["input"], set()).add(job["input"])
+            if job["config"] is not None:
+                try:
+                    paths = config_inputs(job["config"])
+                except Exception:
+                    # an invalid config is watched alone until it is fixed
+                    paths = [job["config"]]
+                for path in paths:
+                    self.inputs.setdefault(path, set()).add(job["config"])
+
+    def watched_paths(self) -> List[str]:
+        return sorted(self.inputs)
+
+    def reload(self, paths: Set[str]) -> Set[str]:
+        """Parse or load the changed URDF files and configs again, return the
+        ones failing, which are reported and forgotten."""
+        for path in paths:
+            self.urdfers.pop(path, None)
+            self.configs.pop(path, None)
+        failed = set()
+        for job in self.jobs:
+            for path, cache, load in (
+                (job["input"], self.urdfers, URDFer),
+                (job["config"], self.configs, load_config),
+            ):
+                if path is None or path in cache or path in failed:
+                    continue
+                log = io.StringIO()
+                try:
+                    with redirect_stdout(log):
+                        cache[path] = load(path)
+                except Exception as e:
+                    failed.add(path)
+                    print(f"Failed to load {path}: {type(e).__name__}: {e}")
+        return failed
+
+    @profiler.profiled("rebuild")
+    def rebuild(self, changed: Optional[Set[str]] = None) -> List[dict]:
+        """Rebuild the jobs using the changed paths, or all of them."""
+        if changed is None:
+            reloaded = {job["input"] for job in self.jobs}
+            reloaded |= {job["config"] for job in self.jobs if job["config"]}
+        else:
+            reloaded = set()
+            for path in changed:
+                reloaded |= self.inputs.get(path, set())
+        failed = self.reload(reloaded)
+        results = []
+        for job in self.jobs:
+            if job["input"] not in reloaded and job["config"] not in reloaded:
+                continue
+            if job["input"] in failed or job["config"] in failed:
+                continue
+            results.append(self.build(job))
+        # the files a config refers to may have changed
+        if any(path.endswith((".toml", ".json")) for path in reloaded):
+            self.update_inputs()
+        return results
+
+    def build(self, job: dict) -> dict:
+        result = {"input": job["input"], "output": job["output"], "ok": False}
+        log = io.StringIO()
+        start = time.perf_counter()
+        try:
+            with redirect_stdout(log):
+                convert_urdfer(
+                    self.urdfers[job["input"]].copy(),
+                    job["output"],
+                    self.configs.get(job["config"]),
+                    job["modify_list"],
+                    job["prefix"],
+                )
+            result["ok"] = True
+        except Exception as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+            log.write(traceback.format_exc())
+        result["seconds"] = time.perf_counter() - start
+        result["log"] = log.getvalue()
+        profiler.count("builds")
+        return result
+
+
+def open_watcher(paths: List[str], poll=False, interval=DEFAULT_INTERVAL):
+    if not poll and sys.platform.startswith("linux"):
+        try:
+            directories = sorted({os.path.dirname(path) for path in paths})
+            return InotifyWatcher(directories)
+        except (OSError, AttributeError) as e:
+            print(f"inotify unavailable ({e}), polling instead")
+    return PollingWatcher(paths, interval)
+
+
+def print_results(results: List[dict], reason: str):
+    stamp = time.strftime("%H:%M:%S")
+    for result in results:
+        if result["ok"]:
+            print(
+                f"[{stamp}] Rebuilt {result['output']} in "
+                f"{result['seconds'] * 1000:.1f} ms ({reason})"
+            )
+        else:
+            print(f"[{stamp}] FAILED {result['input']}: {result['error']}")
+
+
+def watch(
+    jobs: List[dict],
+    debounce=DEFAULT_DEBOUNCE,
+    poll=False,
+    interval=DEFAULT_INTERVAL,
+):
+    watcher = Watcher(jobs)
+    print_results(watcher.rebuild(), "start")
+    paths = watcher.watched_paths()
+    events = open_watcher(paths, poll, interval)
+    print(f"Watching {len(paths)} files of {len(jobs)} URDF files, Ctrl+C to stop")
+    try:
+        while True:
+            changed = events.changes(None)
+            # wait until the changes settle down
+            while True:
+                more = events.changes(debounce)
+                if not more:
+                    break
+                changed |= more
+            if events.overflowed:
+                events.overflowed = False
+                changed = set(watcher.inputs)
+            changed &= set(watcher.inputs)
+            if not changed:
+                continue
+            names = sorted(os.path.basename(path) for path in changed)
+            print_results(watcher.rebuild(changed), f"{', '.join(names)} changed")
+            if watcher.watched_paths() != paths:
+                # a config now refers to other files
+                events.close()
+                paths = watcher.watched_paths()
+                events = open_watcher(paths, poll, interval)
+    except KeyboardInterrupt:
+        print("Stopped watching")
+    finally:
+        events.close()
+
+
+def main(argv=None):
+    import argparse
+    from urdf_to_xacro import MODIFY_CHOICES
+
+    parser = argparse.ArgumentParser(
+        description="Regenerate the xacro files when the URDF files or configs change"
+    )
+    parser.add_argument(
+        "-in", "--input_urdf_path", type=str, nargs="+", help="Paths to URDF files"
+    )
+    parser.add_argument(
+        "-root",
+        "--root_dir",
+        type=str,
+        help="Directory searched recursively for .urdf files",
+        default=None,
+    )
+    parser.add_argument(
+        "-manifest",
+        "--manifest_path",
+        type=str,
+        help="Path to a .json file listing the conversions, see batch.py",
+        default=None,
+    )
+    parser.add_argument(
+        "-cfg",
+        "--config_file_path",
+        type=str,
+        help="Configuration file used for all the URDF files",
+        default=None,
+    )
+    parser.add_argument(
+        "-cfgd",
+        "--configs_dir",
+        type=str,
+        help="Directory containing urdf_config_<name>/urdf_config.{toml,json,py} for each <name>.urdf",
+        default=None,
+    )
+    parser.add_argument(
+        "-p",
+        "--prefix",
+        type=str,
+        help="The prefix to add to the joint and link names",
+        default="prefix",
+    )
+    parser.add_argument(
+        "-ml",
+        "--modify_list",
+        type=str,
+        nargs="*",
+        help="List of components to modify",
+        default=[],
+        choices=MODIFY_CHOICES,
+    )
+    parser.add_argument(
+        "-d",
+        "--debounce",
+        type=float,
+        help="Seconds without changes to wait for before rebuilding",
+        default=DEFAULT_DEBOUNCE,
+    )
+    parser.add_argument(
+        "--poll", action="store_true", help="Poll the files instead of using inotify"
+    )
+    parser.add_argument(
+        "-i",
+        "--interval",
+        type=float,
+        help="Seconds between two polls of the files",
+        default=DEFAULT_INTERVAL,
+    )
+    profiler.add_arguments(parser)
+    args = parser.parse_args(argv)
+    profiler.enable_from_args(args)
+
+    if args.manifest_path is not None:
+        jobs = batch.jobs_from_manifest(args.manifest_path)
+    elif args.root_dir is not None:
+        jobs = batch.jobs_from_directory(
+            args.root_dir,
+            args.config_file_path,
+            args.configs_dir,
+            args.modify_list,
+            args.prefix,
+        )
+    else:
+        assert (
+            args.input_urdf_path
+        ), "One of --input_urdf_path, --root_dir or --manifest_path is required"
+        jobs = []
+        for path in args.input_urdf_path:
+            config_path = args.config_file_path
+            if args.configs_dir is not None:
+                config_path = batch.find_config(path, args.configs_dir) or config_path
+            jobs.append(
+                batch.make_job(path, config_path, None, args.modify_list, args.prefix)
+            )
+    watch(jobs, args.debounce, args.poll, args.interval)
+
+
+if __name__ == "__main__":
+    main()
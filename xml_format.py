@@ -0,0 +1,303 @@
+import re
+import xml.etree.ElementTree as ET
+from typing import Dict, Iterator, List, Optional
+
+"""
+Serialize ElementTree elements the way `xmllint --format` does, so that files
+are written formatted in one pass without spawning xmllint.
+
+examples:
+python3 xml_format.py robot.urdf
+python3 xml_format.py robot.xacro -out formatted.xacro
+"""
+
+INDENT = "  "
+DECLARATION = '<?xml version="1.0" encoding="utf-8"?>\n'
+_DECLARATION = re.compile(rb"^(?:\xef\xbb\xbf)?(<\?xml\s.*?\?>)", re.S)
+_ENCODING = re.compile(r"""\sencoding\s*=\s*["']([A-Za-z0-9._-]+)["']""")
+
+
+def escape_text(text: str) -> str:
+    return (
+        text.replace("&", "&amp;")
+        .replace("<", "&lt;")
+        .replace(">", "&gt;")
+        .replace("\r", "&#13;")
+    )
+
+
+def escape_attrib(value: str) -> str:
+    return (
+        value.replace("&", "&amp;")
+        .replace("<", "&lt;")
+        .replace(">", "&gt;")
+        .replace('"', "&quot;")
+        .replace("\n", "&#10;")
+        .replace("\r", "&#13;")
+        .replace("\t", "&#9;")
+    )
+
+
+def _is_blank(text: Optional[str]) -> bool:
+    return text is None or text.strip() == ""
+
+
+def collect_namespaces(
+    root: ET.Element, namespaces: Optional[Dict[str, str]] = None
+) -> Dict[str, str]:
+    """Return a {uri: prefix} map covering all the namespaces used in the tree,
+    taking the prefixes from `namespaces` and naming the others ns0, ns1..."""
+    known = {} if namespaces is None else namespaces
+    nsmap: Dict[str, str] = {}
+
+    def add(name):
+        if isinstance(name, str) and name[:1] == "{":
+            uri = name[1 : name.index("}")]
+            if uri not in nsmap:
+                nsmap[uri] = known.get(uri, f"ns{len(nsmap)}")
+
+    for element in root.iter():
+        add(element.tag)
+        for key in element.keys():
+            add(key)
+    return nsmap
+
+
+def qualify(name: str, nsmap: Dict[str, str]) -> str:
+    if name[:1] == "{":
+        uri, local = name[1:].split("}", 1)
+        prefix = nsmap[uri]
+        return f"{prefix}:{local}" if prefix else local
+    return name
+
+
+def start_tag(
+    element: ET.Element,
+    nsmap: Dict[str, str],
+    declare: Optional[Dict[str, str]] = None,
+    close=False,
+) -> str:
+    """Open tag of the element, with the namespace declarations of `declare`
+    first as xmllint puts them."""
+    attributes = []
+    literal = [(k, v) for k, v in element.items() if k.startswith("xmlns")]
+    for uri, prefix in (declare or {}).items():
+        name = f"xmlns:{prefix}" if prefix else "xmlns"
+        if name not in element.attrib:
+            attributes.append(f'{name}="{escape_attrib(uri)}"')
+    attributes.extend(f'{k}="{escape_attrib(v)}"' for k, v in literal)
+    attributes.extend(
+        f'{qualify(k, nsmap)}="{escape_attrib(v)}"'
+        for k, v in element.items()
+        if not k.startswith("xmlns")
+    )
+    tag = qualify(element.tag, nsmap)
+    head = " ".join([tag] + attributes)
+    return f"<{head}/>" if close else f"<{head}>"
+
+
+def end_tag(element: ET.Element, nsmap: Dict[str, str]) -> str:
+    return f"</{qualify(element.tag, nsmap)}>"
+
+
+def _inline(element: ET.Element, nsmap: Dict[str, str]) -> Iterator[str]:
+    """Serialize the element as is, inside mixed content."""
+    if element.tag is ET.Comment:
+        yield f"<!--{element.text}-->"
+    elif element.tag is ET.ProcessingInstruction:
+        yield f"<?{element.text}?>"
+    elif element.text is None and len(element) == 0:
+        yield start_tag(element, nsmap, close=True)
+    else:
+        yield start_tag(element, nsmap)
+        if element.text:
+            yield escape_text(element.text)
+        for child in element:
+            yield from _inline(child, nsmap)
+            if child.tail:
+                yield escape_text(child.tail)
+        yield end_tag(element, nsmap)
+
+
+def iter_formatted(
+    element: ET.Element,
+    nsmap: Dict[str, str],
+    level=0,
+    declare: Optional[Dict[str, str]] = None,
+) -> Iterator[str]:
+    """Yield the formatted lines of the element indented at `level`, the
+    element tail excluded."""
+    indent = INDENT * level
+    if element.tag is ET.Comment or element.tag is ET.ProcessingInstruction:
+        yield indent + "".join(_inline(element, nsmap)) + "\n"
+        return
+    if len(element) == 0:
+        if element.text is None or element.text == "":
+            yield indent + start_tag(element, nsmap, declare, close=True) + "\n"
+        else:
+            yield (
+                indent
+                + start_tag(element, nsmap, declare)
+                + escape_text(element.text)
+                + end_tag(element, nsmap)
+                + "\n"
+            )
+        return
+    mixed = not _is_blank(element.text) or any(
+        not _is_blank(child.tail) for child in element
+    )
+    if mixed:
+        # xmllint keeps the content as is once there is text among the children
+        parts = [start_tag(element, nsmap, declare)]
+        if element.text:
+            parts.append(escape_text(element.text))
+        for child in element:
+            parts.extend(_inline(child, nsmap))
+            if child.tail:
+                parts.append(escape_text(child.tail))
+        parts.append(end_tag(element, nsmap))
+        yield indent + "".join(parts) + "\n"
+        return
+    yield indent + start_tag(element, nsmap, declare) + "\n"
+    for child in element:
+        yield from iter_formatted(child, nsmap, level + 1)
+    yield indent + end_tag(element, nsmap) + "\n"
+
+
+def tostring(
+    root: ET.Element,
+    namespaces: Optional[Dict[str, str]] = None,
+    document: Optional[dict] = None,
+) -> str:
+    """The formatted file of the tree, with the declaration and the comments
+    and processing instructions around the root of `document` (see
+    `parse_document`) if given."""
+    nsmap = collect_namespaces(root, namespaces)
+    document = {} if document is None else document
+    lines = [document.get("declaration", DECLARATION.rstrip("\n")) + "\n"]
+    for element in document.get("prolog", []):
+        lines.extend(iter_formatted(element, nsmap))
+    lines.extend(iter_formatted(root, nsmap, declare=nsmap))
+    for element in document.get("epilog", []):
+        lines.extend(iter_formatted(element, nsmap))
+    return "".join(lines)
+
+
+def write(
+    root: ET.Element,
+    path,
+    namespaces: Optional[Dict[str, str]] = None,
+    document: Optional[dict] = None,
+) -> None:
+    """Write the tree formatted like `xmllint --format` in one write, in the
+    encoding of the declaration of `document`, UTF-8 by default."""
+    encoding = "utf-8"
+    if document is not None and "declaration" in document:
+        match = _ENCODING.search(document["declaration"])
+        encoding = match.group(1) if match else encoding
+    text = tostring(root, namespaces, document)
+    with open(path, "w", encoding=encoding, errors="xmlcharrefreplace") as file:
+        file.write(text)
+
+
+class _TreeBuilder(ET.TreeBuilder):
+    """Tree builder recording the namespace prefixes, and the comments and
+    processing instructions before and after the root element, which
+    ElementTree drops."""
+
+    def __init__(self, comments=True) -> None:
+        super().__init__(insert_comments=comments, insert_pis=comments)
+        self.comments = comments
+        self.namespaces: Dict[str, str] = {}
+        self.prolog: List[ET.Element] = []
+        self.epilog: List[ET.Element] = []
+        self._depth = 0
+        self._root_closed = False
+
+    def start_ns(self, prefix, uri):
+        self.namespaces.setdefault(uri, prefix)
+
+    def start(self, tag, attrs):
+        self._depth += 1
+        return super().start(tag, attrs)
+
+    def end(self, tag):
+        self._depth -= 1
+        self._root_closed = self._depth == 0
+        return super().end(tag)
+
+    def _outside(self, element: ET.Element) -> ET.Element:
+        if self.comments and self._depth == 0:
+            (self.epilog if self._root_closed else self.prolog).append(element)
+        return element
+
+    def comment(self, text):
+        return self._outside(super().comment(text))
+
+    def pi(self, target, text=None):
+        return self._outside(super().pi(target, text))
+
+
+def _parse(path, comments) -> tuple:
+    builder = _TreeBuilder(comments)
+    parser = ET.XMLParser(target=builder)
+    with open(path, "rb") as file:
+        head = file.read(1 << 16)
+        declaration = _DECLARATION.match(head)
+        chunk = head
+        while chunk:
+            parser.feed(chunk)
+            chunk = file.read(1 << 16)
+    return parser.close(), builder, declaration
+
+
+def parse(path, comments=True):
+    """Parse an XML file and return the root element with the {uri: prefix}
+    map of the declared namespaces, so that they can be written back with
+    the same prefixes. Comments inside the root element are kept if
+    `comments` is True."""
+    root, builder, _ = _parse(path, comments)
+    return root, builder.namespaces
+
+
+def parse_document(path):
+    """Like `parse`, comments kept, also returning the document around the
+    root: {"declaration": the XML declaration as written, or the one xmllint
+    adds, "prolog" and "epilog": the comments and processing instructions
+    before and after the root element}."""
+    root, builder, declaration = _parse(path, True)
+    document = {
+        "declaration": '<?xml version="1.0"?>',
+        "prolog": builder.prolog,
+        "epilog": builder.epilog,
+    }
+    if declaration is not None:
+        document["declaration"] = declaration.group(1).decode("ascii", "replace")
+    return root, builder.namespaces, document
+
+
+def format_file(path, output_path=None) -> None:
+    """Format an XML file in place (or into `output_path`), keeping its
+    declaration, comments, processing instructions and namespace prefixes."""
+    root, namespaces, document = parse_document(path)
+    write(root, path if output_path is None else output_path, namespaces, document)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Format XML files like xmllint")
+    parser.add_argument("path", type=str, help="Path to the XML file")
+    parser.add_argument(
+        "-out",
+        "--output_path",
+        type=str,
+        help="Path to the formatted file, defaults to formatting in place",
+        default=None,
+    )
+    args = parser.parse_args(argv)
+    format_file(args.path, args.output_path)
+
+
+if __name__ == "__main__":
+    main()